@@ -8,6 +8,7 @@ from shared.database import get_db
 from shared.email_client import EmailClient
 from shared.email_client_factory import EmailClientFactory
 from shared.storage_manager import StorageManager
+from shared.storage_manager_factory import StorageManagerFactory
 from config import get_settings
 from api.services.subscription_service import SubscriptionService
 from api.services.template_service import TemplateService
@@ -47,7 +48,13 @@ def get_storage_manager() -> StorageManager:
     '''Get storage manager singleton.'''
     global _storage_manager
     if _storage_manager is None:
-        _storage_manager = StorageManager()
+        settings = get_settings()
+        _storage_manager = StorageManagerFactory.create(
+            settings.storage_mode,
+            settings.storage_compression,
+            segment_bytes=settings.storage_segment_bytes,
+            compact_interval=settings.storage_compact_interval
+        )
     return _storage_manager
 
 def get_templates() -> Jinja2Templates:
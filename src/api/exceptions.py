@@ -6,6 +6,7 @@ class ErrorCode(str, Enum):
     SUBSCRIPTION_ALREADY_ACTIVE = 'SUBSCRIPTION_ALREADY_ACTIVE'
     INVALID_CALENDAR_URL = 'INVALID_CALENDAR_URL'
     INVALID_ICAL_DOCUMENT = 'INVALID_ICAL_DOCUMENT'
+    CALENDAR_HOST_BUSY = 'CALENDAR_HOST_BUSY'
     NOTIFICATIONS_ALREADY_PAUSED = 'NOTIFICATIONS_ALREADY_PAUSED'
     NOTIFICATIONS_ALREADY_ACTIVE = 'NOTIFICATIONS_ALREADY_ACTIVE'
     RATE_LIMIT_EXCEEDED = 'RATE_LIMIT_EXCEEDED'
@@ -47,6 +48,10 @@ class InvalidCalendarUrlError(LocalizedHTTPException):
     def __init__(self, message: str | None = None):
         super().__init__(400, ErrorCode.INVALID_CALENDAR_URL, {'message': message})
 
+class CalendarHostBusyError(LocalizedHTTPException):
+    def __init__(self):
+        super().__init__(503, ErrorCode.CALENDAR_HOST_BUSY)
+
 class RateLimitExceededError(LocalizedHTTPException):
     def __init__(self, retry_after_minutes: int):
         super().__init__(
@@ -1,5 +1,7 @@
 from fastapi import APIRouter, Body, Depends, HTTPException, status
 import logging
+from datetime import timedelta
+from sqlalchemy.orm import Session
 from api.dependencies import (
     SubscriptionService,
     get_subscription_service,
@@ -7,6 +9,10 @@ from api.dependencies import (
     require_component_enabled,
 )
 from api.schemas import SubscriptionResponse
+from api.exceptions import CalendarHostBusyError
+from shared.database import get_db
+from shared.crud import _now, cap_next_check_times, create_audit_log
+from worker.dependencies import get_polling_policy
 
 logger = logging.getLogger(__name__)
 router = APIRouter(prefix='/admin', tags=['admin'])
@@ -22,8 +28,10 @@ async def admin_subscribe_by_url(
     '''Admin API: Add subscription by calendar URL (activated by default).'''
     logger.info(f'API subscribe request with {q[:30]}... in language {language}')
     try:
-        email = subscription_service.create_subscription_from_url(q, language, activated=True)
+        email = await subscription_service.create_subscription_from_url(q, language, activated=True)
         return SubscriptionResponse(status='ok', email=email)
+    except CalendarHostBusyError:
+        raise
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
@@ -105,3 +113,51 @@ async def admin_get_all_info(subscription_service: SubscriptionService = Depends
         return info
     except Exception as e:
         raise HTTPException(status_code=status.HTTP_500_INTERNAL_SERVER_ERROR, detail=str(e))
+
+@router.get('/polling',
+            dependencies=[Depends(verify_notifer_token), require_component_enabled('admin_api_enabled')])
+async def admin_get_polling():
+    '''Get adaptive polling bounds and the active override, if any.'''
+    policy = get_polling_policy()
+    override = policy.get_override()
+    return {
+        'min_interval': policy.min_interval,
+        'max_interval': policy.max_interval,
+        'override_min_interval': policy.override_min_interval,
+        'override': None if override is None else {'interval': override[0], 'until': override[1]},
+    }
+
+@router.post('/polling/override',
+             dependencies=[Depends(verify_notifer_token), require_component_enabled('admin_api_enabled')])
+async def admin_set_polling_override(
+    interval: int = Body(..., embed=True),
+    hours: float = Body(..., embed=True),
+    db: Session = Depends(get_db)
+):
+    '''
+    Poll every subscription at least every `interval` seconds for the next `hours` hours (e.g. exam periods).
+
+    Intervals below POLL_OVERRIDE_MIN_INTERVAL are raised to it; the response carries the interval in effect.
+    '''
+    if interval <= 0 or hours <= 0:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail='Interval and hours must be positive')
+
+    policy = get_polling_policy()
+    policy.set_override(db, interval, _now() + timedelta(hours=hours))
+    interval, until = policy.get_override() or (interval, None)
+
+    # Pull in subscriptions scheduled further out than the new ceiling, spread over the interval rather than all at its end
+    now = _now()
+    rescheduled = cap_next_check_times(db, now, now + timedelta(seconds=interval))
+    create_audit_log(db, 'polling_override_set', details=f'interval={interval}s until={until}')
+    db.commit()
+    return {"status": "ok", "action": "override_set", "interval": interval, "until": until, "rescheduled": rescheduled}
+
+@router.post('/polling/clear',
+             dependencies=[Depends(verify_notifer_token), require_component_enabled('admin_api_enabled')])
+async def admin_clear_polling_override(db: Session = Depends(get_db)):
+    '''Return to the adaptive polling intervals.'''
+    get_polling_policy().clear_override(db)
+    create_audit_log(db, 'polling_override_cleared')
+    db.commit()
+    return {"status": "ok", "action": "override_cleared"}
@@ -38,6 +38,8 @@ _ACTION_TYPES = [
     'subscription_deleted',
     'email_queued',
     'notification_queued',
+    'polling_override_set',
+    'polling_override_cleared',
 ]
 
 
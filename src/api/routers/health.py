@@ -3,8 +3,10 @@ import logging
 from fastapi import APIRouter, Depends
 from datetime import datetime, timezone
 from api.dependencies import verify_notifer_token
-from worker.dependencies import get_worker_service
+from worker.dependencies import get_worker_service, get_calendar_service
 from shared.email_client import get_email_queue_size
+from shared.http_client import get_connection_stats
+from shared.host_limiter import get_host_limiter_stats
 from shared.crud import (
     db_healthcheck,
     get_total_subscription_count_no_session,
@@ -63,14 +65,18 @@ async def detailed_health_check():
 @router.get('/stats', dependencies=[Depends(verify_notifer_token)])
 async def stats():
     worker_service = get_worker_service()
+    calendar_service = get_calendar_service()
     
-    # Convert worker_last_cycle to human-readable format
+    # Convert worker_last_cycle and worker_last_batch to human-readable format
     worker_last_cycle_readable = None
     if worker_service.worker_last_cycle:
         worker_last_cycle_readable = datetime.fromtimestamp(
             worker_service.worker_last_cycle, 
             timezone.utc
         ).isoformat()
+    worker_last_batch_readable = None
+    if worker_service.worker_last_batch:
+        worker_last_batch_readable = datetime.fromtimestamp(worker_service.worker_last_batch, timezone.utc).isoformat()
     
     return {
         'timestamp': datetime.now(timezone.utc).isoformat(),
@@ -81,8 +87,27 @@ async def stats():
         'worker_cycles_total': worker_service.worker_cycles_total,
         'worker_cycle_duration': worker_service.worker_cycle_duration,
         'worker_last_cycle': worker_last_cycle_readable,
+        'worker_batches_total': worker_service.worker_batches_total,
+        'worker_batch_duration': worker_service.worker_batch_duration,
+        'worker_last_batch': worker_last_batch_readable,
         'subscriptions_processed': worker_service.subscriptions_processed,
         'calendar_fetches': worker_service.calendar_fetches,
         'calendar_fetch_duration': worker_service.calendar_fetch_duration,
+        'calendar_not_modified': worker_service.calendar_not_modified,
+        'calendar_hash_hits': worker_service.calendar_hash_hits,
+        'calendar_full_path': worker_service.calendar_full_path,
+        'calendar_canonical_matches': worker_service.calendar_canonical_matches,
+        'calendar_no_differences': worker_service.calendar_no_differences,
+        'calendar_diff_memo_hits': worker_service.calendar_diff_memo_hits,
+        'fetch_retries': worker_service.fetch_retries_total,
         'emails_queued': worker_service.emails_queued,
+        'http_connections': get_connection_stats(),
+        'host_limits': get_host_limiter_stats(),
+        'parsed_calendar_cache': calendar_service.parsed_cache.stats(),
+        'block_cache': calendar_service.block_cache.stats(),
+        'diff_memo': calendar_service.diff_memo.stats(),
+        'storage_cache': calendar_service.storage_manager.cache.stats(),
+        'storage_backend': calendar_service.storage_manager.stats(),
+        'previous_loader': calendar_service.previous_loader.stats() if calendar_service.previous_loader else None,
+        'change_index': calendar_service.change_index.stats() if calendar_service.change_index else None,
     }
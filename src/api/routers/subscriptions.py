@@ -50,7 +50,7 @@ async def subscribe(
         _rate_limit: RateLimiter = Depends(rate_limit_dependency)
 ):
     logger.info(f'Subscription request: {q[:30]}..., language: {language}')
-    email = subscription_service.create_subscription_from_url(q, language)
+    email = await subscription_service.create_subscription_from_url(q, language)
     email_service.send_activation_email(email, language, db=subscription_service.db)
 
     logger.info(f'Subscritpion created: {email} with language: {language}')
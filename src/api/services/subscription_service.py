@@ -1,6 +1,8 @@
 import logging
 from sqlalchemy.orm import Session
+from starlette.concurrency import run_in_threadpool
 from shared.calendar_utils import parse_calendar_url, is_valid_ical_url
+from shared.host_limiter import HostBusyError
 from shared.token_utils import decode_token, TokenExpiredError, TokenValidationError
 from shared.crud import (
     create_subscription,
@@ -13,6 +15,7 @@ from shared.crud import (
 )
 from api.exceptions import (
     InvalidCalendarUrlError,
+    CalendarHostBusyError,
     SubscriptionAlreadyActiveError,
     SubscriptionNotFoundError,
     NotificationsAlreadyPausedError,
@@ -30,7 +33,7 @@ class SubscriptionService:
     def username_to_email(self, username: str) -> str:
         return f'{username}@{self.recipient_domain}'
 
-    def create_subscription_from_url(self, calendar_url: str, language: str = 'hr', activated: bool = False) -> str:
+    async def create_subscription_from_url(self, calendar_url: str, language: str = 'hr', activated: bool = False) -> str:
         '''Create subscirption from calendar URL and return email.'''
         try:
             parsed_url = parse_calendar_url(calendar_url)
@@ -38,7 +41,13 @@ class SubscriptionService:
             logger.error(f'Invalid calendar URL: {e}')
             raise InvalidCalendarUrlError(str(e))
         
-        if not is_valid_ical_url(calendar_url):
+        # The fetch blocks for up to the request timeout, so keep it off the event loop
+        try:
+            valid = await run_in_threadpool(is_valid_ical_url, calendar_url)
+        except HostBusyError as e:
+            logger.warning(f'Calendar host busy, subscription not validated: {e}')
+            raise CalendarHostBusyError()
+        if not valid:
             logger.error(f'Invalid iCal URL: {calendar_url}')
             raise InvalidCalendarUrlError('Invalid iCal at URL.')
         
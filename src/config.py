@@ -55,11 +55,179 @@ class Settings(BaseSettings):
     def max_workers(self) -> int:
         return int(os.getenv('MAX_WORKERS', '10'))
 
+    @property
+    def worker_mode(self) -> str:
+        return os.getenv('WORKER_MODE', 'thread').lower()
+
+    @property
+    def async_max_concurrency(self) -> int:
+        return int(os.getenv('ASYNC_MAX_CONCURRENCY', '200'))
+
+    @property
+    def worker_schedule(self) -> str:
+        return os.getenv('WORKER_SCHEDULE', 'due').lower()
+
+    @property
+    def poll_min_interval(self) -> int:
+        return int(os.getenv('POLL_MIN_INTERVAL', '900'))
+
+    @property
+    def poll_override_min_interval(self) -> int:
+        return int(os.getenv('POLL_OVERRIDE_MIN_INTERVAL', '300'))
+
+    @property
+    def poll_max_interval(self) -> int:
+        return int(os.getenv('POLL_MAX_INTERVAL', '21600'))
+
+    @property
+    def scheduler_batch_size(self) -> int:
+        return int(os.getenv('SCHEDULER_BATCH_SIZE', '50'))
+
+    @property
+    def scheduler_jitter(self) -> float:
+        return float(os.getenv('SCHEDULER_JITTER', '0.1'))
+
+    @property
+    def scheduler_max_sleep(self) -> float:
+        return float(os.getenv('SCHEDULER_MAX_SLEEP', '60'))
+
+    @property
+    def fetch_retries(self) -> int:
+        return int(os.getenv('FETCH_RETRIES', '3'))
+
+    @property
+    def fetch_retry_backoff(self) -> float:
+        return float(os.getenv('FETCH_RETRY_BACKOFF', '30'))
+
     # Calendar configuration
     @property
     def base_calendar_url(self) -> str:
         return os.getenv('BASE_CALENDAR_URL', 'https://www.fer.unizg.hr/_download/calevent/mycal.ics')
 
+    @property
+    def max_calendar_bytes(self) -> int:
+        return int(os.getenv('MAX_CALENDAR_BYTES', str(5 * 1024 * 1024)))
+
+    @property
+    def hash_mode(self) -> str:
+        return os.getenv('HASH_MODE', 'raw').lower()
+
+    @property
+    def ical_parser(self) -> str:
+        return os.getenv('ICAL_PARSER', 'icalendar').lower()
+
+    @property
+    def diff_engine(self) -> str:
+        return os.getenv('DIFF_ENGINE', 'summary').lower()
+
+    @property
+    def diff_horizon_days(self) -> int:
+        return int(os.getenv('DIFF_HORIZON_DAYS', '0'))
+
+    @property
+    def exam_keywords(self) -> tuple[str, ...]:
+        keywords = os.getenv('EXAM_KEYWORDS', 'ispit,kolokvij,exam')
+        return tuple(keyword.strip().lower() for keyword in keywords.split(',') if keyword.strip())
+
+    @property
+    def parse_pool_size(self) -> int:
+        return int(os.getenv('PARSE_POOL_SIZE', '0'))
+
+    @property
+    def parse_pool_max_tasks(self) -> int:
+        return int(os.getenv('PARSE_POOL_MAX_TASKS', '100'))
+
+    @property
+    def parsed_calendar_cache_size(self) -> int:
+        return int(os.getenv('PARSED_CALENDAR_CACHE_SIZE', '256'))
+
+    @property
+    def block_cache_size(self) -> int:
+        return int(os.getenv('BLOCK_CACHE_SIZE', '50000'))
+
+    @property
+    def change_index_size(self) -> int:
+        return int(os.getenv('CHANGE_INDEX_SIZE', '2048'))
+
+    @property
+    def diff_memo_size(self) -> int:
+        return int(os.getenv('DIFF_MEMO_SIZE', '1024'))
+
+    @property
+    def diff_memo_ttl(self) -> int:
+        return int(os.getenv('DIFF_MEMO_TTL', '3600'))
+
+    # Calendar storage configuration
+    @property
+    def storage_mode(self) -> str:
+        return os.getenv('STORAGE_MODE', 'plain').lower()
+
+    @property
+    def storage_compression(self) -> str:
+        return os.getenv('STORAGE_COMPRESSION', 'gzip').lower()
+
+    @property
+    def storage_segment_bytes(self) -> int:
+        return int(os.getenv('STORAGE_SEGMENT_BYTES', '67108864'))
+
+    @property
+    def storage_compact_interval(self) -> float:
+        return float(os.getenv('STORAGE_COMPACT_INTERVAL', '600'))
+
+    @property
+    def storage_cache_bytes(self) -> int:
+        return int(os.getenv('STORAGE_CACHE_BYTES', '134217728'))
+
+    @property
+    def storage_cache_warm(self) -> bool:
+        return os.getenv('STORAGE_CACHE_WARM', 'true').lower() == 'true'
+
+    # HTTP client configuration
+    @property
+    def http_pool_size(self) -> int:
+        return int(os.getenv('HTTP_POOL_SIZE', '20'))
+
+    @property
+    def http_keepalive_expiry(self) -> float:
+        return float(os.getenv('HTTP_KEEPALIVE_EXPIRY', '60'))
+
+    @property
+    def http_dns_cache_ttl(self) -> float:
+        return float(os.getenv('HTTP_DNS_CACHE_TTL', '300'))
+
+    @property
+    def http2_enabled(self) -> bool:
+        return os.getenv('HTTP2', 'false').lower() == 'true'
+
+    # Per-host limits for outgoing requests, shared by the API and the worker
+    @property
+    def host_min_concurrency(self) -> int:
+        return int(os.getenv('HOST_MIN_CONCURRENCY', '1'))
+
+    @property
+    def host_max_concurrency(self) -> int:
+        return int(os.getenv('HOST_MAX_CONCURRENCY', '10'))
+
+    @property
+    def host_min_interval(self) -> float:
+        return float(os.getenv('HOST_MIN_INTERVAL', '0'))
+
+    @property
+    def host_max_interval(self) -> float:
+        return float(os.getenv('HOST_MAX_INTERVAL', '5'))
+
+    @property
+    def host_target_latency(self) -> float:
+        return float(os.getenv('HOST_TARGET_LATENCY', '2'))
+
+    @property
+    def host_max_retry_after(self) -> float:
+        return float(os.getenv('HOST_MAX_RETRY_AFTER', '300'))
+
+    @property
+    def host_acquire_timeout(self) -> float:
+        return float(os.getenv('HOST_ACQUIRE_TIMEOUT', '30'))
+
     # Rate Limiting
     @property
     def global_rate_limit(self) -> int:
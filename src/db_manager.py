@@ -1,8 +1,10 @@
 import sys
 import logging
-from sqlalchemy import MetaData, text
+from sqlalchemy import MetaData, inspect, literal, text
 from .shared.database import engine, Base
 from .shared.encryption import get_fernet
+from .shared.storage_manager_factory import StorageManagerFactory
+from .config import get_settings
 
 logger = logging.getLogger(__name__)
 
@@ -88,6 +90,44 @@ def check_database():
         logger.error(f'Failed to check database: {e}')
         raise
 
+def migrate_schema():
+    """
+    Bring an existing database up to date with the models.
+    Missing tables, columns and indexes are created; existing data is left unchanged (idempotent).
+    """
+    from .shared import models  # noqa: F401
+
+    inspector = inspect(engine)
+    added = 0
+
+    with engine.begin() as conn:
+        for table in Base.metadata.sorted_tables:
+            if not inspector.has_table(table.name):
+                logger.info(f'Creating table {table.name}')
+                table.create(bind=conn)
+                continue
+
+            existing_columns = {column['name'] for column in inspector.get_columns(table.name)}
+            for column in table.columns:
+                if column.name in existing_columns:
+                    continue
+
+                ddl = f'ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}'
+                if column.default is not None and column.default.is_scalar:
+                    default = literal(column.default.arg).compile(dialect=engine.dialect, compile_kwargs={'literal_binds': True})
+                    ddl += f' DEFAULT {default}'
+                if not column.nullable:
+                    ddl += ' NOT NULL'
+
+                logger.info(f'Adding column {table.name}.{column.name}')
+                conn.execute(text(ddl))
+                added += 1
+
+            for index in table.indexes:
+                index.create(bind=conn, checkfirst=True)
+
+    logger.info(f'Schema migration complete: {added} column(s) added.')
+
 def encrypt_calendar_auth():
     """
     Migrate existing plaintext calendar_auth values to Fernet-encrypted ciphertext.
@@ -116,6 +156,22 @@ def encrypt_calendar_auth():
 
     logger.info(f'Encryption migration complete: {migrated} row(s) encrypted, {skipped} already encrypted.')
 
+def migrate_storage():
+    """
+    Rewrite stored calendars and snapshots into the configured STORAGE_MODE and
+    STORAGE_COMPRESSION, moving files into the stored_files table in database mode and
+    into the segment store in segments mode, which must not be running in the app meanwhile.
+    Files already in that form are left unchanged (idempotent).
+    """
+    settings = get_settings()
+    if settings.storage_mode == 'database':
+        migrate_schema()
+    StorageManagerFactory.create(
+        settings.storage_mode,
+        settings.storage_compression,
+        segment_bytes=settings.storage_segment_bytes,
+        compact_interval=0
+    ).migrate_files()
 
 def main():
     logging.basicConfig(
@@ -136,8 +192,12 @@ def main():
             reset_database(force=force)
         elif command == 'check':
             check_database()
+        elif command == 'migrate':
+            migrate_schema()
         elif command == 'encrypt':
             encrypt_calendar_auth()
+        elif command == 'storage':
+            migrate_storage()
         else:
             print('Usage:')
             print('  python -m src.db_manager create          # Create all tables')
@@ -146,7 +206,9 @@ def main():
             print('  python -m src.db_manager reset           # Drop and recreate (with confirmation)')
             print('  python -m src.db_manager reset --force   # Drop and recreate (no confirmation)')
             print('  python -m src.db_manager check           # Check if database is initialized')
+            print('  python -m src.db_manager migrate         # Add missing tables, columns and indexes')
             print('  python -m src.db_manager encrypt         # Encrypt plaintext calendar_auth values')
+            print('  python -m src.db_manager storage         # Rewrite stored calendars into the configured storage mode')
             sys.exit(1)
     else:
         create_all_tables()
@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+'''
+Memory benchmark of parsed calendars held in memory.
+
+Parses synthetic student calendars, drawn from a shared pool of courses and rooms,
+and keeps every result, as the parsed calendar cache does. Each representation runs
+in its own process and reports its peak RSS growth, scaled to 10k calendars:
+
+    legacy   icalendar parsing into dict-backed events with a private copy of every
+             string, as before (the baseline)
+    compact  the current icalendar parser: slotted Event with interned summaries
+             and locations
+    fast     the same events from the fast parser (ICAL_PARSER=fast)
+
+    python src/memory_benchmark.py [--calendars N] [--events N]
+'''
+import sys
+import random
+import argparse
+import resource
+import subprocess
+from dataclasses import dataclass
+from datetime import datetime
+from icalendar import Calendar
+from shared.calendar_utils import is_excluded_summary, parse_calendar_fast, parse_calendar_icalendar
+
+COURSES = 400
+ROOMS = 150
+
+@dataclass
+class LegacyEvent:
+    uid: str
+    summary: str
+    start: datetime
+    end: datetime
+    location: str | None = None
+
+def parse_legacy(ical_content: str) -> list[LegacyEvent]:
+    '''The icalendar parsing path as it was before events were slotted and interned.'''
+    events = []
+    for component in Calendar.from_ical(ical_content).walk():
+        if component.name == 'VEVENT':
+            summary = component.get('summary')
+            if is_excluded_summary(summary):
+                continue
+            location = component.get('location')
+            events.append(LegacyEvent(
+                uid=str(component.get('uid')),
+                summary=str(summary),
+                start=component.get('dtstart').dt,
+                end=component.get('dtend').dt,
+                location=str(location) if location is not None else None
+            ))
+    return events
+
+PARSERS = {
+    'legacy': parse_legacy,
+    'compact': parse_calendar_icalendar,
+    'fast': parse_calendar_fast,
+}
+
+def build_calendar(rng: random.Random, student: int, events: int) -> str:
+    lines = ['BEGIN:VCALENDAR', 'VERSION:2.0', 'PRODID:-//benchmark//EN']
+    for i in range(events):
+        course = rng.randrange(COURSES)
+        day = datetime(2027, rng.randint(1, 12), rng.randint(1, 28), rng.randint(8, 19))
+        lines += [
+            'BEGIN:VEVENT',
+            f'UID:{student}-{i}@benchmark',
+            f'SUMMARY:Course {course} - Lectures',
+            f'DTSTART:{day:%Y%m%dT%H%M%S}Z',
+            f'DTEND:{day.replace(hour=day.hour + 2):%Y%m%dT%H%M%S}Z',
+            f'LOCATION:Room {rng.randrange(ROOMS)}',
+            'END:VEVENT',
+        ]
+    lines.append('END:VCALENDAR')
+    return '\r\n'.join(lines) + '\r\n'
+
+def peak_rss_kib() -> int:
+    # ru_maxrss is in KiB on Linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+
+def run(mode: str, calendars: int, events: int) -> None:
+    rng = random.Random(0)
+    baseline = peak_rss_kib()
+    parse = PARSERS[mode]
+    kept = []
+    for student in range(calendars):
+        kept.append(parse(build_calendar(rng, student, events)))
+    growth = peak_rss_kib() - baseline
+    print(f'{mode:8} {calendars} calendars, {calendars * events} events: '
+          f'peak RSS +{growth / 1024:.1f} MiB, {growth / 1024 * 10_000 / calendars:.1f} MiB per 10k calendars')
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--calendars', type=int, default=10_000)
+    parser.add_argument('--events', type=int, default=40)
+    parser.add_argument('--mode', choices=list(PARSERS))
+    args = parser.parse_args()
+
+    if args.mode:
+        run(args.mode, args.calendars, args.events)
+        return
+
+    # A fresh process per mode, so one run's peak does not hide the other's
+    for mode in PARSERS:
+        subprocess.run(
+            [sys.executable, __file__, '--mode', mode, '--calendars', str(args.calendars), '--events', str(args.events)],
+            check=True
+        )
+
+if __name__ == '__main__':
+    main()
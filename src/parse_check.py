@@ -0,0 +1,76 @@
+#!/usr/bin/env python3
+'''
+Differential check of the fast iCal parser against icalendar.
+
+Parses every .ics file under the given directories (by default the calendar storage)
+with both parsers and reports files where the results differ.
+
+    python src/parse_check.py [directory ...]
+'''
+import os
+import sys
+import time
+import logging
+from shared.calendar_utils import (
+    UnsupportedIcal,
+    parse_calendar_fast,
+    parse_calendar_icalendar,
+    describe_parser_mismatch,
+)
+from shared.storage_manager import StorageManager, read_file
+
+logger = logging.getLogger(__name__)
+
+def check_file(path: str) -> tuple[str, float, float]:
+    '''Compare both parsers on a file. Returns (outcome, icalendar seconds, fast seconds).'''
+    content = read_file(path).decode('utf-8')
+
+    start = time.perf_counter()
+    expected = parse_calendar_icalendar(content)
+    icalendar_time = time.perf_counter() - start
+
+    start = time.perf_counter()
+    try:
+        actual = parse_calendar_fast(content)
+    except UnsupportedIcal as e:
+        logger.info(f'{path}: fast parser falls back to icalendar ({e})')
+        return 'fallback', icalendar_time, time.perf_counter() - start
+    fast_time = time.perf_counter() - start
+
+    mismatch = describe_parser_mismatch(expected, actual)
+    if mismatch:
+        logger.error(f'{path}: {mismatch}')
+        return 'mismatch', icalendar_time, fast_time
+    return 'match', icalendar_time, fast_time
+
+def main():
+    logging.basicConfig(
+        level=logging.INFO,
+        format='%(asctime)s - %(levelname)s - %(message)s'
+    )
+
+    directories = sys.argv[1:] or [StorageManager().storage_path]
+    outcomes = {'match': 0, 'fallback': 0, 'mismatch': 0}
+    icalendar_total = fast_total = 0.0
+
+    paths = sorted(
+        os.path.join(root, name)
+        for directory in directories
+        for root, _, names in os.walk(directory)
+        for name in names if name.endswith('.ics')
+    )
+    for path in paths:
+        outcome, icalendar_time, fast_time = check_file(path)
+        outcomes[outcome] += 1
+        icalendar_total += icalendar_time
+        fast_total += fast_time
+
+    logger.info(
+        f"Checked {sum(outcomes.values())} calendar(s): {outcomes['match']} match, "
+        f"{outcomes['fallback']} fall back, {outcomes['mismatch']} mismatch. "
+        f'icalendar {icalendar_total:.2f}s, fast {fast_total:.2f}s'
+    )
+    sys.exit(1 if outcomes['mismatch'] else 0)
+
+if __name__ == '__main__':
+    main()
@@ -38,6 +38,11 @@ def signal_handler(signum, _):
     for thread in threads:
         if hasattr(thread, 'stop'):
             thread.stop() # type: ignore
+
+    # The worker thread is a daemon and dies with the process, so release its parse processes here
+    worker_service = get_worker_service()
+    worker_service.stop()
+    worker_service.close()
     sys.exit(0)
 
 def start_api_thread():
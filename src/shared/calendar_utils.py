@@ -1,18 +1,33 @@
+import re
+import sys
 import pytz
+import hashlib
 import logging
-import requests
+import functools
+import httpx
 from icalendar import Calendar
-from requests.exceptions import RequestException
+from icalendar.cal import types_factory
+from icalendar.parser import Contentline
 from http.client import InvalidURL
 from urllib.parse import urlparse, parse_qs
-from dataclasses import dataclass
-from datetime import datetime
+from dataclasses import dataclass, field
+from datetime import date, datetime, timedelta
+from zoneinfo import ZoneInfo
 from enum import Enum
+from shared.http_client import get_http_client
+from shared.host_limiter import HostBusyError
+from shared.lru_cache import LRUCache
 
 logger = logging.getLogger(__name__)
 
 CALENDAR_PATH = '/_download/calevent/mycal.ics'
 EXCLUDED_SUBJECTS = ['Tjelesna i zdravstvena kultura', 'Physical Education and Welfare']
+# Properties servers regenerate without any change to the events
+VOLATILE_PROPERTIES = frozenset({'DTSTAMP', 'PRODID', 'LAST-MODIFIED', 'CREATED', 'SEQUENCE'})
+# VEVENT properties the fast parser extracts
+EVENT_PROPERTIES = frozenset({'UID', 'SUMMARY', 'DTSTART', 'DTEND', 'LOCATION'})
+# Properties icalendar parses with the TZID parameter applied
+TZID_PROPERTIES = ('DTSTART', 'DTEND', 'RECURRENCE-ID', 'DUE', 'RDATE', 'EXDATE')
 
 class ChangeType(Enum):
     NONE = 0
@@ -21,7 +36,11 @@ class ChangeType(Enum):
     TIME = 3
     LOCATION = 4
 
-@dataclass
+def intern_text(value: str | None) -> str | None:
+    '''Intern a summary or location, so the many copies across calendars share one string.'''
+    return None if value is None else sys.intern(value)
+
+@dataclass(slots=True)
 class Event:
     uid: str
     summary: str
@@ -29,12 +48,81 @@ class Event:
     end: datetime
     location: str | None = None
 
-@dataclass
+@dataclass(slots=True)
 class EventChange:
     old: Event | None
     new: Event | None
     change_type: list[ChangeType]
 
+@dataclass
+class ParsedCalendar:
+    events: list[Event]
+    # Fingerprint of every VEVENT block in document order and whether it produced the next
+    # event in events, or None if it was outside the parse horizon and not parsed.
+    # blocks is None when the calendar was parsed by icalendar without an index.
+    blocks: list[tuple[bytes, bool | None]] | None = None
+    # Day bounds (see Horizon.day_bounds) the blocks were trimmed to, or None if none were skipped for it
+    bounds: tuple[str, str] | None = None
+    # EventColumns built on demand by shared.event_diff
+    columns: object | None = field(default=None, repr=False, compare=False)
+
+    def __getstate__(self):
+        # Column string ids are only meaningful in the process that built them
+        state = self.__dict__.copy()
+        state['columns'] = None
+        return state
+
+    def index(self) -> dict[bytes, Event | None]:
+        '''Map fingerprints of parsed blocks to the events they produced.'''
+        index = {}
+        events = iter(self.events)
+        for fingerprint, has_event in self.blocks or ():
+            if has_event is not None:
+                index[fingerprint] = next(events) if has_event else None
+        return index
+
+@functools.lru_cache(maxsize=4096)
+def _is_exam(summary: str, keywords: tuple[str, ...]) -> bool:
+    summary = summary.lower()
+    return any(keyword in summary for keyword in keywords)
+
+@dataclass(frozen=True)
+class Horizon:
+    '''
+    Events worth parsing and diffing: those starting within the next `days` days,
+    and exams, recognised by a keyword in the summary, at any later date.
+    '''
+    days: int
+    exam_keywords: tuple[str, ...] = ()
+
+    def is_exam(self, summary: str | None) -> bool:
+        return bool(summary) and _is_exam(summary, self.exam_keywords)
+
+    def day_bounds(self, now: datetime) -> tuple[str, str]:
+        '''First and last raw DTSTART day (YYYYMMDD) inside the horizon, with a day of margin either side.'''
+        return (now - timedelta(days=1)).strftime('%Y%m%d'), (now + timedelta(days=self.days + 1)).strftime('%Y%m%d')
+
+    def includes_block(self, lines: list[str], bounds: tuple[str, str]) -> bool:
+        '''Whether a raw VEVENT block may be inside the horizon, judged by its DTSTART day and SUMMARY.'''
+        day = _raw_start_day(lines)
+        if day is None:
+            return True
+        if day < bounds[0]:
+            return False
+        if day <= bounds[1]:
+            return True
+        summary = next((line.split(':', 1)[-1] for line in lines if _property_name(line) == 'SUMMARY'), None)
+        return self.is_exam(summary)
+
+    def includes_event(self, event: Event, bounds: tuple[str, str]) -> bool:
+        '''Whether includes_block would have kept the block of a parsed event, judged by its start day.'''
+        if event.start is None:
+            return True
+        day = event.start.strftime('%Y%m%d')
+        if day < bounds[0]:
+            return False
+        return day <= bounds[1] or self.is_exam(event.summary)
+
 def parse_calendar_url(url: str) -> dict[str, str]:
     parsed_url = urlparse(url)
     
@@ -64,36 +152,391 @@ def is_valid_ical(ical_string: str) -> bool:
         return False
     
 def is_valid_ical_url(url: str) -> bool:
+    '''Fetch and check the calendar. Raises HostBusyError if the host has no free request slot, which is worth retrying.'''
     try:
-        response = requests.get(url, timeout=10)
+        response = get_http_client().get(url)
         response.raise_for_status()
         ical_content = response.text
         return is_valid_ical(ical_content)
-    except RequestException as _:
+    except HostBusyError:
+        raise
+    except httpx.HTTPError as _:
         return False
 
-def parse_ical_event(ical_content: str) -> list[Event]:
-    events = []
+def is_excluded_summary(summary: str | None) -> bool:
+    return (summary is None or not str(summary).strip()
+            or any(subj.lower() in summary.lower() for subj in EXCLUDED_SUBJECTS))
+
+def parse_calendar_icalendar(ical_content: str) -> list[Event] | None:
+    '''
+    Parse an iCal document into events with a single Calendar.from_ical call.
+    Returns None if the document is not valid iCal.
+    '''
     try:
         cal = Calendar.from_ical(ical_content)
+    except Exception as _:
+        return None
+
+    events = []
+    try:
         for component in cal.walk():
             if component.name == 'VEVENT':
                 summary = component.get('summary')
-                if (summary is None or not str(summary).strip()
-                        or any(subj.lower() in summary.lower() for subj in EXCLUDED_SUBJECTS)):
+                if is_excluded_summary(summary):
                     continue
                 uid = str(component.get('uid'))
-                summary = str(summary)
+                summary = intern_text(str(summary))
                 dtstart = component.get('dtstart').dt
                 dtend = component.get('dtend').dt
                 location = component.get('location')
                 if location is not None:
-                    location = str(location)
+                    location = intern_text(str(location))
                 events.append(Event(uid=uid, summary=summary, start=dtstart, end=dtend, location=location))
     except Exception as e:
         logger.exception('Failed to parse ical events: %s', e)
     return events
 
+class UnsupportedIcal(Exception):
+    '''Raised by the fast parser for input it leaves to icalendar.'''
+
+def _unescape_text(value: str) -> str:
+    # Same replacements, in the same order, as icalendar's vText
+    if '\\' not in value:
+        return value
+    return (value.replace('\\N', '\\n').replace('\\n', '\n').replace('\\,', ',')
+            .replace('\\;', ';').replace('\\\\', '\\'))
+
+def _split_content_line(line: str) -> tuple[str, str | None, str]:
+    '''Split a content line into (upper-case name, TZID parameter, raw value).'''
+    if '"' in line:
+        in_quotes = False
+        for i, char in enumerate(line):
+            if char == '"':
+                in_quotes = not in_quotes
+            elif char == ':' and not in_quotes:
+                head, value = line[:i], line[i + 1:]
+                break
+        else:
+            raise UnsupportedIcal(f'No value in line: {line[:50]}')
+    else:
+        head, sep, value = line.partition(':')
+        if not sep:
+            raise UnsupportedIcal(f'No value in line: {line[:50]}')
+
+    name, _, params = head.partition(';')
+    tzid = None
+    if params:
+        for param in params.split(';'):
+            key, _, param_value = param.partition('=')
+            if key.upper() == 'TZID':
+                tzid = param_value.strip('"')
+    return name.upper(), tzid, value
+
+@functools.lru_cache(maxsize=64)
+def _zoneinfo(tzid: str) -> ZoneInfo | None:
+    try:
+        return ZoneInfo(tzid.strip('/'))
+    except Exception as _:
+        return None
+
+@functools.lru_cache(maxsize=1024)
+def _validate_property(line: str) -> None:
+    '''
+    Raise UnsupportedIcal unless icalendar accepts the property. Outside of VEVENTs
+    icalendar rejects the whole document on a bad value, so those few lines are
+    checked with its own value types.
+    '''
+    try:
+        name, params, value = Contentline(line).parts()
+        factory = types_factory.for_property(name)
+        if name.upper() in TZID_PROPERTIES and 'TZID' in params:
+            factory.from_ical(value, params['TZID'])
+        else:
+            factory.from_ical(value)
+    except Exception as e:
+        raise UnsupportedIcal(f'Invalid property: {line[:50]}') from e
+
+def _parse_ical_time(value: str, tzid: str | None) -> date | datetime:
+    '''Parse a DATE or DATE-TIME value the way icalendar does, or raise UnsupportedIcal.'''
+    if not value[:8].isdigit():
+        raise UnsupportedIcal(f'Unsupported time value: {value}')
+    year, month, day = int(value[:4]), int(value[4:6]), int(value[6:8])
+    if len(value) == 8:
+        return date(year, month, day)
+    if len(value) not in (15, 16) or value[8] != 'T' or not value[9:15].isdigit():
+        raise UnsupportedIcal(f'Unsupported time value: {value}')
+
+    timestamp = datetime(year, month, day, int(value[9:11]), int(value[11:13]), int(value[13:15]))
+    if tzid:
+        tz = _zoneinfo(tzid)
+        if tz is None:
+            # Custom VTIMEZONE definitions and Windows names are left to icalendar
+            raise UnsupportedIcal(f'Unknown TZID: {tzid}')
+        return timestamp.replace(tzinfo=tz)
+    if len(value) == 15:
+        return timestamp
+    if value[15] == 'Z':
+        return timestamp.replace(tzinfo=ZoneInfo('UTC'))
+    raise UnsupportedIcal(f'Unsupported time value: {value}')
+
+def block_fingerprint(lines: list[str]) -> bytes:
+    '''Fingerprint of a VEVENT block's content, ignoring volatile properties as canonical_ical_hash does.'''
+    content = '\n'.join(line for line in lines if _property_name(line) not in VOLATILE_PROPERTIES)
+    return hashlib.blake2b(content.encode('utf-8'), digest_size=16).digest()
+
+def _parse_vevent_block(lines: list[str]) -> Event | None:
+    '''Parse the lines between BEGIN:VEVENT and END:VEVENT, nested components included.'''
+    fields: dict[str, tuple[str | None, str]] = {}
+    stack: list[str] = []
+
+    for line in lines:
+        name, tzid, value = _split_content_line(line)
+        if name == 'BEGIN':
+            component = value.strip().upper()
+            if component in ('VEVENT', 'VCALENDAR'):
+                raise UnsupportedIcal(f'{component} nested in VEVENT')
+            stack.append(component)
+        elif name == 'END':
+            if not stack or stack[-1] != value.strip().upper():
+                raise UnsupportedIcal(f'Unbalanced END:{value}')
+            stack.pop()
+        elif stack:
+            _validate_property(line)
+        elif name in EVENT_PROPERTIES:
+            if name in fields:
+                raise UnsupportedIcal(f'Duplicate {name}')
+            fields[name] = (tzid, value)
+
+    if stack:
+        raise UnsupportedIcal('Unterminated component in VEVENT')
+    return _build_event(fields)
+
+def parse_calendar_blocks(
+        ical_content: str,
+        previous: dict[bytes, Event | None] | None = None,
+        shared: LRUCache[Event] | None = None,
+        horizon: Horizon | None = None
+) -> ParsedCalendar:
+    '''
+    Line-oriented parser that extracts only the VEVENT fields Event needs.
+    Every VEVENT block is fingerprinted, and blocks found in `previous` (an index of
+    an earlier parse) or in `shared` (events of blocks seen in any calendar) reuse
+    the earlier event instead of being parsed again. A block parses the same in
+    every calendar, since TZIDs resolve to system zones, not the calendar's VTIMEZONEs.
+    With a `horizon`, blocks outside it are only fingerprinted.
+
+    Raises UnsupportedIcal for anything it does not handle exactly like icalendar,
+    including malformed documents, so callers can fall back to the full parser.
+    '''
+    events: list[Event] = []
+    blocks: list[tuple[bytes, bool]] = []
+    stack: list[str] = []
+    calendars = 0
+    block: list[str] | None = None
+    depth = 0
+    bounds = horizon.day_bounds(datetime.now(pytz.UTC)) if horizon is not None else None
+
+    for line in unfold_ical_lines(ical_content):
+        if not line:
+            continue
+
+        if block is not None:
+            # Inside a VEVENT only component boundaries matter until the block is complete
+            head = line[:4].upper()
+            if head == 'BEGI':
+                depth += 1
+            elif head == 'END:':
+                if depth == 0:
+                    if line[4:].strip().upper() != 'VEVENT':
+                        raise UnsupportedIcal(f'Unbalanced {line}')
+                    fingerprint = block_fingerprint(block)
+                    if previous is not None and fingerprint in previous:
+                        event = previous[fingerprint]
+                    elif bounds is not None and not horizon.includes_block(block, bounds):
+                        blocks.append((fingerprint, None))
+                        block = None
+                        continue
+                    else:
+                        event = shared.get(fingerprint) if shared is not None else None
+                        if event is None:
+                            event = _parse_vevent_block(block)
+                            if shared is not None and event is not None:
+                                shared.put(fingerprint, event)
+                    blocks.append((fingerprint, event is not None))
+                    if event is not None:
+                        events.append(event)
+                    block = None
+                    continue
+                depth -= 1
+            block.append(line)
+            continue
+
+        name, _, value = _split_content_line(line)
+        if name == 'BEGIN':
+            component = value.strip().upper()
+            if component == 'VCALENDAR':
+                calendars += 1
+                if stack or calendars > 1:
+                    raise UnsupportedIcal('Nested or multiple calendars')
+            elif not stack:
+                raise UnsupportedIcal(f'{component} outside of a calendar')
+            elif component == 'VEVENT':
+                block = []
+                depth = 0
+                continue
+            stack.append(component)
+        elif name == 'END':
+            if not stack or stack[-1] != value.strip().upper():
+                raise UnsupportedIcal(f'Unbalanced END:{value}')
+            stack.pop()
+        elif not stack:
+            raise UnsupportedIcal('Property outside of a calendar')
+        else:
+            _validate_property(line)
+
+    if stack or block is not None or calendars != 1:
+        raise UnsupportedIcal('Unterminated or missing calendar')
+    return ParsedCalendar(events=events, blocks=blocks, bounds=bounds)
+
+def parse_calendar_fast(ical_content: str) -> list[Event]:
+    '''Events of a document parsed with parse_calendar_blocks, see there.'''
+    return parse_calendar_blocks(ical_content).events
+
+def _build_event(fields: dict[str, tuple[str | None, str]]) -> Event | None:
+    summary = _unescape_text(fields['SUMMARY'][1]) if 'SUMMARY' in fields else None
+    if is_excluded_summary(summary):
+        return None
+    if 'DTSTART' not in fields or 'DTEND' not in fields:
+        raise UnsupportedIcal('VEVENT without DTSTART or DTEND')
+
+    uid = _unescape_text(fields['UID'][1]) if 'UID' in fields else 'None'
+    location = _unescape_text(fields['LOCATION'][1]) if 'LOCATION' in fields else None
+    return Event(
+        uid=uid,
+        summary=intern_text(summary),
+        start=_parse_ical_time(fields['DTSTART'][1], fields['DTSTART'][0]),
+        end=_parse_ical_time(fields['DTEND'][1], fields['DTEND'][0]),
+        location=intern_text(location)
+    )
+
+def describe_parser_mismatch(expected: list[Event] | None, actual: list[Event] | None) -> str | None:
+    '''Describe the first difference between two parse results, or None if they match.'''
+    if expected is None or actual is None:
+        return None if expected is actual else f'validity differs: expected {expected is not None}, got {actual is not None}'
+    if len(expected) != len(actual):
+        return f'event count differs: expected {len(expected)}, got {len(actual)}'
+    for i, (a, b) in enumerate(zip(expected, actual)):
+        for attr in ('uid', 'summary', 'start', 'end', 'location'):
+            x, y = getattr(a, attr), getattr(b, attr)
+            # Equal instants in different zones compare equal, so also compare the wall time
+            if x != y or type(x) is not type(y) or (isinstance(x, datetime) and (x.replace(tzinfo=None), x.utcoffset()) != (y.replace(tzinfo=None), y.utcoffset())):
+                return f'event {i} ({a.uid}) {attr} differs: expected {x!r}, got {y!r}'
+    return None
+
+def parse_calendar(ical_content: str, parser: str = 'icalendar') -> list[Event] | None:
+    '''
+    Parse an iCal document into events. Returns None if the document is not valid iCal.
+
+    parser selects the implementation: 'icalendar' builds the full component tree,
+    'fast' uses parse_calendar_fast and falls back to icalendar for input it does not
+    support, and 'differential' runs both, logs any mismatch and returns the icalendar result.
+    '''
+    if parser == 'icalendar':
+        return parse_calendar_icalendar(ical_content)
+
+    try:
+        events = parse_calendar_fast(ical_content)
+    except UnsupportedIcal as e:
+        logger.debug(f'Fast parser fell back to icalendar: {e}')
+        return parse_calendar_icalendar(ical_content)
+
+    if parser == 'differential':
+        expected = parse_calendar_icalendar(ical_content)
+        mismatch = describe_parser_mismatch(expected, events)
+        if mismatch:
+            logger.warning(f'Fast parser mismatch: {mismatch}')
+        return expected
+    return events
+
+def parse_calendar_indexed(
+        ical_content: str,
+        parser: str = 'icalendar',
+        previous: ParsedCalendar | None = None,
+        shared: LRUCache[Event] | None = None,
+        horizon: Horizon | None = None
+) -> ParsedCalendar | None:
+    '''
+    Parse an iCal document like parse_calendar. With the fast parser the result also
+    carries a VEVENT fingerprint index, blocks unchanged since `previous` or found in
+    the `shared` block cache are not parsed again, and blocks outside the `horizon`
+    are not parsed at all. Returns None if the document is not valid iCal.
+    '''
+    if parser == 'fast':
+        try:
+            index = previous.index() if previous is not None and previous.blocks is not None else None
+            return parse_calendar_blocks(ical_content, index, shared, horizon)
+        except UnsupportedIcal as e:
+            logger.debug(f'Fast parser fell back to icalendar: {e}')
+            events = parse_calendar_icalendar(ical_content)
+    else:
+        events = parse_calendar(ical_content, parser)
+    return ParsedCalendar(events=events) if events is not None else None
+
+def parse_ical_event(ical_content: str) -> list[Event]:
+    return parse_calendar(ical_content) or []
+
+def unfold_ical_lines(ical_content: str) -> list[str]:
+    '''Split an iCal document into content lines, joining folded continuation lines.'''
+    return re.sub(r'(\r?\n)+[ \t]', '', ical_content).splitlines()
+
+def _property_name(line: str) -> str:
+    return line.split(':', 1)[0].split(';', 1)[0].upper()
+
+def _raw_start_day(event_lines: list[str]) -> str | None:
+    '''DTSTART day of a VEVENT block as YYYYMMDD, without parsing it, or None.'''
+    for line in event_lines:
+        if _property_name(line) == 'DTSTART':
+            day = line.split(':', 1)[-1].strip()[:8]
+            return day if len(day) == 8 and day.isdigit() else None
+    return None
+
+def _starts_before(event_lines: list[str], cutoff: str) -> bool:
+    day = _raw_start_day(event_lines)
+    return day is not None and day < cutoff
+
+def canonical_ical_hash(ical_content: str) -> str:
+    '''
+    SHA256 of a normalised iCal document. Lines are unfolded, volatile properties
+    dropped, VEVENTs sorted by UID and events that started before yesterday ignored,
+    so the hash only changes when something that can produce a notification changes.
+    '''
+    # A day of margin keeps events that could still be upcoming in any timezone
+    cutoff = (datetime.now(pytz.UTC) - timedelta(days=1)).strftime('%Y%m%d')
+
+    calendar_lines: list[str] = []
+    events: list[tuple[str, str]] = []
+    event_lines: list[str] | None = None
+    for line in unfold_ical_lines(ical_content):
+        line = line.rstrip()
+        if not line:
+            continue
+        name = _property_name(line)
+        if event_lines is None and line.upper() == 'BEGIN:VEVENT':
+            event_lines = []
+        elif event_lines is not None and line.upper() == 'END:VEVENT':
+            if not _starts_before(event_lines, cutoff):
+                uid = next((l.split(':', 1)[-1] for l in event_lines if _property_name(l) == 'UID'), '')
+                events.append((uid, '\n'.join(event_lines)))
+            event_lines = None
+        elif name not in VOLATILE_PROPERTIES:
+            (calendar_lines if event_lines is None else event_lines).append(line)
+
+    hasher = hashlib.sha256('\n'.join(calendar_lines).encode('utf-8'))
+    for _, event in sorted(events):
+        hasher.update(b'\nBEGIN:VEVENT\n')
+        hasher.update(event.encode('utf-8'))
+    return hasher.hexdigest()
+
 def extract_base_summary(summary: str, timestamp: datetime) -> str:
     if not summary:
         return ''
@@ -133,7 +576,15 @@ def is_past_event_tz(event: Event) -> bool:
 def remove_past_events(events: list[Event]) -> list[Event]:
     return [e for e in events if not is_past_event_tz(e)]
 
-def compute_event_changes(old_events: list[Event], new_events: list[Event]) -> list[EventChange]:
+def event_key(event: Event) -> str:
+    return extract_base_summary(event.summary, event.start)
+
+def compute_event_changes(old_events: list[Event], new_events: list[Event], keys: set[str] | None = None) -> list[EventChange]:
+    # only compare the events grouped under the given keys, if any
+    if keys is not None:
+        old_events = [e for e in old_events if e.summary and event_key(e) in keys]
+        new_events = [e for e in new_events if e.summary and event_key(e) in keys]
+
     # remove past events before building dicts of unique events
     old_events = remove_past_events(old_events)
     new_events = remove_past_events(new_events)
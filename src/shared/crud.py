@@ -1,9 +1,11 @@
 import os
 import pytz
-from datetime import datetime
+import random
+from datetime import datetime, timedelta
+from typing import Callable
 from sqlalchemy.orm import Session
-from sqlalchemy import func, text
-from shared.models import UserCalendar, AuditLog
+from sqlalchemy import func, or_, text
+from shared.models import UserCalendar, AuditLog, PollingOverride
 from shared.database import SessionLocal
 
 _TZ = pytz.timezone(os.getenv('TIMEZONE', 'Europe/Zagreb'))
@@ -116,6 +118,144 @@ def get_active_subscriptions_no_session(expunge_all: bool = True) -> list[UserCa
     finally:
         session.close()
 
+def schedule_unscheduled_subscriptions(db: Session, next_check: Callable[[UserCalendar], datetime]) -> int:
+    """
+    Assign a due time to active, already checked subscriptions that have none.
+    Subscriptions that were never checked are left due immediately.
+    """
+    subs = db.query(UserCalendar).filter(
+        UserCalendar.activated.is_(True),
+        UserCalendar.paused.is_(False),
+        UserCalendar.next_check_at.is_(None),
+        UserCalendar.last_checked.is_not(None)
+    ).all()
+    for sub in subs:
+        sub.next_check_at = next_check(sub)
+    db.commit()
+    return len(subs)
+
+def schedule_unscheduled_subscriptions_no_session(next_check: Callable[[UserCalendar], datetime]) -> int:
+    session = SessionLocal()
+    try:
+        return schedule_unscheduled_subscriptions(session, next_check)
+    except Exception as _:
+        session.rollback()
+        return 0
+    finally:
+        session.close()
+
+def claim_due_subscriptions(
+        db: Session,
+        now: datetime,
+        limit: int,
+        next_check: Callable[[UserCalendar], datetime]
+) -> list[UserCalendar]:
+    """
+    Claim up to `limit` active subscriptions that are due, earliest first, and move
+    their due time forward with `next_check`. Rows claimed by another worker are skipped.
+    """
+    subs = db.query(UserCalendar).filter(
+        UserCalendar.activated.is_(True),
+        UserCalendar.paused.is_(False),
+        or_(UserCalendar.next_check_at.is_(None), UserCalendar.next_check_at <= now)
+    ).order_by(
+        UserCalendar.next_check_at.asc().nulls_first()
+    ).limit(limit).with_for_update(skip_locked=True).all()
+
+    for sub in subs:
+        sub.next_check_at = next_check(sub)
+    db.commit()
+    return subs
+
+def claim_due_subscriptions_no_session(
+        now: datetime,
+        limit: int,
+        next_check: Callable[[UserCalendar], datetime]
+) -> list[UserCalendar]:
+    session = SessionLocal(expire_on_commit=False)
+    try:
+        subs = claim_due_subscriptions(session, now, limit, next_check)
+        session.expunge_all()
+        return subs
+    except Exception as _:
+        session.rollback()
+        return []
+    finally:
+        session.close()
+
+def record_fetch_failures(db: Session, username: str, domain: str, failures: int, retry_at: datetime | None = None) -> None:
+    """Set a subscription's consecutive fetch failures and, if given, move its due time to `retry_at`."""
+    values = {UserCalendar.fetch_failures: failures}
+    if retry_at is not None:
+        values[UserCalendar.next_check_at] = retry_at
+    db.query(UserCalendar).filter(
+        UserCalendar.username == username,
+        UserCalendar.domain == domain
+    ).update(values, synchronize_session=False)
+    db.commit()
+
+def record_fetch_failures_no_session(username: str, domain: str, failures: int, retry_at: datetime | None = None) -> bool:
+    session = SessionLocal()
+    try:
+        record_fetch_failures(session, username, domain, failures, retry_at)
+        return True
+    except Exception as _:
+        session.rollback()
+        return False
+    finally:
+        session.close()
+
+def cap_next_check_times(db: Session, earliest: datetime, latest: datetime) -> int:
+    """Move every due time later than `latest` to a random time in [`earliest`, `latest`], so they do not all fall due at once."""
+    keys = db.query(UserCalendar.username, UserCalendar.domain).filter(
+        UserCalendar.next_check_at > latest
+    ).all()
+    window = (latest - earliest).total_seconds()
+    db.bulk_update_mappings(UserCalendar, [
+        {'username': username, 'domain': domain, 'next_check_at': earliest + timedelta(seconds=random.uniform(0, window))}
+        for username, domain in keys
+    ])
+    db.commit()
+    return len(keys)
+
+def get_polling_override(db: Session) -> PollingOverride | None:
+    """The stored polling override, which may have expired."""
+    return db.get(PollingOverride, 1)
+
+def get_polling_override_no_session() -> tuple[int, datetime] | None:
+    session = SessionLocal()
+    try:
+        override = get_polling_override(session)
+        return (override.interval, override.until) if override is not None else None
+    except Exception as _:
+        return None
+    finally:
+        session.close()
+
+def set_polling_override(db: Session, interval: int, until: datetime) -> None:
+    """Store the polling override, replacing any previous one."""
+    db.merge(PollingOverride(id=1, interval=interval, until=until))
+    db.commit()
+
+def clear_polling_override(db: Session) -> None:
+    db.query(PollingOverride).delete(synchronize_session=False)
+    db.commit()
+
+def get_next_due_time(db: Session) -> datetime | None:
+    """Earliest due time among active subscriptions."""
+    return db.query(func.min(UserCalendar.next_check_at)).filter(
+        UserCalendar.activated.is_(True), UserCalendar.paused.is_(False)
+    ).scalar()
+
+def get_next_due_time_no_session() -> datetime | None:
+    session = SessionLocal()
+    try:
+        return get_next_due_time(session)
+    except Exception as _:
+        return None
+    finally:
+        session.close()
+
 def get_total_subscription_count(db: Session) -> int:
     return db.query(func.count(UserCalendar.username)).scalar() or 0
 
@@ -189,6 +329,7 @@ def update_calendar_url(db: Session, email: str, new_calendar_url: str, new_cale
 
     sub.previous_calendar = new_calendar_url
     sub.previous_calendar_hash = new_calendar_hash
+    sub.stored_calendar_hash = None
     sub.last_checked = _now()
 
     db.commit()
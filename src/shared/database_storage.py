@@ -0,0 +1,80 @@
+import os
+import logging
+import datetime
+from sqlalchemy import delete, select
+from sqlalchemy.dialects.postgresql import insert
+from .database import SessionLocal
+from .models import StoredFile
+from .storage_manager import StorageManager, decompress
+
+logger = logging.getLogger(__name__)
+
+# Keys per query in bulk reads, well below Postgres' bind parameter limit
+READ_BATCH_SIZE = 1000
+
+class DatabaseStorageManager(StorageManager):
+    '''
+    Stores calendars and their event snapshots compressed in the stored_files table
+    rather than as files, so previous versions survive without the data volume and
+    a whole batch of them can be loaded in one query.
+    '''
+
+    bulk_reads = True
+
+    def __init__(self, compression: str = 'gzip', cache_bytes: int = 0):
+        super().__init__('compressed', compression, cache_bytes)
+
+    def _write(self, key: str, data: bytes) -> str:
+        statement = insert(StoredFile).values(key=key, data=self._encode(data), updated_at=datetime.datetime.now())
+        statement = statement.on_conflict_do_update(
+            index_elements=[StoredFile.key],
+            set_={'data': statement.excluded.data, 'updated_at': statement.excluded.updated_at}
+        )
+        with SessionLocal() as session:
+            session.execute(statement)
+            session.commit()
+        return self._path(key)
+
+    def _read(self, key: str) -> bytes | None:
+        with SessionLocal() as session:
+            data = session.scalar(select(StoredFile.data).where(StoredFile.key == key))
+        return decompress(data) if data is not None else None
+
+    def _read_many(self, keys: list[str]) -> dict[str, bytes]:
+        stored = {}
+        with SessionLocal() as session:
+            for i in range(0, len(keys), READ_BATCH_SIZE):
+                rows = session.execute(
+                    select(StoredFile.key, StoredFile.data).where(StoredFile.key.in_(keys[i:i + READ_BATCH_SIZE]))
+                )
+                stored.update((key, decompress(data)) for key, data in rows)
+        return stored
+
+    def _delete(self, key: str) -> bool:
+        with SessionLocal() as session:
+            deleted = session.execute(delete(StoredFile).where(StoredFile.key == key)).rowcount
+            session.commit()
+        return deleted > 0
+
+    def _path(self, key: str) -> str:
+        # Recorded as the subscription's previous calendar path
+        return f'{StoredFile.__tablename__}/{key}'
+
+    def migrate_files(self) -> tuple[int, int]:
+        """
+        Moves every calendar and snapshot file, in either file layout, into the database.
+
+        :return: (files moved, rows already in the database that no file replaced).
+        """
+        migrated = 0
+        for path, key in self._stored_files():
+            with open(path, 'rb') as f:
+                self._write(key, decompress(f.read()))
+            os.remove(path)
+            migrated += 1
+
+        with SessionLocal() as session:
+            rows = session.query(StoredFile).count()
+
+        logger.info(f'Storage migration complete: {migrated} file(s) moved into the database, {rows - migrated} row(s) already there.')
+        return migrated, rows - migrated
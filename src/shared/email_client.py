@@ -2,7 +2,7 @@ import time
 import logging
 import threading
 from enum import Enum
-from typing import List
+from typing import Callable, List
 from queue import Queue
 from dataclasses import dataclass
 from shared.calendar_utils import EventChange
@@ -13,7 +13,8 @@ from shared.email_templates import (
     deletion_email_content,
     pause_email_content,
     resume_email_content,
-    notification_email_content
+    notification_email_content,
+    render_notification_change
 )
 from shared.email_sender import EmailSender
 
@@ -180,10 +181,16 @@ class EmailClient:
         content = self._generate_confirmation_email(email_type, recipient_email, language)
         self._enqueue_email(recipient_email, content)
 
-    def send_notification_email(self, recipient_email: str, event_changes: List[EventChange], language: str = 'hr') -> None:
-        '''Send a notification email about schedule changes.'''
+    def send_notification_email(
+            self,
+            recipient_email: str,
+            event_changes: List[EventChange],
+            language: str = 'hr',
+            render_change: Callable[[EventChange, str], str] = render_notification_change
+    ) -> None:
+        '''Send a notification email about schedule changes, with change cards rendered by render_change.'''
         logger.info(f'Sending notification email to {recipient_email} in {language}')
 
         token = create_token(recipient_email, 'pause')  # For unsubscribe link
-        content = notification_email_content(self.api_base_url, event_changes, token, language)
+        content = notification_email_content(self.api_base_url, event_changes, token, language, render_change)
         self._enqueue_email(recipient_email, content)
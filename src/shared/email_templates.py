@@ -1,6 +1,7 @@
 import os
 import datetime
-from jinja2 import Environment, FileSystemLoader
+from typing import Callable
+from jinja2 import Environment, FileSystemLoader, pass_context
 from shared.calendar_utils import EventChange
 
 TRANSLATIONS = {
@@ -151,6 +152,8 @@ def format_datetime(value: datetime.datetime, language: str = 'hr') -> str:
 
 TEMPLATES_DIR = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', '..', 'templates', 'email'))
 env = Environment(loader=FileSystemLoader(TEMPLATES_DIR))
+# Reads the language from the render context, so concurrent renders in different languages don't interfere
+env.filters['format_datetime'] = pass_context(lambda context, value: format_datetime(value, context['lang']))
 
 def render_confirmation_email(email_type: str, base_url: str, token: str, language: str = 'hr') -> str:
     template = env.get_template('confirmation.html')
@@ -168,14 +171,32 @@ def render_confirmation_email(email_type: str, base_url: str, token: str, langua
     )
     return body
 
-def render_notification_email(template_name: str, base_url: str, event_changes: list[EventChange], token: str, language: str = 'hr'):
+# Changes shown in full in a notification, the rest are only counted
+MAX_CHANGES_SHOWN = 5
+
+def render_notification_change(change: EventChange, language: str = 'hr') -> str:
+    '''Render the card of a single change, independent of the recipient.'''
+    template = env.get_template('notification_change.html')
+    return template.render(change=change, t=TRANSLATIONS[language]['notification'], lang=language)
+
+def render_notification_email(
+        template_name: str,
+        base_url: str,
+        event_changes: list[EventChange],
+        token: str,
+        language: str = 'hr',
+        render_change: Callable[[EventChange, str], str] = render_notification_change
+):
     template = env.get_template(f'{template_name}.html')
     t = TRANSLATIONS[language][template_name]
-    
-    env.filters['format_datetime'] = lambda value: format_datetime(value, language)
+
+    sorted_changes = sorted(event_changes, key=lambda change: change.new.start if change.new else change.old.start)
+    cards = [render_change(change, language) for change in sorted_changes[:MAX_CHANGES_SHOWN]]
 
     body = template.render(
         event_changes=event_changes,
+        cards=cards,
+        max_to_show=MAX_CHANGES_SHOWN,
         count=len(event_changes),
         base_url=base_url,
         token=token,
@@ -212,7 +233,13 @@ def resume_email_content(base_url: str, token: str, language: str = 'hr') -> Ema
     html = render_confirmation_email('resume', base_url, token, language)
     return EmailContent(subject, html=html)
 
-def notification_email_content(base_url: str, event_changes: list[EventChange], token: str, language: str = 'hr') -> EmailContent:
+def notification_email_content(
+        base_url: str,
+        event_changes: list[EventChange],
+        token: str,
+        language: str = 'hr',
+        render_change: Callable[[EventChange, str], str] = render_notification_change
+) -> EmailContent:
     subject = TRANSLATIONS[language]['subjects']['notification']
-    html = render_notification_email('notification', base_url, event_changes, token, language)
+    html = render_notification_email('notification', base_url, event_changes, token, language, render_change)
     return EmailContent(subject, html=html)
@@ -0,0 +1,362 @@
+import time
+import heapq
+import logging
+import threading
+import numpy as np
+from collections import Counter
+from dataclasses import dataclass
+from datetime import date, datetime, timedelta, timezone
+from shared.calendar_utils import Event, EventChange, ChangeType, Horizon, ParsedCalendar, event_key
+
+logger = logging.getLogger(__name__)
+
+# Kinds of time values, a change of kind is a change of time
+NAIVE, AWARE, DATE = 0, 1, 2
+
+_EPOCH = datetime(1970, 1, 1, tzinfo=timezone.utc)
+_NAIVE_EPOCH = datetime(1970, 1, 1)
+_MICROSECOND = timedelta(microseconds=1)
+# Occurrences further apart than this are reported as removed and added, not moved
+MAX_MOVE = timedelta(days=7) // _MICROSECOND
+
+class StringTable:
+    '''Process-wide, append-only table mapping strings to stable integer ids.'''
+
+    def __init__(self):
+        self._ids: dict[str, int] = {}
+        self._strings: list[str] = []
+        self._lock = threading.Lock()
+
+    def intern(self, value: str | None) -> int:
+        if value is None:
+            return -1
+        id = self._ids.get(value)
+        if id is None:
+            with self._lock:
+                id = self._ids.setdefault(value, len(self._strings))
+                if id == len(self._strings):
+                    self._strings.append(value)
+        return id
+
+    def get(self, value: str) -> int:
+        '''Id of an already interned string, or -1.'''
+        return self._ids.get(value, -1)
+
+    def __getitem__(self, id: int) -> str:
+        return self._strings[id]
+
+    def __len__(self) -> int:
+        return len(self._strings)
+
+_strings = StringTable()
+
+def _to_micros(value: date | datetime) -> tuple[int, int]:
+    '''Microseconds since the epoch and kind of a time value. Naive times and dates are taken as UTC.'''
+    if isinstance(value, datetime):
+        if value.utcoffset() is None:
+            return (value.replace(tzinfo=None) - _NAIVE_EPOCH) // _MICROSECOND, NAIVE
+        return (value - _EPOCH) // _MICROSECOND, AWARE
+    return (datetime(value.year, value.month, value.day) - _NAIVE_EPOCH) // _MICROSECOND, DATE
+
+@dataclass
+class EventColumns:
+    '''Columnar view of an event list, with strings replaced by ids from the process-wide table.'''
+    start: np.ndarray
+    end: np.ndarray
+    start_kind: np.ndarray
+    end_kind: np.ndarray
+    # Interned base-summary key (see event_key), -1 for events without a summary
+    key: np.ndarray
+    location: np.ndarray
+
+    @classmethod
+    def from_events(cls, events: list[Event]) -> 'EventColumns':
+        count = len(events)
+        start = np.empty(count, dtype=np.int64)
+        end = np.empty(count, dtype=np.int64)
+        start_kind = np.empty(count, dtype=np.int8)
+        end_kind = np.empty(count, dtype=np.int8)
+        key = np.empty(count, dtype=np.int64)
+        location = np.empty(count, dtype=np.int64)
+
+        for i, event in enumerate(events):
+            start[i], start_kind[i] = _to_micros(event.start)
+            end[i], end_kind[i] = _to_micros(event.end)
+            key[i] = _strings.intern(event_key(event)) if event.summary else -1
+            location[i] = _strings.intern(event.location)
+
+        return cls(start, end, start_kind, end_kind, key, location)
+
+def get_columns(parsed: ParsedCalendar) -> EventColumns:
+    '''Columns of a parsed calendar, built once and kept on it.'''
+    if parsed.columns is None:
+        parsed.columns = EventColumns.from_events(parsed.events)
+    return parsed.columns
+
+def _diff_mask(
+        events: list[Event],
+        columns: EventColumns,
+        keys: set[str] | None,
+        now_micros: int,
+        horizon: Horizon | None
+) -> np.ndarray:
+    '''Events to compare: upcoming, grouped under one of `keys` if given, and inside the horizon if given.'''
+    mask = columns.start >= now_micros
+    if keys is not None:
+        key_ids = np.array([_strings.get(key) for key in keys], dtype=np.int64)
+        mask &= np.isin(columns.key, key_ids)
+    if horizon is not None:
+        until = now_micros + horizon.days * 86_400_000_000
+        for i in np.flatnonzero(mask & (columns.start > until)):
+            if not horizon.is_exam(events[i].summary):
+                mask[i] = False
+    return mask
+
+def _unique_keys(columns: EventColumns, mask: np.ndarray) -> tuple[np.ndarray, np.ndarray]:
+    '''Sorted keys that occur exactly once among the masked events, and the index of their event.'''
+    indices = np.flatnonzero(mask & (columns.key >= 0))
+    keys, first, counts = np.unique(columns.key[indices], return_index=True, return_counts=True)
+    for key in keys[counts > 1]:
+        logger.warning('Ignoring dublicate events with base summary: %s', _strings[key])
+    single = counts == 1
+    return keys[single], indices[first[single]]
+
+def compute_column_changes(
+        old_events: list[Event],
+        old: EventColumns,
+        new_events: list[Event],
+        new: EventColumns,
+        keys: set[str] | None = None,
+        now: float | None = None,
+        horizon: Horizon | None = None
+) -> list[EventChange]:
+    '''
+    Same result as compute_event_changes, with past filtering, key matching and time and
+    location comparison done on columns against a single `now` (epoch seconds).
+    With a `horizon`, only events inside it are compared.
+    '''
+    now_micros = int((time.time() if now is None else now) * 1_000_000)
+    old_mask = _diff_mask(old_events, old, keys, now_micros, horizon)
+    new_mask = _diff_mask(new_events, new, keys, now_micros, horizon)
+
+    old_keys, old_index = _unique_keys(old, old_mask)
+    new_keys, new_index = _unique_keys(new, new_mask)
+
+    changes: list[EventChange] = []
+
+    # removed and added events, in document order
+    for i in np.sort(old_index[~np.isin(old_keys, new_keys, assume_unique=True)]):
+        changes.append(EventChange(old=old_events[i], new=None, change_type=[ChangeType.REMOVED]))
+    for i in np.sort(new_index[~np.isin(new_keys, old_keys, assume_unique=True)]):
+        changes.append(EventChange(old=None, new=new_events[i], change_type=[ChangeType.ADDED]))
+
+    # changed events
+    _, old_common, new_common = np.intersect1d(old_keys, new_keys, assume_unique=True, return_indices=True)
+    o = old_index[old_common]
+    n = new_index[new_common]
+    time_changed = (
+        (old.start[o] != new.start[n]) | (old.end[o] != new.end[n])
+        | (old.start_kind[o] != new.start_kind[n]) | (old.end_kind[o] != new.end_kind[n])
+    )
+    location_changed = old.location[o] != new.location[n]
+
+    changed = np.flatnonzero(time_changed | location_changed)
+    for j in changed[np.argsort(n[changed])]:
+        change_types = []
+        if time_changed[j]:
+            change_types.append(ChangeType.TIME)
+        if location_changed[j]:
+            change_types.append(ChangeType.LOCATION)
+        changes.append(EventChange(old=old_events[o[j]], new=new_events[n[j]], change_type=change_types))
+
+    return changes
+
+def _pair_nearest(old: list[tuple[int, int]], new: list[tuple[int, int]]) -> list[tuple[int, int]]:
+    '''
+    Pair (start, index) entries of old and new events, closest starts first and at most
+    MAX_MOVE apart. Only neighbours on the merged timeline are candidates, so pairs never
+    cross and are found in O(n log n). Returns (old index, new index) pairs.
+    '''
+    points = sorted([(start, 0, index) for start, index in old] + [(start, 1, index) for start, index in new])
+    count = len(points)
+    previous = list(range(-1, count - 1))
+    following = list(range(1, count + 1))
+    heap = [
+        (points[i + 1][0] - points[i][0], i, i + 1)
+        for i in range(count - 1)
+        if points[i][1] != points[i + 1][1] and points[i + 1][0] - points[i][0] <= MAX_MOVE
+    ]
+    heapq.heapify(heap)
+
+    pairs = []
+    while heap:
+        _, a, b = heapq.heappop(heap)
+        # stale once either side was paired, the pair is only current while adjacent
+        if following[a] != b or previous[b] != a:
+            continue
+        old_point, new_point = (points[a], points[b]) if points[a][1] == 0 else (points[b], points[a])
+        pairs.append((old_point[2], new_point[2]))
+
+        before, after = previous[a], following[b]
+        following[a] = previous[b] = -2
+        if before >= 0:
+            following[before] = after
+        if after < count:
+            previous[after] = before
+        if (
+            before >= 0 and after < count and points[before][1] != points[after][1]
+            and points[after][0] - points[before][0] <= MAX_MOVE
+        ):
+            heapq.heappush(heap, (points[after][0] - points[before][0], before, after))
+    return pairs
+
+def _merge_rows(columns: EventColumns, mask: np.ndarray) -> list[tuple]:
+    '''(key, start, end, start kind, end kind, location, index) of the masked events, sorted.'''
+    indices = np.flatnonzero(mask & (columns.key >= 0))
+    return sorted(zip(
+        columns.key[indices].tolist(),
+        columns.start[indices].tolist(),
+        columns.end[indices].tolist(),
+        columns.start_kind[indices].tolist(),
+        columns.end_kind[indices].tolist(),
+        columns.location[indices].tolist(),
+        indices.tolist()
+    ))
+
+def compute_merge_changes(
+        old_events: list[Event],
+        old: EventColumns,
+        new_events: list[Event],
+        new: EventColumns,
+        keys: set[str] | None = None,
+        now: float | None = None,
+        horizon: Horizon | None = None
+) -> list[EventChange]:
+    '''
+    Sort-merge engine. Unlike compute_column_changes it does not drop base summaries
+    that occur more than once, so recurring events are compared too:
+
+    1. events identical in time and location on both sides are matched and dropped,
+    2. the rest are grouped by base summary (see event_key) and paired by UID,
+    3. remaining events of a group are paired by nearest start time (moved occurrences),
+    4. whatever is left over was removed or added.
+
+    With a `horizon`, only events inside it are compared.
+    '''
+    now_micros = int((time.time() if now is None else now) * 1_000_000)
+    old_mask = _diff_mask(old_events, old, keys, now_micros, horizon)
+    new_mask = _diff_mask(new_events, new, keys, now_micros, horizon)
+
+    old_rows = _merge_rows(old, old_mask)
+    new_rows = _merge_rows(new, new_mask)
+
+    # 1. drop identical events, leaving the unmatched ones grouped by key
+    old_left: dict[int, list[tuple]] = {}
+    new_left: dict[int, list[tuple]] = {}
+    i = j = 0
+    while i < len(old_rows) or j < len(new_rows):
+        if j == len(new_rows) or (i < len(old_rows) and old_rows[i][:6] < new_rows[j][:6]):
+            old_left.setdefault(old_rows[i][0], []).append(old_rows[i])
+            i += 1
+        elif i == len(old_rows) or new_rows[j][:6] < old_rows[i][:6]:
+            new_left.setdefault(new_rows[j][0], []).append(new_rows[j])
+            j += 1
+        else:
+            i += 1
+            j += 1
+
+    pairs: list[tuple[int, int]] = []
+    removed: list[int] = []
+    added: list[int] = []
+    for key in old_left.keys() | new_left.keys():
+        old_group = old_left.get(key, [])
+        new_group = new_left.get(key, [])
+
+        # 2. pair by UID
+        by_uid: dict[str, list[tuple]] = {}
+        for row in old_group:
+            uid = old_events[row[6]].uid
+            if uid and uid != 'None':
+                by_uid.setdefault(uid, []).append(row)
+        new_rest = []
+        paired = set()
+        for row in new_group:
+            candidates = by_uid.get(new_events[row[6]].uid)
+            if candidates:
+                old_index = candidates.pop(0)[6]
+                paired.add(old_index)
+                pairs.append((old_index, row[6]))
+            else:
+                new_rest.append(row)
+        old_rest = [row for row in old_group if row[6] not in paired]
+
+        # 3. pair moved occurrences by nearest start
+        nearest = _pair_nearest([(row[1], row[6]) for row in old_rest], [(row[1], row[6]) for row in new_rest])
+        pairs.extend(nearest)
+
+        # 4. leftovers
+        old_paired = {old_index for old_index, _ in nearest}
+        new_paired = {new_index for _, new_index in nearest}
+        removed.extend(row[6] for row in old_rest if row[6] not in old_paired)
+        added.extend(row[6] for row in new_rest if row[6] not in new_paired)
+
+    changes: list[EventChange] = []
+    for i in sorted(removed):
+        changes.append(EventChange(old=old_events[i], new=None, change_type=[ChangeType.REMOVED]))
+    for i in sorted(added):
+        changes.append(EventChange(old=None, new=new_events[i], change_type=[ChangeType.ADDED]))
+    for o, n in sorted(pairs, key=lambda pair: pair[1]):
+        change_types = []
+        if (old.start[o], old.end[o], old.start_kind[o], old.end_kind[o]) != (new.start[n], new.end[n], new.start_kind[n], new.end_kind[n]):
+            change_types.append(ChangeType.TIME)
+        if old.location[o] != new.location[n]:
+            change_types.append(ChangeType.LOCATION)
+        if change_types:
+            changes.append(EventChange(old=old_events[o], new=new_events[n], change_type=change_types))
+    return changes
+
+def compute_parsed_changes(
+        old: ParsedCalendar,
+        new: ParsedCalendar,
+        now: float | None = None,
+        engine: str = 'summary',
+        horizon: Horizon | None = None
+) -> list[EventChange]:
+    '''
+    Compute event changes between two parsed calendars with the given engine, 'summary'
+    (compute_column_changes) or 'merge' (compute_merge_changes). When both carry a
+    fingerprint index, only events grouped under the same keys as added or removed blocks are compared.
+
+    Blocks the old calendar left unparsed, outside its horizon, are taken from the new
+    calendar where unchanged, so events moving into the horizon are not reported as added.
+    If the new calendar has no index (icalendar parsed it), its events outside the old
+    calendar's bounds are taken as unchanged instead, even ones that did change there.
+    '''
+    keys = None
+    if old.blocks is not None and new.blocks is not None:
+        old_counts = Counter(fingerprint for fingerprint, _ in old.blocks)
+        new_counts = Counter(fingerprint for fingerprint, _ in new.blocks)
+        changed = {fingerprint for fingerprint in old_counts.keys() | new_counts.keys() if old_counts[fingerprint] != new_counts[fingerprint]}
+        if not changed:
+            return []
+
+        keys = set()
+        for parsed in (old, new):
+            for fingerprint, event in parsed.index().items():
+                if fingerprint in changed and event is not None and event.summary:
+                    keys.add(event_key(event))
+
+        unparsed = {fingerprint for fingerprint, has_event in old.blocks if has_event is None}
+        if unparsed:
+            entered = [event for fingerprint, event in new.index().items() if fingerprint in unparsed and event is not None]
+            if entered:
+                old = ParsedCalendar(events=old.events + entered, blocks=None)
+    elif old.bounds is not None and horizon is not None and any(has_event is None for _, has_event in old.blocks):
+        # Events the old calendar did parse are compared as usual, even if they moved out of its bounds
+        parsed_uids = {event.uid for event in old.events}
+        entered = [event for event in new.events if event.uid not in parsed_uids and not horizon.includes_event(event, old.bounds)]
+        if entered:
+            old = ParsedCalendar(events=old.events + entered, blocks=None)
+
+    compute = compute_merge_changes if engine == 'merge' else compute_column_changes
+    return compute(old.events, get_columns(old), new.events, get_columns(new), keys, now, horizon)
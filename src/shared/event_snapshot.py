@@ -0,0 +1,70 @@
+import logging
+import msgpack
+from datetime import date, datetime
+from shared.calendar_utils import Event, ParsedCalendar, intern_text
+
+logger = logging.getLogger(__name__)
+
+# Bump whenever the encoded layout changes, older snapshots are then ignored and rebuilt
+SNAPSHOT_VERSION = 4
+
+def _encode_time(value: date | datetime) -> str:
+    # isoformat keeps the wall time and UTC offset, dates stay dates
+    return value.isoformat()
+
+def _decode_time(value: str) -> date | datetime:
+    if 'T' in value:
+        return datetime.fromisoformat(value)
+    return date.fromisoformat(value)
+
+def encode_snapshot(content_hash: str | None, parsed: ParsedCalendar) -> bytes:
+    '''Encode a parsed calendar, and the hash of the calendar it came from, as a msgpack snapshot.'''
+    return msgpack.packb([
+        SNAPSHOT_VERSION,
+        content_hash,
+        [
+            [e.uid, e.summary, _encode_time(e.start), _encode_time(e.end), e.location]
+            for e in parsed.events
+        ],
+        None if parsed.blocks is None else [[fingerprint, has_event] for fingerprint, has_event in parsed.blocks],
+        None if parsed.bounds is None else list(parsed.bounds)
+    ])
+
+def snapshot_hash(data: bytes) -> str | None:
+    '''Hash of the calendar a snapshot came from, read without decoding its events. None if unreadable or outdated.'''
+    try:
+        unpacker = msgpack.Unpacker()
+        unpacker.feed(data)
+        unpacker.read_array_header()
+        if unpacker.unpack() != SNAPSHOT_VERSION:
+            return None
+        return unpacker.unpack()
+    except Exception as e:
+        logger.warning(f'Failed to read event snapshot: {e}')
+        return None
+
+def decode_snapshot(data: bytes) -> tuple[str | None, ParsedCalendar] | None:
+    '''Decode a snapshot into (content_hash, parsed calendar), or None if it is unreadable or outdated.'''
+    try:
+        version, *fields = msgpack.unpackb(data)
+        if version != SNAPSHOT_VERSION:
+            return None
+        content_hash, rows, blocks, bounds = fields
+        events = [
+            Event(
+                uid=uid,
+                summary=intern_text(summary),
+                start=_decode_time(start),
+                end=_decode_time(end),
+                location=intern_text(location)
+            )
+            for uid, summary, start, end, location in rows
+        ]
+        if blocks is not None:
+            blocks = [(fingerprint, has_event) for fingerprint, has_event in blocks]
+            if sum(1 for _, has_event in blocks if has_event) != len(events):
+                return None
+        return content_hash, ParsedCalendar(events=events, blocks=blocks, bounds=None if bounds is None else tuple(bounds))
+    except Exception as e:
+        logger.warning(f'Failed to decode event snapshot: {e}')
+        return None
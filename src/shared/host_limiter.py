@@ -0,0 +1,197 @@
+import math
+import time
+import asyncio
+import logging
+import threading
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+import httpx
+from config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# Statuses that mean the host wants us to slow down
+BACKOFF_STATUSES = frozenset({429, 503})
+
+class HostBusyError(httpx.TransportError):
+    '''Raised when a request could not get a slot for its host in time.'''
+
+def _wake(waiter: asyncio.Future) -> None:
+    if not waiter.done():
+        waiter.set_result(None)
+
+def parse_retry_after(value: str | None) -> float | None:
+    '''Parse a Retry-After header (delay in seconds or HTTP date) into seconds from now.'''
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+class HostLimiter:
+    '''
+    Adaptive concurrency and request-rate limit for a single host.
+
+    Concurrency grows additively while responses are fast and successful, and is cut
+    multiplicatively on slow responses, errors, 429 and 503. The minimum spacing between
+    request starts moves the opposite way. A Retry-After header blocks new requests to
+    the host until it expires.
+    '''
+
+    def __init__(
+            self,
+            host: str,
+            min_concurrency: int = 1,
+            max_concurrency: int = 10,
+            min_interval: float = 0,
+            max_interval: float = 5,
+            target_latency: float = 2,
+            max_retry_after: float = 300
+    ):
+        self.host = host
+        self.min_concurrency = min_concurrency
+        self.max_concurrency = max_concurrency
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.target_latency = target_latency
+        self.max_retry_after = max_retry_after
+
+        self.limit = float(max(min_concurrency, min(max_concurrency, max_concurrency // 2 or 1)))
+        self.interval = min_interval
+        self.in_flight = 0
+        self.blocked_until = 0.0
+        self._next_start = 0.0
+        self._last_decrease = 0.0
+        self._condition = threading.Condition()
+        # Coroutines waiting for a slot, woken on their own loop by release
+        self._async_waiters: list[tuple[asyncio.AbstractEventLoop, asyncio.Future]] = []
+
+    def _try_acquire(self) -> float:
+        '''
+        Take a slot if one is free. Returns 0 on success, otherwise how long to wait before
+        trying again: until the next start is allowed, or indefinitely (inf) until a release.
+        Called with the condition held.
+        '''
+        now = time.monotonic()
+        if now < self.blocked_until:
+            return self.blocked_until - now
+        if now < self._next_start:
+            return self._next_start - now
+        if self.in_flight >= int(self.limit):
+            return math.inf
+        self.in_flight += 1
+        self._next_start = now + self.interval
+        return 0
+
+    def acquire(self, timeout: float | None = None) -> None:
+        '''Wait for a slot, raising HostBusyError after `timeout` seconds, or never if it is None.'''
+        deadline = math.inf if timeout is None else time.monotonic() + timeout
+        with self._condition:
+            while (wait := self._try_acquire()) > 0:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise HostBusyError(f'No request slot available for {self.host}')
+                wait = min(wait, remaining)
+                self._condition.wait(None if wait == math.inf else wait)
+
+    async def acquire_async(self, timeout: float | None = None) -> None:
+        '''Async counterpart of acquire, woken by release rather than polling.'''
+        deadline = math.inf if timeout is None else time.monotonic() + timeout
+        loop = asyncio.get_running_loop()
+        while True:
+            with self._condition:
+                wait = self._try_acquire()
+                if wait == 0:
+                    return
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise HostBusyError(f'No request slot available for {self.host}')
+                waiter = loop.create_future()
+                self._async_waiters.append((loop, waiter))
+
+            wait = min(wait, remaining)
+            try:
+                await asyncio.wait_for(waiter, None if wait == math.inf else wait)
+            except asyncio.TimeoutError:
+                pass
+            finally:
+                with self._condition:
+                    if (loop, waiter) in self._async_waiters:
+                        self._async_waiters.remove((loop, waiter))
+
+    def release(self, status_code: int | None, latency: float, retry_after: float | None = None) -> None:
+        '''Free the slot and adapt the limits to how the request went. status_code is None on transport errors.'''
+        now = time.monotonic()
+        with self._condition:
+            self.in_flight = max(0, self.in_flight - 1)
+
+            if retry_after is not None and status_code in BACKOFF_STATUSES:
+                retry_after = min(retry_after, self.max_retry_after)
+                self.blocked_until = max(self.blocked_until, now + retry_after)
+                logger.warning(f'{self.host} asked to retry after {retry_after:.0f}s')
+
+            failed = status_code is None or status_code in BACKOFF_STATUSES or status_code >= 500
+            if failed or latency > self.target_latency:
+                # Many in-flight requests fail together, count them as one congestion signal
+                if now - self._last_decrease >= max(latency, 1):
+                    self._last_decrease = now
+                    factor = 0.5 if failed else 0.75
+                    self.limit = max(self.min_concurrency, self.limit * factor)
+                    self.interval = min(self.max_interval, max(self.interval * 2, self.min_interval, 0.1))
+                    logger.info(f'Slowing down {self.host}: limit={int(self.limit)}, interval={self.interval:.2f}s')
+            else:
+                self.limit = min(self.max_concurrency, self.limit + 1 / max(self.limit, 1))
+                self.interval = max(self.min_interval, self.interval * 0.9)
+                if self.interval < 0.01:
+                    self.interval = self.min_interval
+
+            self._condition.notify_all()
+            waiters, self._async_waiters = self._async_waiters, []
+        for loop, waiter in waiters:
+            try:
+                loop.call_soon_threadsafe(_wake, waiter)
+            except RuntimeError:
+                # The waiter's loop has been closed
+                pass
+
+    def stats(self) -> dict:
+        with self._condition:
+            return {
+                'limit': int(self.limit),
+                'in_flight': self.in_flight,
+                'interval': round(self.interval, 3),
+                'blocked_for': round(max(0.0, self.blocked_until - time.monotonic()), 1),
+            }
+
+_limiters: dict[str, HostLimiter] = {}
+_limiters_lock = threading.Lock()
+
+def get_host_limiter(host: str) -> HostLimiter:
+    '''Get the process-wide limiter for a host, shared by the API and the worker.'''
+    with _limiters_lock:
+        limiter = _limiters.get(host)
+        if limiter is None:
+            settings = get_settings()
+            limiter = HostLimiter(
+                host,
+                min_concurrency=settings.host_min_concurrency,
+                max_concurrency=settings.host_max_concurrency,
+                min_interval=settings.host_min_interval,
+                max_interval=settings.host_max_interval,
+                target_latency=settings.host_target_latency,
+                max_retry_after=settings.host_max_retry_after
+            )
+            _limiters[host] = limiter
+        return limiter
+
+def get_host_limiter_stats() -> dict[str, dict]:
+    with _limiters_lock:
+        limiters = list(_limiters.values())
+    return {limiter.host: limiter.stats() for limiter in limiters}
@@ -0,0 +1,365 @@
+import time
+import socket
+import asyncio
+import logging
+import threading
+import httpx
+import httpcore
+from config import get_settings
+from shared.host_limiter import get_host_limiter, parse_retry_after
+
+logger = logging.getLogger(__name__)
+
+class DnsCache:
+    '''Thread-safe TTL cache of resolved host addresses.'''
+
+    def __init__(self, ttl: float):
+        self.ttl = ttl
+        self._entries: dict[tuple[str, int], tuple[float, list[str]]] = {}
+        self._lock = threading.Lock()
+
+    def _lookup(self, host: str, port: int) -> list[str] | None:
+        with self._lock:
+            entry = self._entries.get((host, port))
+        if entry is None or entry[0] < time.monotonic():
+            return None
+        return entry[1]
+
+    def _store(self, host: str, port: int, infos) -> list[str]:
+        addresses = list(dict.fromkeys(info[4][0] for info in infos))
+        with self._lock:
+            self._entries[(host, port)] = (time.monotonic() + self.ttl, addresses)
+        return addresses
+
+    def invalidate(self, host: str, port: int) -> None:
+        with self._lock:
+            self._entries.pop((host, port), None)
+
+    def resolve(self, host: str, port: int) -> list[str]:
+        if self.ttl <= 0:
+            return [host]
+        addresses = self._lookup(host, port)
+        if addresses is None:
+            addresses = self._store(host, port, socket.getaddrinfo(host, port, type=socket.SOCK_STREAM))
+        return addresses
+
+    async def resolve_async(self, host: str, port: int) -> list[str]:
+        if self.ttl <= 0:
+            return [host]
+        addresses = self._lookup(host, port)
+        if addresses is None:
+            infos = await asyncio.get_running_loop().getaddrinfo(host, port, type=socket.SOCK_STREAM)
+            addresses = self._store(host, port, infos)
+        return addresses
+
+class ConnectionCounter:
+    '''Counts open connections per host across all clients.'''
+
+    def __init__(self):
+        self._counts: dict[str, int] = {}
+        self._lock = threading.Lock()
+
+    def opened(self, host: str) -> None:
+        with self._lock:
+            self._counts[host] = self._counts.get(host, 0) + 1
+
+    def closed(self, host: str) -> None:
+        with self._lock:
+            remaining = self._counts.get(host, 0) - 1
+            if remaining > 0:
+                self._counts[host] = remaining
+            else:
+                self._counts.pop(host, None)
+
+    def snapshot(self) -> dict[str, int]:
+        with self._lock:
+            return dict(self._counts)
+
+class _Lease:
+    '''Releases a counted connection exactly once.'''
+
+    def __init__(self, counter: ConnectionCounter, host: str):
+        self._counter = counter
+        self._host = host
+        self._released = False
+        counter.opened(host)
+
+    def release(self) -> None:
+        if not self._released:
+            self._released = True
+            self._counter.closed(self._host)
+
+class _TrackedStream(httpcore.NetworkStream):
+    def __init__(self, stream: httpcore.NetworkStream, lease: _Lease):
+        self._stream = stream
+        self._lease = lease
+
+    def read(self, max_bytes: int, timeout: float | None = None) -> bytes:
+        return self._stream.read(max_bytes, timeout)
+
+    def write(self, buffer: bytes, timeout: float | None = None) -> None:
+        self._stream.write(buffer, timeout)
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._lease.release()
+
+    def start_tls(self, ssl_context, server_hostname: str | None = None, timeout: float | None = None) -> httpcore.NetworkStream:
+        try:
+            return _TrackedStream(self._stream.start_tls(ssl_context, server_hostname, timeout), self._lease)
+        except Exception:
+            self._lease.release()
+            raise
+
+    def get_extra_info(self, info: str):
+        return self._stream.get_extra_info(info)
+
+class _AsyncTrackedStream(httpcore.AsyncNetworkStream):
+    def __init__(self, stream: httpcore.AsyncNetworkStream, lease: _Lease):
+        self._stream = stream
+        self._lease = lease
+
+    async def read(self, max_bytes: int, timeout: float | None = None) -> bytes:
+        return await self._stream.read(max_bytes, timeout)
+
+    async def write(self, buffer: bytes, timeout: float | None = None) -> None:
+        await self._stream.write(buffer, timeout)
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._lease.release()
+
+    async def start_tls(self, ssl_context, server_hostname: str | None = None, timeout: float | None = None) -> httpcore.AsyncNetworkStream:
+        try:
+            return _AsyncTrackedStream(await self._stream.start_tls(ssl_context, server_hostname, timeout), self._lease)
+        except Exception:
+            self._lease.release()
+            raise
+
+    def get_extra_info(self, info: str):
+        return self._stream.get_extra_info(info)
+
+class CachingNetworkBackend(httpcore.NetworkBackend):
+    '''
+    Network backend that resolves hosts through a DnsCache and counts open connections.
+    TLS still uses the original hostname for SNI and certificate checks, only the TCP
+    connect goes to the cached address.
+    '''
+
+    def __init__(self, dns_cache: DnsCache, counter: ConnectionCounter):
+        self._backend = httpcore.SyncBackend()
+        self._dns_cache = dns_cache
+        self._counter = counter
+
+    def connect_tcp(self, host: str, port: int, timeout: float | None = None, local_address: str | None = None, socket_options=None) -> httpcore.NetworkStream:
+        error: Exception | None = None
+        for address in self._dns_cache.resolve(host, port):
+            try:
+                stream = self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+                return _TrackedStream(stream, _Lease(self._counter, host))
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        self._dns_cache.invalidate(host, port)
+        raise error or httpcore.ConnectError(f'No addresses for {host}')
+
+    def connect_unix_socket(self, path: str, timeout: float | None = None, socket_options=None) -> httpcore.NetworkStream:
+        return self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    def sleep(self, seconds: float) -> None:
+        self._backend.sleep(seconds)
+
+class AsyncCachingNetworkBackend(httpcore.AsyncNetworkBackend):
+    '''Async counterpart of CachingNetworkBackend.'''
+
+    def __init__(self, dns_cache: DnsCache, counter: ConnectionCounter):
+        self._backend = httpcore.AnyIOBackend()
+        self._dns_cache = dns_cache
+        self._counter = counter
+
+    async def connect_tcp(self, host: str, port: int, timeout: float | None = None, local_address: str | None = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        error: Exception | None = None
+        for address in await self._dns_cache.resolve_async(host, port):
+            try:
+                stream = await self._backend.connect_tcp(address, port, timeout, local_address, socket_options)
+                return _AsyncTrackedStream(stream, _Lease(self._counter, host))
+            except (httpcore.ConnectError, httpcore.ConnectTimeout) as e:
+                error = e
+        self._dns_cache.invalidate(host, port)
+        raise error or httpcore.ConnectError(f'No addresses for {host}')
+
+    async def connect_unix_socket(self, path: str, timeout: float | None = None, socket_options=None) -> httpcore.AsyncNetworkStream:
+        return await self._backend.connect_unix_socket(path, timeout, socket_options)
+
+    async def sleep(self, seconds: float) -> None:
+        await self._backend.sleep(seconds)
+
+class _ReleasingStream(httpx.SyncByteStream):
+    def __init__(self, stream: httpx.SyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    def __iter__(self):
+        yield from self._stream
+
+    def close(self) -> None:
+        try:
+            self._stream.close()
+        finally:
+            self._release()
+
+class _AsyncReleasingStream(httpx.AsyncByteStream):
+    def __init__(self, stream: httpx.AsyncByteStream, release):
+        self._stream = stream
+        self._release = release
+
+    async def __aiter__(self):
+        async for chunk in self._stream:
+            yield chunk
+
+    async def aclose(self) -> None:
+        try:
+            await self._stream.aclose()
+        finally:
+            self._release()
+
+def _release_once(limiter, response: httpx.Response, latency: float):
+    released = False
+    retry_after = parse_retry_after(response.headers.get('Retry-After'))
+
+    def release() -> None:
+        nonlocal released
+        if not released:
+            released = True
+            limiter.release(response.status_code, latency, retry_after)
+    return release
+
+class LimitedTransport(httpx.BaseTransport):
+    '''
+    Runs every request through the per-host limiter.
+    The slot is held until the response body is closed and the limiter learns the
+    status code, latency and Retry-After of each response.
+    '''
+
+    def __init__(self, transport: httpx.BaseTransport, acquire_timeout: float):
+        self._transport = transport
+        self.acquire_timeout = acquire_timeout
+
+    def handle_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = get_host_limiter(request.url.host)
+        limiter.acquire(self.acquire_timeout)
+        start = time.monotonic()
+        try:
+            response = self._transport.handle_request(request)
+        except Exception:
+            limiter.release(None, time.monotonic() - start)
+            raise
+
+        release = _release_once(limiter, response, time.monotonic() - start)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_ReleasingStream(response.stream, release),  # type: ignore[arg-type]
+            extensions=response.extensions
+        )
+
+    def close(self) -> None:
+        self._transport.close()
+
+class AsyncLimitedTransport(httpx.AsyncBaseTransport):
+    '''Async counterpart of LimitedTransport, sharing the same per-host limiters.'''
+
+    def __init__(self, transport: httpx.AsyncBaseTransport, acquire_timeout: float | None):
+        self._transport = transport
+        self.acquire_timeout = acquire_timeout
+
+    async def handle_async_request(self, request: httpx.Request) -> httpx.Response:
+        limiter = get_host_limiter(request.url.host)
+        await limiter.acquire_async(self.acquire_timeout)
+        start = time.monotonic()
+        try:
+            response = await self._transport.handle_async_request(request)
+        except Exception:
+            limiter.release(None, time.monotonic() - start)
+            raise
+
+        release = _release_once(limiter, response, time.monotonic() - start)
+        return httpx.Response(
+            status_code=response.status_code,
+            headers=response.headers,
+            stream=_AsyncReleasingStream(response.stream, release),  # type: ignore[arg-type]
+            extensions=response.extensions
+        )
+
+    async def aclose(self) -> None:
+        await self._transport.aclose()
+
+_dns_cache: DnsCache | None = None
+_connection_counter = ConnectionCounter()
+_http_client: httpx.Client | None = None
+_http_client_lock = threading.Lock()
+
+def _get_dns_cache() -> DnsCache:
+    global _dns_cache
+    if _dns_cache is None:
+        _dns_cache = DnsCache(get_settings().http_dns_cache_ttl)
+    return _dns_cache
+
+def _limits(max_connections: int | None = None) -> httpx.Limits:
+    settings = get_settings()
+    pool_size = max_connections or settings.http_pool_size
+    return httpx.Limits(
+        max_connections=pool_size,
+        max_keepalive_connections=pool_size,
+        keepalive_expiry=settings.http_keepalive_expiry
+    )
+
+def _use_network_backend(transport: httpx.HTTPTransport | httpx.AsyncHTTPTransport, backend) -> None:
+    '''
+    Install a network backend on the transport's httpcore pool. httpx has no public hook for
+    it, so this relies on the pinned httpcore version and fails loudly if the pool changes.
+    '''
+    pool = getattr(transport, '_pool', None)
+    if not isinstance(pool, (httpcore.ConnectionPool, httpcore.AsyncConnectionPool)) or not hasattr(pool, '_network_backend'):
+        raise RuntimeError(f'Unsupported httpcore {httpcore.__version__}, cannot install the caching network backend')
+    pool._network_backend = backend
+
+def get_http_client() -> httpx.Client:
+    '''Get the process-wide pooled HTTP client. Safe to share between threads.'''
+    global _http_client
+    with _http_client_lock:
+        if _http_client is None:
+            settings = get_settings()
+            transport = httpx.HTTPTransport(limits=_limits(), http2=settings.http2_enabled)
+            _use_network_backend(transport, CachingNetworkBackend(_get_dns_cache(), _connection_counter))
+            # Calendar hosts may redirect, as requests followed before
+            _http_client = httpx.Client(
+                transport=LimitedTransport(transport, settings.host_acquire_timeout),
+                timeout=10,
+                follow_redirects=True
+            )
+            logger.info(f'HTTP client initialized: pool_size={settings.http_pool_size}, http2={settings.http2_enabled}')
+        return _http_client
+
+def create_async_http_client(max_connections: int | None = None) -> httpx.AsyncClient:
+    '''
+    Create a pooled async HTTP client for the running event loop.
+    The DNS cache, connection counters and host limiters are shared with the sync client.
+    Requests queue for their host's limiter without a timeout: the worker runs many more
+    fetches than one host allows at once, and waiting for a slot is not a failure.
+    '''
+    settings = get_settings()
+    transport = httpx.AsyncHTTPTransport(limits=_limits(max_connections), http2=settings.http2_enabled)
+    _use_network_backend(transport, AsyncCachingNetworkBackend(_get_dns_cache(), _connection_counter))
+    return httpx.AsyncClient(
+        transport=AsyncLimitedTransport(transport, None),
+        timeout=10,
+        follow_redirects=True
+    )
+
+def get_connection_stats() -> dict[str, int]:
+    '''Open connections per host, across the sync and async clients.'''
+    return _connection_counter.snapshot()
@@ -1,5 +1,5 @@
 import datetime
-from sqlalchemy import String, Boolean, DateTime, Integer, Index
+from sqlalchemy import String, Boolean, DateTime, Integer, Index, LargeBinary
 from sqlalchemy.orm import Mapped, mapped_column
 from sqlalchemy.ext.declarative import declarative_base
 from .encryption import EncryptedString
@@ -11,6 +11,8 @@ class UserCalendar(Base):
     __table_args__ = (
         # Worker's main query filters on both columns every polling cycle
         Index('ix_user_calendars_activated_paused', 'activated', 'paused'),
+        # Due-time scheduler pulls the earliest due active subscriptions
+        Index('ix_user_calendars_due', 'activated', 'paused', 'next_check_at'),
     )
 
     username: Mapped[str] = mapped_column(
@@ -55,6 +57,11 @@ class UserCalendar(Base):
         nullable=True
     )
 
+    next_check_at: Mapped[datetime.datetime | None] = mapped_column(
+        DateTime,
+        nullable=True
+    )
+
     last_change_detected: Mapped[datetime.datetime | None] = mapped_column(
         DateTime,
         nullable=True
@@ -66,6 +73,20 @@ class UserCalendar(Base):
         nullable=False
     )
 
+    # Consecutive checks without detected changes, used by the adaptive polling policy
+    checks_since_change: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        nullable=False
+    )
+
+    # Consecutive failed fetches, while due-time scheduling retries them with backoff
+    fetch_failures: Mapped[int] = mapped_column(
+        Integer,
+        default=0,
+        nullable=False
+    )
+
     previous_calendar_path: Mapped[str | None] = mapped_column(
         String,
         nullable=True
@@ -76,6 +97,29 @@ class UserCalendar(Base):
         nullable=True
     )
 
+    # Hash of the calendar in storage, when a canonically equal fetch moved previous_calendar_hash past it
+    stored_calendar_hash: Mapped[str | None] = mapped_column(
+        String,
+        nullable=True
+    )
+
+    # Hash of the normalised calendar, ignoring volatile properties and past events
+    previous_canonical_hash: Mapped[str | None] = mapped_column(
+        String,
+        nullable=True
+    )
+
+    # Conditional GET validators returned with the stored calendar
+    calendar_etag: Mapped[str | None] = mapped_column(
+        String,
+        nullable=True
+    )
+
+    calendar_last_modified: Mapped[str | None] = mapped_column(
+        String,
+        nullable=True
+    )
+
     language: Mapped[str] = mapped_column(
         String,
         default='hr',
@@ -86,6 +130,55 @@ class UserCalendar(Base):
     def email(self) -> str:
         return f'{self.username}@{self.domain}'
 
+    @property
+    def stored_hash(self) -> str | None:
+        '''Hash of the stored calendar and its snapshot, which the previous version is looked up by.'''
+        return self.stored_calendar_hash or self.previous_calendar_hash
+
+
+class StoredFile(Base):
+    '''Calendar or event snapshot kept in the database, in STORAGE_MODE=database.'''
+    __tablename__ = 'stored_files'
+
+    # Same key as the file name in file storage, e.g. jdoe_fer-hr.ics
+    key: Mapped[str] = mapped_column(
+        String,
+        primary_key=True
+    )
+
+    # Compressed content, bytea in Postgres
+    data: Mapped[bytes] = mapped_column(
+        LargeBinary,
+        nullable=False
+    )
+
+    updated_at: Mapped[datetime.datetime] = mapped_column(
+        DateTime,
+        default=datetime.datetime.now,
+        nullable=False
+    )
+
+
+class PollingOverride(Base):
+    '''Admin override of the polling interval, a single row so it survives restarts.'''
+    __tablename__ = 'polling_override'
+
+    id: Mapped[int] = mapped_column(
+        Integer,
+        primary_key=True
+    )
+
+    # Ceiling on every subscription's polling interval, in seconds
+    interval: Mapped[int] = mapped_column(
+        Integer,
+        nullable=False
+    )
+
+    until: Mapped[datetime.datetime] = mapped_column(
+        DateTime,
+        nullable=False
+    )
+
 
 class AuditLog(Base):
     __tablename__ = 'audit_log'
@@ -0,0 +1,484 @@
+import os
+import mmap
+import zlib
+import struct
+import logging
+import threading
+from dataclasses import dataclass, field
+from .storage_manager import StorageManager, decompress, write_file_atomic
+
+logger = logging.getLogger(__name__)
+
+# Record header: magic, flags, key length, data length, sequence number, crc32 of key and data
+RECORD = struct.Struct('<2sBHIQI')
+RECORD_MAGIC = b'SR'
+# Hint entry: flags, key length, data length, sequence number, data offset
+HINT = struct.Struct('<BHIQQ')
+TOMBSTONE = 1
+
+SEGMENT_SUFFIX = '.seg'
+HINT_SUFFIX = '.hint'
+# Compaction output until it is sealed, renamed to a segment only once its hint file exists
+COMPACTING_SUFFIX = '.compacting'
+# Sealed segments are compacted once at least this share of their bytes is superseded
+COMPACT_RATIO = 0.5
+
+@dataclass(slots=True)
+class Location:
+    segment: int
+    offset: int
+    length: int
+    seq: int
+    # Whole record, header and key included
+    size: int
+
+@dataclass(slots=True)
+class Entry:
+    key: str
+    flags: int
+    seq: int
+    offset: int
+    length: int
+
+    @property
+    def size(self) -> int:
+        return RECORD.size + len(self.key.encode('utf-8')) + self.length
+
+@dataclass
+class Segment:
+    '''
+    One append-only segment file. The active segment is appended to and read with
+    pread; sealed segments are immutable, memory-mapped, and indexed by a hint file.
+    '''
+    id: int
+    path: str
+    size: int = 0
+    # Records of the active segment, written out as its hint file when sealed
+    entries: list[Entry] = field(default_factory=list)
+    map: mmap.mmap | None = None
+
+    def __post_init__(self):
+        self.file = open(self.path, 'a+b')
+        self.size = self.file.seek(0, os.SEEK_END)
+
+    @property
+    def hint_path(self) -> str:
+        return os.path.join(os.path.dirname(self.path), f'{self.id:08d}{HINT_SUFFIX}')
+
+    def append(self, record: bytes) -> int:
+        '''Append a record, which is only durable once the segment is synced.'''
+        offset = self.size
+        self.file.write(record)
+        self.file.flush()
+        self.size += len(record)
+        return offset
+
+    def sync(self) -> None:
+        os.fsync(self.file.fileno())
+
+    def read(self, offset: int, length: int) -> bytes:
+        if self.map is not None:
+            return self.map[offset:offset + length]
+        return os.pread(self.file.fileno(), length, offset)
+
+    def scan(self) -> list[Entry]:
+        '''Records of the segment, read from the file. A torn or corrupt tail is cut off.'''
+        entries = []
+        offset = 0
+        while offset + RECORD.size <= self.size:
+            magic, flags, key_length, length, seq, crc = RECORD.unpack(os.pread(self.file.fileno(), RECORD.size, offset))
+            body = os.pread(self.file.fileno(), key_length + length, offset + RECORD.size)
+            if magic != RECORD_MAGIC or len(body) < key_length + length or zlib.crc32(body) != crc:
+                break
+            entries.append(Entry(body[:key_length].decode('utf-8'), flags, seq, offset + RECORD.size + key_length, length))
+            offset += RECORD.size + key_length + length
+
+        if offset < self.size:
+            logger.warning(f'Truncating {self.size - offset} bytes of incomplete records from {self.path}')
+            self.file.truncate(offset)
+            self.size = offset
+        return entries
+
+    def load_hint(self) -> list[Entry] | None:
+        try:
+            with open(self.hint_path, 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            return None
+
+        entries = []
+        offset = 0
+        while offset < len(data):
+            flags, key_length, length, seq, data_offset = HINT.unpack_from(data, offset)
+            offset += HINT.size
+            entries.append(Entry(data[offset:offset + key_length].decode('utf-8'), flags, seq, data_offset, length))
+            offset += key_length
+        return entries
+
+    def seal(self) -> None:
+        '''Write the hint file and map the segment, which is never appended to again.'''
+        self.sync()
+        hint = bytearray()
+        for entry in self.entries:
+            key = entry.key.encode('utf-8')
+            hint += HINT.pack(entry.flags, len(key), entry.length, entry.seq, entry.offset) + key
+        write_file_atomic(self.hint_path, bytes(hint))
+        self.entries = []
+        self.map_file()
+
+    def rename(self, path: str) -> None:
+        os.rename(self.path, path)
+        self.path = path
+
+    def map_file(self) -> None:
+        if self.size > 0:
+            self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+    def close(self) -> None:
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        self.file.close()
+
+    def remove(self) -> None:
+        self.close()
+        # Without its hint file a segment is scanned at startup, a hint without a segment would be stale
+        for path in (self.hint_path, self.path):
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+
+class SegmentStore:
+    '''
+    Log-structured key-value store. Writes append a record to the active segment,
+    which is sealed once it reaches segment_bytes. Every record carries a sequence
+    number, so the latest version of a key wins however segments are ordered, and
+    the key to location index is rebuilt at startup from the hint files of sealed
+    segments and a scan of the active one. A background thread compacts the sealed
+    segments into new ones without superseded versions and deleted keys.
+
+    Writes return once their record is synced to disk. Writers arriving while a sync
+    is running wait for the next one, which covers all of them (group commit).
+    '''
+
+    def __init__(self, path: str, segment_bytes: int, compact_interval: float):
+        self.path = path
+        self.segment_bytes = segment_bytes
+        self.compact_interval = compact_interval
+        os.makedirs(path, exist_ok=True)
+
+        self._lock = threading.Lock()
+        self._compact_lock = threading.Lock()
+        self._segments: dict[int, Segment] = {}
+        self._index: dict[str, Location] = {}
+        # Superseded bytes by segment
+        self._dead: dict[int, int] = {}
+        self._seq = 0
+        self._next_id = 1
+        # Group commit: records appended and records known synced, counted since startup
+        self._appended = 0
+        self._synced = 0
+        self._syncing = False
+        self._sync_cond = threading.Condition()
+        self.syncs = 0
+        self.compactions = 0
+        self.compacted_bytes = 0
+        self._load()
+
+        self._stop = threading.Event()
+        if compact_interval > 0:
+            threading.Thread(target=self._compact_loop, name='SegmentCompaction', daemon=True).start()
+
+    def _segment_path(self, segment_id: int) -> str:
+        return os.path.join(self.path, f'{segment_id:08d}{SEGMENT_SUFFIX}')
+
+    def _new_segment(self, compacting: bool = False) -> Segment:
+        path = self._segment_path(self._next_id)
+        segment = Segment(self._next_id, path + COMPACTING_SUFFIX if compacting else path)
+        self._next_id += 1
+        self._segments[segment.id] = segment
+        self._dead[segment.id] = 0
+        return segment
+
+    def _load(self) -> None:
+        # Output of an interrupted compaction, the segments it was compacting are still there
+        for name in os.listdir(self.path):
+            if name.endswith(COMPACTING_SUFFIX):
+                logger.warning(f'Removing {name} left by an interrupted compaction')
+                segment_id = name[:-len(SEGMENT_SUFFIX + COMPACTING_SUFFIX)]
+                for path in (os.path.join(self.path, segment_id + HINT_SUFFIX), os.path.join(self.path, name)):
+                    try:
+                        os.remove(path)
+                    except FileNotFoundError:
+                        pass
+
+        ids = sorted(int(name[:-len(SEGMENT_SUFFIX)]) for name in os.listdir(self.path) if name.endswith(SEGMENT_SUFFIX))
+        deleted: dict[str, int] = {}
+        active = None
+        for segment_id in ids:
+            segment = Segment(segment_id, self._segment_path(segment_id))
+            self._segments[segment_id] = segment
+            self._dead[segment_id] = 0
+            entries = segment.load_hint()
+            if entries is None:
+                entries = segment.scan()
+                segment.entries = list(entries)
+                # Only the newest segment stays open for appends, any other lost its hint file while being removed
+                if segment_id == ids[-1]:
+                    active = segment
+                else:
+                    segment.seal()
+            else:
+                segment.map_file()
+            for entry in entries:
+                self._apply(segment_id, entry, deleted)
+
+        self._next_id = ids[-1] + 1 if ids else 1
+        self._active = active if active is not None else self._new_segment()
+        logger.info(f'Segment store opened: {len(self._index)} keys in {len(self._segments)} segment(s)')
+
+    def _apply(self, segment_id: int, entry: Entry, deleted: dict[str, int] | None = None) -> None:
+        '''Index a record, unless a newer version of its key is already indexed.'''
+        current = self._index.get(entry.key)
+        latest = max(current.seq if current is not None else -1, deleted.get(entry.key, -1) if deleted else -1)
+        if entry.seq < latest:
+            self._dead[segment_id] += entry.size
+            return
+
+        self._seq = max(self._seq, entry.seq + 1)
+        if current is not None:
+            self._dead[current.segment] += current.size
+            del self._index[entry.key]
+        if entry.flags & TOMBSTONE:
+            self._dead[segment_id] += entry.size
+            if deleted is not None:
+                deleted[entry.key] = entry.seq
+        else:
+            self._index[entry.key] = Location(segment_id, entry.offset, entry.length, entry.seq, entry.size)
+
+    def _append(self, segment: Segment, key: str, data: bytes, flags: int, seq: int) -> Entry:
+        key_bytes = key.encode('utf-8')
+        crc = zlib.crc32(data, zlib.crc32(key_bytes))
+        offset = segment.append(RECORD.pack(RECORD_MAGIC, flags, len(key_bytes), len(data), seq, crc) + key_bytes + data)
+        entry = Entry(key, flags, seq, offset + RECORD.size + len(key_bytes), len(data))
+        segment.entries.append(entry)
+        return entry
+
+    def _write(self, key: str, data: bytes, flags: int) -> int:
+        '''Append a record and index it, returning its number for _sync. Called with the lock held.'''
+        segment = self._active
+        entry = self._append(segment, key, data, flags, self._seq)
+        self._apply(segment.id, entry)
+        self._appended += 1
+        if segment.size >= self.segment_bytes:
+            # Sealing syncs the segment, so its records need no further sync
+            segment.seal()
+            self._active = self._new_segment()
+        return self._appended
+
+    def _sync(self, appended: int) -> None:
+        '''Wait until the first `appended` records are on disk, syncing them and any appended meanwhile.'''
+        with self._sync_cond:
+            while self._synced < appended and self._syncing:
+                self._sync_cond.wait()
+            if self._synced >= appended:
+                return
+            self._syncing = True
+
+        synced = self._synced
+        try:
+            with self._lock:
+                covered = self._appended
+                segment = self._active
+            segment.sync()
+            synced = covered
+        finally:
+            with self._sync_cond:
+                self._syncing = False
+                self._synced = max(self._synced, synced)
+                self.syncs += 1
+                self._sync_cond.notify_all()
+
+    def put(self, key: str, data: bytes) -> None:
+        with self._lock:
+            appended = self._write(key, data, 0)
+        self._sync(appended)
+
+    def delete(self, key: str) -> bool:
+        with self._lock:
+            if key not in self._index:
+                return False
+            appended = self._write(key, b'', TOMBSTONE)
+        self._sync(appended)
+        return True
+
+    def get(self, key: str) -> bytes | None:
+        with self._lock:
+            location = self._index.get(key)
+            if location is None:
+                return None
+            return self._segments[location.segment].read(location.offset, location.length)
+
+    def get_many(self, keys: list[str]) -> dict[str, bytes]:
+        with self._lock:
+            locations = [(key, self._index[key]) for key in keys if key in self._index]
+            # In file order, so a batch reads each segment front to back
+            locations.sort(key=lambda item: (item[1].segment, item[1].offset))
+            return {key: self._segments[location.segment].read(location.offset, location.length) for key, location in locations}
+
+    def __len__(self) -> int:
+        with self._lock:
+            return len(self._index)
+
+    def compact(self, force: bool = False) -> bool:
+        '''
+        Rewrite the live records of all sealed segments into new segments and remove
+        the old ones, if enough of them is superseded or force is set. Writes and reads
+        continue meanwhile: sealed segments never change, and a key written again during
+        compaction keeps pointing at its newer version.
+        '''
+        with self._compact_lock:
+            with self._lock:
+                sealed = [segment for segment in self._segments.values() if segment is not self._active]
+                total = sum(segment.size for segment in sealed)
+                dead = sum(self._dead[segment.id] for segment in sealed)
+                if not sealed or not dead or (not force and dead < total * COMPACT_RATIO):
+                    return False
+                sealed_ids = {segment.id for segment in sealed}
+                live = sorted(
+                    ((key, location) for key, location in self._index.items() if location.segment in sealed_ids),
+                    key=lambda item: (item[1].segment, item[1].offset)
+                )
+                output = self._new_segment(compacting=True)
+            outputs = [output]
+
+            moved: list[tuple[str, Location, Location]] = []
+            for key, location in live:
+                if output.size >= self.segment_bytes:
+                    output.seal()
+                    with self._lock:
+                        output = self._new_segment(compacting=True)
+                    outputs.append(output)
+                data = self._segments[location.segment].read(location.offset, location.length)
+                # Synced once when sealed, the old segments are only removed after that
+                entry = self._append(output, key, data, 0, location.seq)
+                moved.append((key, location, Location(output.id, entry.offset, entry.length, entry.seq, entry.size)))
+            output.seal()
+
+            # Sealed outputs have their hint files, so a restart never takes them for the active segment
+            for output in outputs:
+                output.rename(self._segment_path(output.id))
+            self._sync_dir()
+
+            with self._lock:
+                for key, old, new in moved:
+                    if self._index.get(key) is old:
+                        self._index[key] = new
+                    else:
+                        # Written again or deleted while compacting
+                        self._dead[new.segment] += new.size
+                for segment in sealed:
+                    del self._segments[segment.id]
+                    del self._dead[segment.id]
+                    segment.remove()
+                self.compactions += 1
+                self.compacted_bytes += total - sum(segment.size for segment in outputs)
+
+            logger.info(f'Compacted {len(sealed)} segment(s) into {len(outputs)}, {len(moved)} live record(s) kept')
+            return True
+
+    def _sync_dir(self) -> None:
+        fd = os.open(self.path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _compact_loop(self) -> None:
+        while not self._stop.wait(self.compact_interval):
+            try:
+                self.compact()
+            except Exception as e:
+                logger.exception(f'Error compacting segment store: {e}')
+
+    def close(self) -> None:
+        self._stop.set()
+        with self._compact_lock, self._lock:
+            for segment in self._segments.values():
+                segment.close()
+            self._segments.clear()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'keys': len(self._index),
+                'segments': len(self._segments),
+                'bytes': sum(segment.size for segment in self._segments.values()),
+                'dead_bytes': sum(self._dead.values()),
+                'syncs': self.syncs,
+                'compactions': self.compactions,
+                'compacted_bytes': self.compacted_bytes,
+            }
+
+# One store per directory, shared by every SegmentStorageManager of the process
+_stores: dict[str, SegmentStore] = {}
+_stores_lock = threading.Lock()
+
+def open_segment_store(path: str, segment_bytes: int, compact_interval: float) -> SegmentStore:
+    path = os.path.abspath(path)
+    with _stores_lock:
+        if path not in _stores:
+            _stores[path] = SegmentStore(path, segment_bytes, compact_interval)
+        return _stores[path]
+
+class SegmentStorageManager(StorageManager):
+    '''
+    Stores calendars and their event snapshots compressed in a log-structured segment
+    store, so writes are sequential appends to one file and a batch of reads comes out
+    of a few memory-mapped segments.
+    '''
+
+    bulk_reads = True
+
+    def __init__(self, compression: str = 'gzip', cache_bytes: int = 0, segment_bytes: int = 64 * 1024 * 1024, compact_interval: float = 600):
+        super().__init__('compressed', compression, cache_bytes)
+        self.store = open_segment_store(os.path.join(self.storage_path, '..', 'segments'), segment_bytes, compact_interval)
+
+    def _write(self, key: str, data: bytes) -> str:
+        self.store.put(key, self._encode(data))
+        return self._path(key)
+
+    def _read(self, key: str) -> bytes | None:
+        data = self.store.get(key)
+        return decompress(data) if data is not None else None
+
+    def _read_many(self, keys: list[str]) -> dict[str, bytes]:
+        return {key: decompress(data) for key, data in self.store.get_many(keys).items()}
+
+    def _delete(self, key: str) -> bool:
+        return self.store.delete(key)
+
+    def _path(self, key: str) -> str:
+        # Recorded as the subscription's previous calendar path
+        return f'segments/{key}'
+
+    def stats(self) -> dict | None:
+        return self.store.stats()
+
+    def migrate_files(self) -> tuple[int, int]:
+        """
+        Moves every calendar and snapshot file, in either file layout, into the segment store.
+
+        :return: (files moved, keys already in the store that no file replaced).
+        """
+        migrated = 0
+        for path, key in self._stored_files():
+            with open(path, 'rb') as f:
+                self._write(key, decompress(f.read()))
+            os.remove(path)
+            migrated += 1
+
+        stored = len(self.store)
+        logger.info(f'Storage migration complete: {migrated} file(s) moved into the segment store, {stored - migrated} key(s) already there.')
+        return migrated, stored - migrated
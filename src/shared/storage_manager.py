@@ -1,80 +1,370 @@
 import os
+import gzip
+import hashlib
 import logging
+import tempfile
+from .lru_cache import SizedLRUCache
+
+try:
+    from compression import zstd  # Python 3.14+
+    _zstd_compress, _zstd_decompress = zstd.compress, zstd.decompress
+except ImportError:
+    try:
+        import zstandard
+        _zstd_compress = lambda data: zstandard.ZstdCompressor().compress(data)
+        _zstd_decompress = lambda data: zstandard.ZstdDecompressor().decompress(data)
+    except ImportError:
+        _zstd_compress = _zstd_decompress = None
 
 logger = logging.getLogger(__name__)
 
+GZIP_MAGIC = b'\x1f\x8b'
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+TEMP_PREFIX = '.tmp-'
+# Users whose stored content warm_cache loads per bulk read
+WARM_BATCH_SIZE = 500
+
 def get_file_key(email: str) -> str:
     return f"{email.replace('@', '_').replace('.', '-')}.ics"
 
+def get_snapshot_key(email: str) -> str:
+    return f"{email.replace('@', '_').replace('.', '-')}.events"
+
+def compress(data: bytes, compression: str) -> bytes:
+    if compression == 'zstd':
+        return _zstd_compress(data)
+    return gzip.compress(data, compresslevel=6)
+
+def decompress(data: bytes) -> bytes:
+    '''Decompress gzip or zstd data, recognised by its magic bytes. Anything else is returned as is.'''
+    if data.startswith(GZIP_MAGIC):
+        return gzip.decompress(data)
+    if data.startswith(ZSTD_MAGIC):
+        if _zstd_decompress is None:
+            raise RuntimeError('zstd-compressed file, but no zstd support is available')
+        return _zstd_decompress(data)
+    return data
+
+def read_file(path: str) -> bytes:
+    '''Read a stored file, compressed or not.'''
+    with open(path, 'rb') as f:
+        return decompress(f.read())
+
+def write_file_atomic(path: str, data: bytes) -> None:
+    '''Write a file through a temporary file and a rename, so readers never see a partial file.'''
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    fd, temp_path = tempfile.mkstemp(dir=directory, prefix=TEMP_PREFIX)
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(temp_path, path)
+    except BaseException:
+        try:
+            os.remove(temp_path)
+        except OSError:
+            pass
+        raise
+
 class StorageManager:
-    def __init__(self):
+    '''
+    Stores calendars and their event snapshots as files.
+
+    In 'plain' mode files are written uncompressed into one flat directory. In
+    'compressed' mode they are compressed with gzip or zstd and spread over
+    two levels of hash-prefixed subdirectories. Reads look in both layouts and
+    recognise compression by content, so switching modes needs no migration
+    (db_manager storage rewrites existing files into the current mode).
+    DatabaseStorageManager and SegmentStorageManager keep the same content in
+    Postgres or in append-only segment files instead.
+
+    With a cache budget, content read or written is also kept in memory, up to
+    cache_bytes in total, so reads of recently used calendars skip storage. Cached
+    content is tagged with the hash of the calendar it belongs to and only served to
+    callers expecting that hash, so content replaced by another worker replica is
+    read from storage again. Reads without a hash always go to storage.
+    '''
+
+    # Whether _read_many loads many keys at a fraction of the cost of as many _read calls
+    bulk_reads = False
+
+    def __init__(self, mode: str = 'plain', compression: str = 'gzip', cache_bytes: int = 0):
         current_dir = os.path.dirname(os.path.abspath(__file__))
 
         self.__storage_path = os.path.join(current_dir, '../..', 'data', 'calendars')
         os.makedirs(self.__storage_path, exist_ok=True)
 
-    def save_calendar(self, email: str, ics_content: str) -> str | None:
+        if compression == 'zstd' and _zstd_compress is None:
+            logger.warning('zstd is not available, compressing calendars with gzip')
+            compression = 'gzip'
+        self.mode = mode
+        self.compression = compression
+        # (calendar hash, decompressed content) by key, written through on every save
+        self.cache: SizedLRUCache[tuple[str, bytes]] = SizedLRUCache(cache_bytes, sizeof=lambda entry: len(entry[1]))
+
+    @property
+    def storage_path(self) -> str:
+        return self.__storage_path
+
+    def _flat_path(self, key: str) -> str:
+        return os.path.join(self.__storage_path, key)
+
+    def _sharded_path(self, key: str) -> str:
+        digest = hashlib.sha1(key.encode('utf-8')).hexdigest()
+        return os.path.join(self.__storage_path, digest[:2], digest[2:4], key)
+
+    def _path(self, key: str) -> str:
+        return self._sharded_path(key) if self.mode == 'compressed' else self._flat_path(key)
+
+    def _other_path(self, key: str) -> str:
+        return self._flat_path(key) if self.mode == 'compressed' else self._sharded_path(key)
+
+    def _encode(self, data: bytes) -> bytes:
+        return compress(data, self.compression) if self.mode == 'compressed' else data
+
+    def _is_encoded(self, stored: bytes) -> bool:
+        '''Whether stored file content is already in the current mode's encoding.'''
+        if self.mode == 'compressed':
+            return stored.startswith(ZSTD_MAGIC if self.compression == 'zstd' else GZIP_MAGIC)
+        return not stored.startswith((GZIP_MAGIC, ZSTD_MAGIC))
+
+    def _write(self, key: str, data: bytes) -> str:
+        path = self._path(key)
+        write_file_atomic(path, self._encode(data))
+        # A copy left in the other layout would be stale once the mode is switched back
+        other = self._other_path(key)
+        if os.path.exists(other):
+            os.remove(other)
+        return path
+
+    def _read(self, key: str) -> bytes | None:
+        for path in (self._path(key), self._other_path(key)):
+            if os.path.exists(path):
+                return read_file(path)
+        return None
+
+    def _read_many(self, keys: list[str]) -> dict[str, bytes]:
+        stored = {}
+        for key in keys:
+            data = self._read(key)
+            if data is not None:
+                stored[key] = data
+        return stored
+
+    def _delete(self, key: str) -> bool:
+        deleted = False
+        for path in (self._path(key), self._other_path(key)):
+            if os.path.exists(path):
+                os.remove(path)
+                deleted = True
+        return deleted
+
+    def _cached(self, key: str, version: str | None) -> bytes | None:
+        if version is None:
+            return None
+        entry = self.cache.get(key, lambda entry: entry[0] == version)
+        return entry[1] if entry is not None else None
+
+    def _load(self, key: str, version: str | None = None) -> bytes | None:
+        data = self._cached(key, version)
+        if data is None:
+            data = self._read(key)
+            if data is not None and version is not None:
+                self.cache.put(key, (version, data))
+        return data
+
+    def _load_many(self, keys: list[str], versions: dict[str, str] | None = None) -> dict[str, bytes]:
+        versions = versions or {}
+        loaded = {}
+        missing = []
+        for key in keys:
+            data = self._cached(key, versions.get(key))
+            if data is not None:
+                loaded[key] = data
+            else:
+                missing.append(key)
+        if missing:
+            for key, data in self._read_many(missing).items():
+                if versions.get(key) is not None:
+                    self.cache.put(key, (versions[key], data))
+                loaded[key] = data
+        return loaded
+
+    def _store(self, key: str, data: bytes, version: str | None = None) -> str:
+        path = self._write(key, data)
+        if version is not None:
+            self.cache.put(key, (version, data))
+        else:
+            self.cache.pop(key)
+        return path
+
+    def _remove(self, key: str) -> bool:
+        self.cache.pop(key)
+        return self._delete(key)
+
+    def save_calendar(self, email: str, ics_content: str, content_hash: str | None = None) -> str | None:
         """
         Updates (or creates if it doesn't exist) a calendar for a user in local storage.
 
         :param email: The user's email address.
         :param ics_content: The calendar content in iCalendar format.
+        :param content_hash: Hash of the calendar, under which it is cached.
         :return: The URL of the uploaded calendar file.
         """
-        file_key = get_file_key(email)
-        file_path = os.path.join(self.__storage_path, file_key)
-
         try:
-            with open(file_path, 'w', encoding='utf-8') as f:
-                f.write(ics_content)
-            url = self.get_calendar_path(email)
+            url = self._store(get_file_key(email), ics_content.encode('utf-8'), content_hash)
             logger.info(f'Successfully updated calendar for {email}')
             return url
         except Exception as e:
             logger.error(f'Error updating calendar for {email}: {e}')
             return None
 
-    def get_calendar(self, email: str) -> str | None:
+    def get_calendar(self, email: str, content_hash: str | None = None) -> str | None:
         """
         Retrieves the calendar content of a user from storage.
 
         :param email: The user's email address.
+        :param content_hash: Hash of the expected calendar, which may then come from the cache.
         :return: The calendar content as a string, or None if not found.
         """
-        file_key = get_file_key(email)
-        file_path = os.path.join(self.__storage_path, file_key)
-
         try:
-            if not os.path.exists(file_path):
+            data = self._load(get_file_key(email), content_hash)
+            if data is None:
                 logger.warning(f'Calendar content not found for {email}')
                 return None
-            
-            with open(file_path, 'r', encoding='utf-8') as f:
-                content = f.read()
+
             logger.info(f'Successfully retrieved calendar for {email}')
-            return content
+            return data.decode('utf-8')
         except Exception as e:
             logger.error(f'Error retrieving calendar for {email}: {e}')
             return None
 
-    def delete_calendar(self, email: str):
+    def get_calendars(self, emails: list[str], content_hashes: dict[str, str] | None = None) -> dict[str, str]:
+        """
+        Retrieves the calendar content of many users from storage at once.
+
+        :param emails: The users' email addresses.
+        :param content_hashes: Hashes of the expected calendars by email address, which may then come from the cache.
+        :return: Calendar content by email address, without users whose calendar is not found.
+        """
+        try:
+            keys = {get_file_key(email): email for email in emails}
+            versions = {get_file_key(email): content_hash for email, content_hash in (content_hashes or {}).items()}
+            return {keys[key]: data.decode('utf-8') for key, data in self._load_many(list(keys), versions).items()}
+        except Exception as e:
+            logger.error(f'Error retrieving {len(emails)} calendars: {e}')
+            return {}
+
+    def save_snapshot(self, email: str, data: bytes, content_hash: str | None = None) -> bool:
+        """
+        Updates (or creates if it doesn't exist) the parsed event snapshot of a user's calendar.
+
+        :param email: The user's email address.
+        :param data: The encoded snapshot.
+        :param content_hash: Hash of the calendar the snapshot was made from, under which it is cached.
+        :return: True if the snapshot was written.
+        """
+        try:
+            self._store(get_snapshot_key(email), data, content_hash)
+            return True
+        except Exception as e:
+            logger.error(f'Error updating event snapshot for {email}: {e}')
+            return False
+
+    def get_snapshot(self, email: str, content_hash: str | None = None) -> bytes | None:
         """
-        Deletes the calendar file of a user from storage.
+        Retrieves the parsed event snapshot of a user's calendar from storage.
 
         :param email: The user's email address.
+        :param content_hash: Hash of the calendar the snapshot is expected for, which may then come from the cache.
+        :return: The encoded snapshot, or None if not found.
+        """
+        try:
+            return self._load(get_snapshot_key(email), content_hash)
+        except Exception as e:
+            logger.error(f'Error retrieving event snapshot for {email}: {e}')
+            return None
+
+    def get_snapshots(self, emails: list[str], content_hashes: dict[str, str] | None = None) -> dict[str, bytes]:
+        """
+        Retrieves the parsed event snapshots of many users' calendars from storage at once.
+
+        :param emails: The users' email addresses.
+        :param content_hashes: Hashes of the calendars the snapshots are expected for, by email address, which may then come from the cache.
+        :return: Encoded snapshots by email address, without users whose snapshot is not found.
+        """
+        try:
+            keys = {get_snapshot_key(email): email for email in emails}
+            versions = {get_snapshot_key(email): content_hash for email, content_hash in (content_hashes or {}).items()}
+            return {keys[key]: data for key, data in self._load_many(list(keys), versions).items()}
+        except Exception as e:
+            logger.error(f'Error retrieving {len(emails)} event snapshots: {e}')
+            return {}
+
+    def delete_snapshot(self, email: str) -> bool:
+        """
+        Deletes the parsed event snapshot of a user's calendar from storage, leaving the calendar.
+
+        :param email: The user's email address.
+        :return: True if a snapshot was deleted.
+        """
+        try:
+            return self._remove(get_snapshot_key(email))
+        except Exception as e:
+            logger.error(f'Error deleting event snapshot for {email}: {e}')
+            return False
+
+    def delete_calendar(self, email: str):
         """
-        file_key = get_file_key(email)
-        file_path = os.path.join(self.__storage_path, file_key)
+        Deletes the calendar file and event snapshot of a user from storage.
 
+        :param email: The user's email address.
+        """
         try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
+            if self._remove(get_file_key(email)):
                 logger.info(f'Successfully deleted calendar for {email}')
             else:
                 logger.warning(f'Calendar file not found for {email}')
+            self._remove(get_snapshot_key(email))
         except Exception as e:
             logger.error(f'Error deleting calendar for {email}: {e}')
 
+    def warm_cache(self, content_hashes: dict[str, str]) -> int:
+        """
+        Loads the stored content of users into the cache, in the given order, until the
+        cache is full: the event snapshot, or the calendar of users without a snapshot.
+
+        :param content_hashes: Hashes of the users' stored calendars by email address, the most likely to be needed first.
+        :return: The number of users whose content was loaded.
+        """
+        if self.cache.maxbytes <= 0:
+            return 0
+
+        emails = list(content_hashes)
+        warmed = 0
+        try:
+            for i in range(0, len(emails), WARM_BATCH_SIZE):
+                batch = emails[i:i + WARM_BATCH_SIZE]
+                stored = self._read_many([get_snapshot_key(email) for email in batch])
+                stored.update(self._read_many([get_file_key(email) for email in batch if get_snapshot_key(email) not in stored]))
+                for email in batch:
+                    key = get_snapshot_key(email) if get_snapshot_key(email) in stored else get_file_key(email)
+                    data = stored.get(key)
+                    if data is None:
+                        continue
+                    if not self.cache.fits(len(data)):
+                        return warmed
+                    self.cache.put(key, (content_hashes[email], data))
+                    warmed += 1
+            return warmed
+        except Exception as e:
+            logger.error(f'Error warming the storage cache: {e}')
+            return warmed
+        finally:
+            logger.info(f'Storage cache warmed with {warmed} of {len(emails)} users ({self.cache.bytes} bytes)')
+
     def get_calendar_path(self, email: str) -> str:
         """
         Generages the public URL of a user's calendar file.
@@ -82,5 +372,43 @@ class StorageManager:
         :param email: The user's email address.
         :return: The URL of the calendar file.
         """
-        file_key = get_file_key(email)
-        return os.path.join(self.__storage_path, file_key)
+        return self._path(get_file_key(email))
+
+    def _stored_files(self) -> list[tuple[str, str]]:
+        '''(path, key) of every calendar and snapshot file, in either layout.'''
+        files = []
+        # Listed up front, a walk would otherwise also visit files written while migrating
+        for directory, _, names in os.walk(self.__storage_path):
+            for name in names:
+                path = os.path.join(directory, name)
+                if name.startswith(TEMP_PREFIX):
+                    # Left behind by an interrupted write
+                    os.remove(path)
+                elif name.endswith(('.ics', '.events')):
+                    files.append((path, name))
+        return files
+
+    def stats(self) -> dict | None:
+        '''Statistics of the storage backend, if it keeps any.'''
+        return None
+
+    def migrate_files(self) -> tuple[int, int]:
+        """
+        Rewrites every stored calendar and snapshot into the current mode's layout and compression.
+
+        :return: (files rewritten, files already up to date).
+        """
+        migrated = 0
+        unchanged = 0
+        for path, name in self._stored_files():
+            with open(path, 'rb') as f:
+                stored = f.read()
+            if os.path.abspath(path) == os.path.abspath(self._path(name)) and self._is_encoded(stored):
+                unchanged += 1
+                continue
+
+            self._write(name, decompress(stored))
+            migrated += 1
+
+        logger.info(f'Storage migration complete: {migrated} file(s) rewritten, {unchanged} already up to date.')
+        return migrated, unchanged
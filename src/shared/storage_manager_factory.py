@@ -0,0 +1,18 @@
+from .storage_manager import StorageManager
+from .database_storage import DatabaseStorageManager
+from .segment_storage import SegmentStorageManager
+
+class StorageManagerFactory:
+    @staticmethod
+    def create(
+            mode: str,
+            compression: str = 'gzip',
+            cache_bytes: int = 0,
+            segment_bytes: int = 64 * 1024 * 1024,
+            compact_interval: float = 600
+    ) -> StorageManager:
+        if mode == 'database':
+            return DatabaseStorageManager(compression, cache_bytes)
+        if mode == 'segments':
+            return SegmentStorageManager(compression, cache_bytes, segment_bytes, compact_interval)
+        return StorageManager(mode, compression, cache_bytes)
@@ -1,12 +1,20 @@
 from shared.storage_manager import StorageManager
+from shared.storage_manager_factory import StorageManagerFactory
 from shared.email_client import EmailClient
 from shared.email_client_factory import EmailClientFactory
+from shared.lru_cache import LRUCache
+from shared.calendar_utils import Horizon
 from config import get_settings
 from worker.services.calendar_service import CalendarService
 from worker.services.worker_service import WorkerService
+from worker.services.polling_policy import PollingPolicy
+from worker.services.parse_pool import ParsePool
+from worker.services.change_index import ChangeIndex
 
 _storage_manager: StorageManager | None = None
 _email_client: EmailClient | None = None
+_polling_policy: PollingPolicy | None = None
+_parse_pool: ParsePool | None = None
 _calendar_service: CalendarService | None = None
 _worker_service: WorkerService | None = None
 
@@ -14,7 +22,14 @@ def get_storage_manager() -> StorageManager:
     '''Get storage manager instance.'''
     global _storage_manager
     if _storage_manager is None:
-        _storage_manager = StorageManager()
+        settings = get_settings()
+        _storage_manager = StorageManagerFactory.create(
+            settings.storage_mode,
+            settings.storage_compression,
+            settings.storage_cache_bytes,
+            settings.storage_segment_bytes,
+            settings.storage_compact_interval
+        )
     return _storage_manager
 
 def get_email_client() -> EmailClient:
@@ -32,6 +47,33 @@ def get_email_client() -> EmailClient:
         )
     return _email_client
 
+def get_polling_policy() -> PollingPolicy:
+    '''Get polling policy instance.'''
+    global _polling_policy
+    if _polling_policy is None:
+        settings = get_settings()
+        _polling_policy = PollingPolicy(
+            base_interval=settings.worker_interval,
+            min_interval=settings.poll_min_interval,
+            max_interval=settings.poll_max_interval,
+            jitter=settings.scheduler_jitter,
+            override_min_interval=settings.poll_override_min_interval
+        )
+    return _polling_policy
+
+def get_parse_pool() -> ParsePool | None:
+    '''Get parse pool instance, or None if parsing runs in the worker threads.'''
+    global _parse_pool
+    settings = get_settings()
+    if _parse_pool is None and settings.parse_pool_size > 0:
+        _parse_pool = ParsePool(
+            size=settings.parse_pool_size,
+            max_tasks_per_child=settings.parse_pool_max_tasks or None,
+            block_cache_size=settings.block_cache_size,
+            parsed_cache_size=settings.parsed_calendar_cache_size
+        )
+    return _parse_pool
+
 def get_calendar_service() -> CalendarService:
     '''Get calendar service instance.'''
     global _calendar_service
@@ -40,7 +82,18 @@ def get_calendar_service() -> CalendarService:
         _calendar_service = CalendarService(
             storage_manager=get_storage_manager(),
             email_client=get_email_client(),
-            base_calendar_url=settings.base_calendar_url
+            base_calendar_url=settings.base_calendar_url,
+            polling_policy=get_polling_policy(),
+            max_calendar_bytes=settings.max_calendar_bytes,
+            hash_mode=settings.hash_mode,
+            ical_parser=settings.ical_parser,
+            diff_engine=settings.diff_engine,
+            horizon=Horizon(settings.diff_horizon_days, settings.exam_keywords) if settings.diff_horizon_days > 0 else None,
+            parsed_cache=LRUCache(settings.parsed_calendar_cache_size),
+            parse_pool=get_parse_pool(),
+            block_cache=LRUCache(settings.block_cache_size),
+            change_index=ChangeIndex(settings.change_index_size) if settings.change_index_size > 0 else None,
+            diff_memo=LRUCache(settings.diff_memo_size, ttl=settings.diff_memo_ttl)
         )
     return _calendar_service
 
@@ -51,7 +104,16 @@ def get_worker_service() -> WorkerService:
         settings = get_settings()
         _worker_service = WorkerService(
             calendar_service=get_calendar_service(),
+            polling_policy=get_polling_policy(),
             worker_interval=settings.worker_interval,
-            max_workers=settings.max_workers
+            max_workers=settings.max_workers,
+            mode=settings.worker_mode,
+            max_concurrency=settings.async_max_concurrency,
+            fetch_retries=settings.fetch_retries,
+            retry_backoff=settings.fetch_retry_backoff,
+            schedule_mode=settings.worker_schedule,
+            batch_size=settings.scheduler_batch_size,
+            max_sleep=settings.scheduler_max_sleep,
+            warm_storage_cache=settings.storage_cache_warm and settings.storage_cache_bytes > 0
         )
     return _worker_service
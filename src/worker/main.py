@@ -23,7 +23,11 @@ def start_worker():
 
     try:
         worker_service = get_worker_service()
-        worker_service.run_continuously()
+        try:
+            worker_service.run_continuously()
+        finally:
+            # Also reached on the SystemExit raised by the signal handler
+            worker_service.close()
     except KeyboardInterrupt:
         logger.info('Received keyboard interrupt, shutting down...')
     except Exception as e:
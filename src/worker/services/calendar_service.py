@@ -1,94 +1,344 @@
-import time
 import logging
 import hashlib
-import requests
+import httpx
+from dataclasses import dataclass, field
+from functools import cached_property
 from datetime import datetime
 
-from shared.calendar_utils import is_valid_ical, compute_ical_changes
+from shared.calendar_utils import Event, EventChange, Horizon, ParsedCalendar, canonical_ical_hash
+from shared.lru_cache import LRUCache
+from shared.event_diff import compute_parsed_changes
+from shared.event_snapshot import encode_snapshot, decode_snapshot, snapshot_hash
+from shared.http_client import get_http_client
 from shared.models import UserCalendar
 from shared.database import SessionLocal
 from shared.storage_manager import StorageManager
 from shared.email_client import EmailClient
 from shared.crud import create_audit_log, _now
+from worker.services.polling_policy import PollingPolicy
+from worker.services.parse_pool import ParsePool, CalendarAnalysis, UnreadableSnapshot, analyze_calendar, parsed_cache_key, trims_parses
+from worker.services.change_index import ChangeIndex
+from worker.services.previous_loader import PreviousLoader
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class FetchResult:
+    '''Outcome of a calendar fetch that got a usable response.'''
+    not_modified: bool = False
+    too_large: bool = False
+    etag: str | None = None
+    last_modified: str | None = None
+    encoding: str = 'utf-8'
+    content_hash: str | None = None
+    size: int = 0
+    chunks: list[bytes] = field(default_factory=list)
+
+    @cached_property
+    def content(self) -> str:
+        '''Decoded calendar body, joined from the streamed chunks on first access.'''
+        content = b''.join(self.chunks).decode(self.encoding, errors='replace')
+        self.chunks = []
+        return content
+
 class CalendarService:
     '''Service for processing individual calendar subscriptions.'''
 
-    def __init__(self, storage_manager: StorageManager, email_client: EmailClient, base_calendar_url: str):
+    def __init__(
+            self,
+            storage_manager: StorageManager,
+            email_client: EmailClient,
+            base_calendar_url: str,
+            polling_policy: PollingPolicy | None = None,
+            max_calendar_bytes: int = 5 * 1024 * 1024,
+            hash_mode: str = 'raw',
+            ical_parser: str = 'icalendar',
+            diff_engine: str = 'summary',
+            horizon: Horizon | None = None,
+            parsed_cache: LRUCache[ParsedCalendar] | None = None,
+            parse_pool: ParsePool | None = None,
+            block_cache: LRUCache[Event] | None = None,
+            change_index: ChangeIndex | None = None,
+            diff_memo: LRUCache[list[EventChange]] | None = None
+    ):
         self.storage_manager = storage_manager
         self.email_client = email_client
         self.base_calendar_url = base_calendar_url
+        self.polling_policy = polling_policy
+        self.max_calendar_bytes = max_calendar_bytes
+        self.hash_mode = hash_mode
+        self.ical_parser = ical_parser
+        self.diff_engine = diff_engine
+        self.horizon = horizon
+        self.parsed_cache = parsed_cache if parsed_cache is not None else LRUCache(0)
+        self.parse_pool = parse_pool
+        # Shared by all subscriptions: parsed VEVENT blocks, and changes detected in any calendar
+        self.block_cache = block_cache if block_cache is not None else LRUCache(0)
+        self.change_index = change_index
+        # Changes between two documents, keyed by their (old, new) canonical hashes
+        self.diff_memo = diff_memo if diff_memo is not None else LRUCache(0)
+        # Coalesces previous calendar reads into bulk reads, where the storage supports them
+        self.previous_loader = PreviousLoader(storage_manager) if storage_manager.bulk_reads else None
 
     def compute_hash(self, content: str) -> str:
         '''Compute SHA256 hash of calendar content.'''
         return hashlib.sha256(content.encode('utf-8')).hexdigest()
     
-    def fetch_calendar_with_retry(self, url: str, retries: int = 3, backoff_factor: float = 30) -> str | None:
+    def conditional_headers(self, subscription: UserCalendar) -> dict[str, str]:
+        '''Build If-None-Match / If-Modified-Since headers from stored validators.'''
+        headers = {}
+        # Validators are only useful while we still hold the content they describe
+        if not subscription.previous_calendar_path or not subscription.previous_calendar_hash:
+            return headers
+        if subscription.calendar_etag:
+            headers['If-None-Match'] = subscription.calendar_etag
+        if subscription.calendar_last_modified:
+            headers['If-Modified-Since'] = subscription.calendar_last_modified
+        return headers
+
+    def _start_fetch_result(self, url: str, response: httpx.Response) -> FetchResult | None:
+        '''Build a FetchResult from response headers, or None if the response is unusable.'''
+        if response.status_code not in (200, 304):
+            logger.warning(f'Non-200 status code {response.status_code} when fetching {url}')
+            return None
+
+        result = FetchResult(
+            not_modified=response.status_code == 304,
+            etag=response.headers.get('ETag'),
+            last_modified=response.headers.get('Last-Modified'),
+            encoding=response.charset_encoding or 'utf-8'
+        )
+
+        content_length = response.headers.get('Content-Length')
+        if not result.not_modified and content_length and content_length.isdigit():
+            if int(content_length) > self.max_calendar_bytes:
+                logger.error(f'Calendar at {url} is {content_length} bytes, over the {self.max_calendar_bytes} byte limit')
+                result.too_large = True
+        return result
+
+    def _add_chunk(self, url: str, result: FetchResult, hasher, chunk: bytes) -> bool:
+        '''Hash and buffer one body chunk. Returns False once the size limit is exceeded.'''
+        result.size += len(chunk)
+        if result.size > self.max_calendar_bytes:
+            logger.error(f'Calendar at {url} exceeded the {self.max_calendar_bytes} byte limit while streaming')
+            result.too_large = True
+            result.chunks = []
+            return False
+        hasher.update(chunk)
+        result.chunks.append(chunk)
+        return True
+
+    def fetch_calendar(self, url: str, headers: dict[str, str] | None = None) -> FetchResult | None:
         '''
-        Fetch calendar content with retry logic.
+        Fetch calendar content once. Retries are scheduled by the caller.
+
+        The body is streamed in chunks and hashed as it arrives, and the transfer
+        is abandoned as soon as it exceeds max_calendar_bytes.
 
         Args:
             url: Calendar URL to fetch
-            retries: Number of retry attempts
-            backoff_factor: Exponential backoff factor
+            headers: Extra request headers, e.g. conditional GET validators
 
         Returns:
-            Calendar content as string, or None if failed
+            FetchResult, or None if failed
         '''
-        for attempt in range(1, retries + 1):
-            try:
-                response = requests.get(url, timeout=10)
-                if response.status_code == 200:
-                    return response.text
-                else:
-                    logger.warning(f'Non-200 status ccode {response.status_code} when fetching {url}')
-            except Exception as e:
-                logger.exception(f'Exception fetching {url}: {e}')
+        try:
+            with get_http_client().stream('GET', url, headers=headers) as response:
+                result = self._start_fetch_result(url, response)
+                if result is None or result.not_modified or result.too_large:
+                    return result
 
-            if attempt < retries:  # Don't sleep on the last attempt
-                sleep_time = backoff_factor * (2 ** (attempt - 1))
-                logger.info(f'Retrying in {sleep_time} seconds.')
-                time.sleep(sleep_time)
+                hasher = hashlib.sha256()
+                for chunk in response.iter_bytes():
+                    if not self._add_chunk(url, result, hasher, chunk):
+                        return result
+                result.content_hash = hasher.hexdigest()
+                return result
+        except Exception as e:
+            logger.exception(f'Exception fetching {url}: {e}')
+            return None
 
-        return None
+    async def fetch_calendar_async(
+            self,
+            client: httpx.AsyncClient,
+            url: str,
+            headers: dict[str, str] | None = None
+    ) -> FetchResult | None:
+        '''
+        Fetch calendar content once on the event loop. Retries are scheduled by the caller.
+
+        Args:
+            client: Shared async HTTP client
+            url: Calendar URL to fetch
+            headers: Extra request headers, e.g. conditional GET validators
+
+        Returns:
+            FetchResult, or None if failed
+        '''
+        try:
+            async with client.stream('GET', url, headers=headers) as response:
+                result = self._start_fetch_result(url, response)
+                if result is None or result.not_modified or result.too_large:
+                    return result
+
+                hasher = hashlib.sha256()
+                async for chunk in response.aiter_bytes():
+                    if not self._add_chunk(url, result, hasher, chunk):
+                        return result
+                result.content_hash = hasher.hexdigest()
+                return result
+        except Exception as e:
+            logger.exception(f'Exception fetching {url}: {e}')
+            return None
+
+    def build_calendar_url(self, subscription: UserCalendar) -> str:
+        '''Build the FER calendar URL for a subscription.'''
+        return f'{self.base_calendar_url}?user={subscription.username}&auth={subscription.calendar_auth}'
     
     def get_previous_calendar_content(self, subscription: UserCalendar) -> str | None:
         '''Get previous calendar content from storage.'''
         if not subscription.previous_calendar_path:
             return None
         
-        previous_content = self.storage_manager.get_calendar(subscription.email)
+        previous_content = self.storage_manager.get_calendar(subscription.email, subscription.stored_hash)
         if previous_content is None:
             logger.warning(f'Previous calendar missing or failed from storage for {subscription.email}')
 
         return previous_content
     
-    def save_calendar(self, email: str, content: str) -> str | None:
-        '''Save calendar content to storage and return the path.'''
-        path = self.storage_manager.save_calendar(email, content)
+    def parsed_key(self, content_hash: str) -> str:
+        '''Key of a calendar in the parsed calendar cache, see parsed_cache_key.'''
+        return parsed_cache_key(content_hash, self.ical_parser, self.horizon)
+
+    def analyze_calendar(
+            self,
+            subscription: UserCalendar,
+            content_hash: str | None,
+            content: str,
+            previous: ParsedCalendar | None,
+            previous_snapshot: bytes | None = None,
+            previous_content: str | None = None
+    ) -> CalendarAnalysis | None:
+        '''
+        Parse calendar content and diff it against the previous version, in the parse pool
+        if one is configured. Parsed calendars are cached by content hash and shared with the
+        cache, so they must not be modified. Returns None if the content is not valid iCal.
+        '''
+        previous_hash = subscription.stored_hash
+        if self.parse_pool is not None:
+            if previous is not None:
+                previous_snapshot = encode_snapshot(previous_hash, previous)
+            try:
+                analysis = self.parse_pool.analyze(content, content_hash, previous_hash, previous_snapshot, previous_content, self.ical_parser, self.block_cache, self.diff_engine, self.horizon)
+            except UnreadableSnapshot:
+                logger.warning(f'Event snapshot of {subscription.email} is unreadable, parsing its previous calendar')
+                previous_content = self.get_previous_calendar_content(subscription)
+                analysis = self.parse_pool.analyze(content, content_hash, previous_hash, None, previous_content, self.ical_parser, self.block_cache, self.diff_engine, self.horizon)
+        else:
+            parsed = self.parsed_cache.get(self.parsed_key(content_hash)) if content_hash else None
+            if parsed is not None and previous_content is None:
+                changes = compute_parsed_changes(previous, parsed, engine=self.diff_engine, horizon=self.horizon) if previous is not None else []
+                return CalendarAnalysis(parsed=parsed, changes=changes)
+            analysis = analyze_calendar(content, previous, previous_content, self.ical_parser, self.block_cache, self.diff_engine, self.horizon)
+
+        if analysis is not None and analysis.parsed is not None and content_hash:
+            self.parsed_cache.put(self.parsed_key(content_hash), analysis.parsed)
+        return analysis
+
+    def load_previous(self, subscription: UserCalendar) -> tuple[ParsedCalendar | None, bytes | None, str | None]:
+        '''
+        Load the previously stored calendar of a subscription whose calendar changed:
+        parsed from the cache, as its encoded snapshot, or else as raw content. All are None
+        if it is missing from storage. Snapshots are decoded here unless the parse pool will.
+        '''
+        previous_hash = subscription.stored_hash
+        if not subscription.previous_calendar_path or not previous_hash:
+            return None, None, self.get_previous_calendar_content(subscription)
+
+        parsed = self.parsed_cache.get(self.parsed_key(previous_hash))
+        if parsed is not None:
+            return parsed, None, None
+
+        if self.previous_loader is not None:
+            snapshot, content = self.previous_loader.load(subscription.email, previous_hash)
+            if snapshot is None and content is None:
+                logger.warning(f'Previous calendar missing or failed from storage for {subscription.email}')
+                return None, None, None
+        else:
+            snapshot = self.storage_manager.get_snapshot(subscription.email, previous_hash)
+            if snapshot is not None and snapshot_hash(snapshot) != previous_hash:
+                snapshot = None
+            content = None
+
+        if snapshot is not None and self.parse_pool is None:
+            decoded = decode_snapshot(snapshot)
+            if decoded is not None:
+                # A snapshot may have been trimmed to other bounds, which only matters in a key that has them
+                if not trims_parses(self.ical_parser, self.horizon):
+                    self.parsed_cache.put(previous_hash, decoded[1])
+                return decoded[1], None, None
+            snapshot = None
+
+        if snapshot is None and content is None:
+            content = self.get_previous_calendar_content(subscription)
+        return None, snapshot, content
+
+    def update_validators(self, subscription: UserCalendar, fetched: FetchResult) -> None:
+        '''Remember the conditional GET validators the server sent, if any.'''
+        if fetched.etag:
+            subscription.calendar_etag = fetched.etag
+        if fetched.last_modified:
+            subscription.calendar_last_modified = fetched.last_modified
+
+    def record_check(self, subscription: UserCalendar, changed: bool) -> None:
+        '''Update change-stability bookkeeping and schedule the next poll.'''
+        subscription.checks_since_change = 0 if changed else (subscription.checks_since_change or 0) + 1
+        if self.polling_policy is not None:
+            subscription.next_check_at = self.polling_policy.next_check_time(subscription)
+
+    def save_calendar(
+            self,
+            email: str,
+            content: str,
+            content_hash: str | None = None,
+            parsed: ParsedCalendar | None = None,
+            snapshot: bytes | None = None
+    ) -> str | None:
+        '''Save calendar content, and its snapshot if given or parsed, to storage and return the path.'''
+        path = self.storage_manager.save_calendar(email, content, content_hash)
         if not path:
             logger.error(f'Failed to save updated calendar for {email} to storage')
+            return path
+
+        # The snapshot is only an optimization, the raw calendar is parsed again if it is missing
+        if snapshot is None and parsed is not None:
+            snapshot = encode_snapshot(content_hash, parsed)
+        if snapshot is None:
+            # Not parsed (a diff memo hit): the old snapshot describes the replaced calendar and would
+            # only be read to be discarded. The next change parses this calendar instead, which costs
+            # nothing if it never changes again, rather than parsing it now just for the snapshot
+            self.storage_manager.delete_snapshot(email)
+        elif not self.storage_manager.save_snapshot(email, snapshot, content_hash):
+            logger.warning(f'Failed to save event snapshot for {email}')
         return path
     
-    def detect_and_notify_changes(self, subscription: UserCalendar, previous_content: str | None, new_content: str | None) -> bool:
+    def detect_and_notify_changes(self, subscription: UserCalendar, event_changes: list[EventChange]) -> bool:
         '''
-        Detect changes between calendars and send notifications if needed.
+        Send notifications for detected event changes, if any. With a change index, changes
+        already detected for other subscribers are shared and their cards rendered only once.
 
         Returns:
             True if changes were detected and email enqueued, False otherwise
         '''
-        event_changes = compute_ical_changes(
-            old_ical=previous_content or '',
-            new_ical=new_content or ''
-        )
-
         if event_changes:
             logger.info(f'Detected {len(event_changes)} event changes for {subscription.email}')
             # Get user's language preference for notifications
             language: str = getattr(subscription, 'language', 'hr')
-            self.email_client.send_notification_email(subscription.email, event_changes, language)
+            if self.change_index is not None:
+                event_changes = [self.change_index.record(change) for change in event_changes]
+                self.email_client.send_notification_email(subscription.email, event_changes, language, self.change_index.render)
+            else:
+                self.email_client.send_notification_email(subscription.email, event_changes, language)
             return True
         else:
             logger.info(f'Calendar content changed but no event differences found for {subscription.email}')
@@ -96,13 +346,31 @@ class CalendarService:
         
     def process_subscription(self, sub: UserCalendar) -> dict:
         '''
-        Process a single subscription for calendar changes.
+        Fetch and process a single subscription for calendar changes, without retries.
 
         Args:
             subscription: UserCalendar instance to process
 
         Returns:
-            True if processing was successful, False otherwise
+            Processing status dict
+        '''
+        logger.info(f'Fetching calendar for {sub.email}')
+        fetched = self.fetch_calendar(self.build_calendar_url(sub), self.conditional_headers(sub))
+        return self.process_fetched_calendar(sub, fetched)
+
+    def process_fetched_calendar(self, sub: UserCalendar, fetched: FetchResult | None) -> dict:
+        '''
+        Process already fetched calendar content for a single subscription.
+
+        The subscription row is locked only for the duration of this call, so
+        network time spent fetching the calendar never holds a DB session.
+
+        Args:
+            sub: UserCalendar instance the content belongs to
+            fetched: Fetch result, or None if the fetch failed
+
+        Returns:
+            Processing status dict
         '''
         session = SessionLocal()
 
@@ -112,6 +380,11 @@ class CalendarService:
             'skipped': False,
             'is_initial': False,
             'treated_as_initial': False,
+            'not_modified': False,
+            'hash_hit': False,
+            'canonical_match': False,
+            'diff_memo_hit': False,
+            'no_differences': False,
             'no_changes': True
         }
 
@@ -131,59 +404,111 @@ class CalendarService:
                 logger.info(f'Skipping {subscription.email} (not activated or paused)')
                 status['skipped'] = True
                 return status
-            
-            # Build calendar URL
-            calendar_url = f'{self.base_calendar_url}?user={subscription.username}&auth={subscription.calendar_auth}'
-            logger.info(f'Fetching calendar for {subscription.email}')
-
-            # Fetch current calendar content
-            current_content = self.fetch_calendar_with_retry(calendar_url)
-            if current_content is None:
-                logger.error(f'Failed to fetch calendar for {subscription.email} after retries')
+
+            if fetched is None:
+                logger.error(f'Failed to fetch calendar for {subscription.email}')
                 status['error'] = 'FAILED_FETCH'
                 return status
-            
-            # Validate calendar content
-            if not is_valid_ical(current_content):
-                logger.error(f'Fetched calendar for {subscription.email} is not a valid iCal document')
-                status['error'] = 'INVALID_ICAL'
+
+            # Server confirmed the stored calendar is still current
+            if fetched.not_modified:
+                logger.info(f'No changes for {subscription.email} (not modified)')
+                status['not_modified'] = True
+                self.update_validators(subscription, fetched)
+                self.record_check(subscription, changed=False)
+                subscription.last_checked = _now()
+                session.commit()
+                return status
+
+            if fetched.too_large:
+                status['error'] = 'CALENDAR_TOO_LARGE'
                 return status
-            
-            # Compute new hash
-            new_hash = self.compute_hash(current_content)
+
+            # Hash was computed while streaming the body
+            new_hash = fetched.content_hash
 
             # Determine if this is initial processing
             is_initial = not subscription.previous_calendar_path
             status['is_initial'] = is_initial
-            previous_content = None
 
-            if not is_initial:
-                previous_content = self.get_previous_calendar_content(subscription)
-                # Treat as initial if previous calendar document missing in storage
-                if previous_content is None:
-                    logger.warning(f'Treating {subscription.email} as initial due to missing previous calendar')
-                    is_initial = True
-                    status['treated_as_initial'] = True
+            # Unchanged content needs neither decoding nor parsing
+            if not is_initial and subscription.previous_calendar_hash == new_hash:
+                logger.info(f'No changes for {subscription.email}')
+                status['hash_hit'] = True
+                self.update_validators(subscription, fetched)
+                self.record_check(subscription, changed=False)
+                subscription.last_checked = _now()
+                session.commit()
+                return status
 
-            email_sent = False
+            current_content = fetched.content
+            canonical_hash = canonical_ical_hash(current_content)
 
-            # Proceed based on initial vs update
-            if not is_initial:
-                # Check if content actually changed
-                if subscription.previous_calendar_hash == new_hash:
-                    logger.info(f'No changes for {subscription.email}')
+            # Bytes changed, but only in fields that cannot affect notifications
+            if not is_initial and subscription.previous_canonical_hash == canonical_hash:
+                status['canonical_match'] = True
+                if self.hash_mode == 'canonical':
+                    logger.info(f'No changes for {subscription.email} (canonical hash)')
+                    # Fetching the same bytes again is then a plain hash hit. Storage keeps the
+                    # calendar and snapshot it had, which are still found by their own hash
+                    subscription.stored_calendar_hash = subscription.stored_hash
+                    subscription.previous_calendar_hash = new_hash
+                    self.update_validators(subscription, fetched)
+                    self.record_check(subscription, changed=False)
                     subscription.last_checked = _now()
-                    session.merge(subscription)
                     session.commit()
                     return status
-                
+
+            # The same pair of documents was diffed recently, for this or another subscription
+            memo_key = None
+            if not is_initial and subscription.previous_canonical_hash:
+                memo_key = (subscription.previous_canonical_hash, canonical_hash)
+            changes = self.diff_memo.get(memo_key) if memo_key is not None else None
+
+            if changes is not None:
+                status['diff_memo_hit'] = True
+                # Only used for the snapshot, which is dropped if the calendar was not parsed recently
+                parsed, snapshot = self.parsed_cache.get(self.parsed_key(new_hash)), None
+            else:
+                previous = None
+                previous_snapshot = None
+                previous_content = None
+
+                if not is_initial:
+                    previous, previous_snapshot, previous_content = self.load_previous(subscription)
+                    # Treat as initial if previous calendar document missing in storage
+                    if previous is None and previous_snapshot is None and previous_content is None:
+                        logger.warning(f'Treating {subscription.email} as initial due to missing previous calendar')
+                        is_initial = True
+                        status['treated_as_initial'] = True
+
+                # Parse and diff once, which also validates the calendar content
+                analysis = self.analyze_calendar(subscription, new_hash, current_content, previous, previous_snapshot, previous_content)
+                if analysis is None:
+                    logger.error(f'Fetched calendar for {subscription.email} is not a valid iCal document')
+                    status['error'] = 'INVALID_ICAL'
+                    return status
+
+                if analysis.previous is not None and subscription.stored_hash:
+                    self.parsed_cache.put(self.parsed_key(subscription.stored_hash), analysis.previous)
+
+                changes, parsed, snapshot = analysis.changes, analysis.parsed, analysis.snapshot
+                if memo_key is not None and not is_initial:
+                    self.diff_memo.put(memo_key, changes)
+
+            email_sent = False
+
+            # Proceed based on initial vs update
+            if not is_initial:
                 # Detect and notify changes
-                email_sent = self.detect_and_notify_changes(subscription, previous_content, current_content)
+                email_sent = self.detect_and_notify_changes(subscription, changes)
                 if email_sent:
                     status['email_queued'] = True
                     subscription.change_count += 1
                     subscription.last_change_detected = _now()
                     create_audit_log(session, 'notification_queued', subscription.email)
+                else:
+                    status['no_differences'] = True
             else:
                 logger.info(f'Initial calendar for {subscription.email}')
 
@@ -191,7 +516,7 @@ class CalendarService:
 
             # Save new calendar to storage
             logger.info(f'Saving new calendar for {subscription.email}')
-            calendar_local_path = self.save_calendar(subscription.email, current_content)
+            calendar_local_path = self.save_calendar(subscription.email, current_content, new_hash, parsed, snapshot)
             if not calendar_local_path:
                 status['error'] = 'STORAGE_ERROR'
                 return status
@@ -199,6 +524,10 @@ class CalendarService:
             # Update subscription record
             subscription.previous_calendar_path = calendar_local_path
             subscription.previous_calendar_hash = new_hash
+            subscription.stored_calendar_hash = None
+            subscription.previous_canonical_hash = canonical_hash
+            self.update_validators(subscription, fetched)
+            self.record_check(subscription, changed=email_sent)
             subscription.last_checked = _now() if not email_sent else subscription.last_change_detected
 
             session.commit()
@@ -0,0 +1,85 @@
+import threading
+from dataclasses import dataclass, field
+from typing import Callable, Hashable
+
+from shared.calendar_utils import Event, EventChange, event_key
+from shared.email_templates import render_notification_change
+from shared.lru_cache import LRUCache
+
+def event_identity(event: Event) -> str:
+    '''Identity of an event across calendars: its UID, or its course and slot if it has none.'''
+    if event.uid and event.uid != 'None':
+        return event.uid
+    return f'{event_key(event)}@{event.start.isoformat()}'
+
+def _event_fields(event: Event | None) -> tuple | None:
+    if event is None:
+        return None
+    return event_identity(event), event.summary, event.start, event.end, event.location
+
+def change_key(change: EventChange) -> Hashable:
+    '''Key under which the same change detected in different calendars is indexed.'''
+    return _event_fields(change.old), _event_fields(change.new), tuple(change.change_type)
+
+@dataclass(slots=True)
+class IndexedChange:
+    change: EventChange
+    # Rendered notification card by language
+    cards: dict[str, str] = field(default_factory=dict)
+
+class ChangeIndex:
+    '''
+    Cross-subscription index of detected changes.
+
+    A timetable change, such as a moved lecture, shows up in the calendar of every
+    student in the class. The index keeps one EventChange per distinct change and renders
+    its notification card once per language for all of them.
+    '''
+
+    def __init__(self, maxsize: int, render: Callable[[EventChange, str], str] = render_notification_change):
+        self._entries: LRUCache[IndexedChange] = LRUCache(maxsize)
+        self._render = render
+        self._lock = threading.Lock()
+        self.changes_recorded = 0
+        self.distinct_changes = 0
+        self.cards_rendered = 0
+        self.card_render_hits = 0
+
+    def record(self, change: EventChange) -> EventChange:
+        '''Record a detected change, returning the shared instance of that change.'''
+        key = change_key(change)
+        with self._lock:
+            self.changes_recorded += 1
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = IndexedChange(change)
+                self._entries.put(key, entry)
+                self.distinct_changes += 1
+        return entry.change
+
+    def render(self, change: EventChange, language: str) -> str:
+        '''Notification card of a change, rendered on first use per language.'''
+        with self._lock:
+            entry = self._entries.get(change_key(change))
+            card = entry.cards.get(language) if entry is not None else None
+            if card is not None:
+                self.card_render_hits += 1
+                return card
+
+        card = self._render(change, language)
+        with self._lock:
+            self.cards_rendered += 1
+            if entry is not None:
+                entry.cards.setdefault(language, card)
+        return card
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'size': len(self._entries),
+                'maxsize': self._entries.maxsize,
+                'changes_recorded': self.changes_recorded,
+                'distinct_changes': self.distinct_changes,
+                'cards_rendered': self.cards_rendered,
+                'card_render_hits': self.card_render_hits,
+            }
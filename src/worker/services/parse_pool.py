@@ -0,0 +1,211 @@
+import logging
+import threading
+import multiprocessing
+import pytz
+from datetime import datetime
+from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+
+from shared.calendar_utils import Event, EventChange, Horizon, ParsedCalendar, parse_calendar_indexed
+from shared.lru_cache import LRUCache
+from shared.event_diff import compute_parsed_changes
+from shared.event_snapshot import encode_snapshot, decode_snapshot
+
+logger = logging.getLogger(__name__)
+
+# Block cache and calendars parsed by a pool process, by content hash, set up by _init_process
+_process_block_cache: LRUCache[Event] | None = None
+_process_parsed_cache: LRUCache[ParsedCalendar] | None = None
+
+@dataclass
+class CalendarAnalysis:
+    '''
+    Changes of a calendar against the previous version, with the calendar parsed or,
+    when analysed in the parse pool, only its encoded snapshot.
+    '''
+    parsed: ParsedCalendar | None
+    changes: list[EventChange]
+    # Set when the previous calendar had to be parsed from raw content
+    previous: ParsedCalendar | None = None
+    snapshot: bytes | None = None
+
+class UnreadableSnapshot(Exception):
+    '''The snapshot of the previous calendar could not be decoded, its raw content is needed.'''
+
+def trims_parses(parser: str, horizon: Horizon | None) -> bool:
+    '''Whether parses skip blocks outside the horizon, which only the fast parser does.'''
+    return horizon is not None and parser == 'fast'
+
+def parsed_cache_key(content_hash: str, parser: str, horizon: Horizon | None) -> str:
+    '''
+    Key of a parsed calendar in the parsed calendar caches. Parses trimmed to the horizon
+    are only valid for the day bounds they were made with, so those are part of the key.
+    '''
+    if not trims_parses(parser, horizon):
+        return content_hash
+    start, end = horizon.day_bounds(datetime.now(pytz.UTC))
+    return f'{content_hash}:{start}-{end}'
+
+def analyze_calendar(
+        content: str,
+        previous: ParsedCalendar | None,
+        previous_content: str | None = None,
+        parser: str = 'icalendar',
+        block_cache: LRUCache[Event] | None = None,
+        diff_engine: str = 'summary',
+        horizon: Horizon | None = None
+) -> CalendarAnalysis | None:
+    '''
+    Parse a calendar and diff it against the previous version, parsing the previous
+    raw content first if it is not known parsed. VEVENT blocks unchanged since the
+    previous version, or already in the cross-calendar block cache, are reused rather
+    than parsed again, and blocks outside the horizon are skipped, where the parser
+    supports it. Returns None if the calendar is not valid iCal.
+    '''
+    parsed_previous = None
+    if previous is None and previous_content is not None:
+        previous = parsed_previous = parse_calendar_indexed(previous_content, parser, shared=block_cache, horizon=horizon) or ParsedCalendar(events=[])
+
+    parsed = parse_calendar_indexed(content, parser, previous, block_cache, horizon)
+    if parsed is None:
+        return None
+
+    changes = compute_parsed_changes(previous, parsed, engine=diff_engine, horizon=horizon) if previous is not None else []
+    return CalendarAnalysis(parsed=parsed, changes=changes, previous=parsed_previous)
+
+def _decode_previous(previous_hash: str | None, previous_snapshot: bytes | None) -> ParsedCalendar | None:
+    if previous_snapshot is None:
+        return None
+    decoded = decode_snapshot(previous_snapshot)
+    if decoded is None:
+        raise UnreadableSnapshot(previous_hash)
+    return decoded[1]
+
+def _init_process(block_cache_size: int, parsed_cache_size: int) -> None:
+    global _process_block_cache, _process_parsed_cache
+    _process_block_cache = LRUCache(block_cache_size)
+    _process_parsed_cache = LRUCache(parsed_cache_size)
+
+def _analyze_in_process(
+        content: bytes,
+        content_hash: str | None,
+        previous_hash: str | None,
+        previous_snapshot: bytes | None,
+        previous_content: bytes | None,
+        parser: str,
+        diff_engine: str,
+        horizon: Horizon | None
+) -> CalendarAnalysis | None:
+    # Calendars cross the process boundary encoded, and only the changes and snapshot return
+    previous_key = parsed_cache_key(previous_hash, parser, horizon) if previous_hash else None
+    content_key = parsed_cache_key(content_hash, parser, horizon) if content_hash else None
+    previous = _process_parsed_cache.get(previous_key) if previous_key else None
+    if previous is None:
+        previous = _decode_previous(previous_hash, previous_snapshot)
+        # A snapshot may have been trimmed to other bounds, which only matters in a key that has them
+        if previous is not None and previous_key and not trims_parses(parser, horizon):
+            _process_parsed_cache.put(previous_key, previous)
+
+    parsed = _process_parsed_cache.get(content_key) if content_key else None
+    if parsed is not None and previous is not None:
+        changes = compute_parsed_changes(previous, parsed, engine=diff_engine, horizon=horizon)
+        return CalendarAnalysis(parsed=None, changes=changes, snapshot=encode_snapshot(content_hash, parsed))
+
+    analysis = analyze_calendar(
+        content.decode('utf-8'),
+        previous,
+        previous_content.decode('utf-8') if previous_content is not None else None,
+        parser,
+        _process_block_cache,
+        diff_engine,
+        horizon
+    )
+    if analysis is None:
+        return None
+
+    if analysis.previous is not None and previous_key:
+        _process_parsed_cache.put(previous_key, analysis.previous)
+    if content_key:
+        _process_parsed_cache.put(content_key, analysis.parsed)
+    return CalendarAnalysis(parsed=None, changes=analysis.changes, snapshot=encode_snapshot(content_hash, analysis.parsed))
+
+class ParsePool:
+    '''
+    Runs analyze_calendar in worker processes, so parsing and diffing use every core
+    and do not hold the GIL shared with the API and fetch threads. Calendars are sent
+    encoded and the processes keep the parsed ones, so only changes and snapshots return.
+    '''
+
+    def __init__(self, size: int, max_tasks_per_child: int | None = None, block_cache_size: int = 0, parsed_cache_size: int = 0):
+        self.size = size
+        self.max_tasks_per_child = max_tasks_per_child
+        # Each process keeps its own caches, they are not shared between processes
+        self.block_cache_size = block_cache_size
+        self.parsed_cache_size = parsed_cache_size
+        self._executor: ProcessPoolExecutor | None = None
+        self._lock = threading.Lock()
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        with self._lock:
+            if self._executor is None:
+                # Forking a process that runs the API and worker threads is unsafe, always spawn
+                self._executor = ProcessPoolExecutor(
+                    max_workers=self.size,
+                    mp_context=multiprocessing.get_context('spawn'),
+                    max_tasks_per_child=self.max_tasks_per_child,
+                    initializer=_init_process,
+                    initargs=(self.block_cache_size, self.parsed_cache_size)
+                )
+                logger.info(f'Parse pool started: size={self.size}, max_tasks_per_child={self.max_tasks_per_child}')
+            return self._executor
+
+    def _reset(self, executor: ProcessPoolExecutor) -> None:
+        with self._lock:
+            if self._executor is executor:
+                self._executor = None
+        executor.shutdown(wait=False, cancel_futures=True)
+
+    def analyze(
+            self,
+            content: str,
+            content_hash: str | None,
+            previous_hash: str | None,
+            previous_snapshot: bytes | None,
+            previous_content: str | None = None,
+            parser: str = 'icalendar',
+            block_cache: LRUCache[Event] | None = None,
+            diff_engine: str = 'summary',
+            horizon: Horizon | None = None
+    ) -> CalendarAnalysis | None:
+        '''
+        Run analyze_calendar in the pool, falling back to this process, with
+        `block_cache`, if the pool broke. The previous calendar is taken from the
+        process cache by `previous_hash`, or else decoded from `previous_snapshot` or
+        parsed from `previous_content`. Raises UnreadableSnapshot if the snapshot is
+        needed but cannot be decoded.
+        '''
+        executor = self._get_executor()
+        try:
+            return executor.submit(
+                _analyze_in_process,
+                content.encode('utf-8'),
+                content_hash,
+                previous_hash,
+                previous_snapshot,
+                previous_content.encode('utf-8') if previous_content is not None else None,
+                parser,
+                diff_engine,
+                horizon
+            ).result()
+        except BrokenProcessPool:
+            logger.exception('Parse pool broke, restarting it and parsing in-process')
+            self._reset(executor)
+            previous = _decode_previous(previous_hash, previous_snapshot)
+            return analyze_calendar(content, previous, previous_content, parser, block_cache, diff_engine, horizon)
+
+    def shutdown(self) -> None:
+        with self._lock:
+            executor, self._executor = self._executor, None
+        if executor is not None:
+            executor.shutdown(wait=True, cancel_futures=True)
@@ -0,0 +1,107 @@
+import time
+import random
+import logging
+import threading
+from datetime import datetime, timedelta
+from sqlalchemy.orm import Session
+
+from shared.models import UserCalendar
+from shared.crud import _now, get_polling_override_no_session, set_polling_override, clear_polling_override
+
+logger = logging.getLogger(__name__)
+
+# Consecutive checks without a change before the interval doubles again
+STABLE_CHECKS_PER_STEP = 24
+MAX_STABLE_STEPS = 3
+# Seconds the stored override is trusted before it is read from the database again
+OVERRIDE_REFRESH_SECONDS = 30
+
+class PollingPolicy:
+    '''
+    Decides how long to wait before polling a subscription again.
+
+    Calendars that changed recently or change often are polled more often than
+    the base interval, calendars that have been stable for many checks less
+    often. The result is always clamped to [min_interval, max_interval], and an
+    admin override can temporarily force a tighter ceiling (e.g. during exams),
+    down to its own floor of override_min_interval. The override is stored in
+    the database, so it survives restarts.
+    '''
+
+    def __init__(self, base_interval: int, min_interval: int, max_interval: int, jitter: float = 0.1, override_min_interval: int | None = None):
+        self.base_interval = base_interval
+        self.min_interval = min_interval
+        self.override_min_interval = min_interval if override_min_interval is None else override_min_interval
+        self.max_interval = max_interval
+        self.jitter = jitter
+        # Stored override as last read, and when, on the monotonic clock
+        self._override: tuple[int, datetime] | None = None
+        self._override_read_at: float | None = None
+        self._lock = threading.Lock()
+
+    def set_override(self, db: Session, interval: int, until: datetime) -> None:
+        '''Poll every subscription at least every `interval` seconds until `until`.'''
+        interval = max(self.override_min_interval, interval)
+        set_polling_override(db, interval, until)
+        with self._lock:
+            self._override = interval, until
+            self._override_read_at = time.monotonic()
+        logger.info(f'Polling interval override set to {interval}s until {until}')
+
+    def clear_override(self, db: Session) -> None:
+        clear_polling_override(db)
+        with self._lock:
+            self._override = None
+            self._override_read_at = time.monotonic()
+        logger.info('Polling interval override cleared')
+
+    def get_override(self) -> tuple[int, datetime] | None:
+        '''Active override as (interval, until), or None.'''
+        with self._lock:
+            override, read_at = self._override, self._override_read_at
+
+        if read_at is None or time.monotonic() - read_at >= OVERRIDE_REFRESH_SECONDS:
+            override = get_polling_override_no_session()
+            with self._lock:
+                self._override = override
+                self._override_read_at = time.monotonic()
+
+        if override is None or override[1] <= _now():
+            return None
+        return override
+
+    def interval_for(self, subscription: UserCalendar) -> float:
+        '''Polling interval in seconds for a subscription, before jitter.'''
+        now = _now()
+        factor = 1.0
+
+        # Recently changed calendars tend to change again soon
+        if subscription.last_change_detected is not None:
+            hours_since_change = (now - subscription.last_change_detected).total_seconds() / 3600
+            if hours_since_change < 24:
+                factor *= 0.25
+            elif hours_since_change < 72:
+                factor *= 0.5
+
+        # Calendars with at least one change per week over their lifetime are volatile
+        weeks_subscribed = max(1.0, (now - subscription.created).days / 7)
+        if (subscription.change_count or 0) / weeks_subscribed >= 1:
+            factor *= 0.5
+
+        # Back off on calendars whose content has been stable for a long time
+        checks_since_change = subscription.checks_since_change or 0
+        factor *= 2 ** min(checks_since_change // STABLE_CHECKS_PER_STEP, MAX_STABLE_STEPS)
+
+        interval = min(self.max_interval, max(self.min_interval, self.base_interval * factor))
+
+        override = self.get_override()
+        if override is not None:
+            interval = min(interval, override[0])
+
+        return interval
+
+    def next_check_time(self, subscription: UserCalendar) -> datetime:
+        '''Next due time for a subscription, jittered so subscriptions do not line up.'''
+        interval = self.interval_for(subscription)
+        spread = interval * self.jitter
+        return _now() + timedelta(seconds=interval + random.uniform(-spread, spread))
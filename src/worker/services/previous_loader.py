@@ -0,0 +1,91 @@
+import logging
+import threading
+from dataclasses import dataclass, field
+
+from shared.event_snapshot import snapshot_hash
+from shared.storage_manager import StorageManager
+
+logger = logging.getLogger(__name__)
+
+@dataclass
+class _PendingLoad:
+    email: str
+    previous_hash: str
+    done: threading.Event = field(default_factory=threading.Event)
+    snapshot: bytes | None = None
+    content: str | None = None
+
+class PreviousLoader:
+    '''
+    Coalesces reads of previous calendars by concurrently processed subscriptions into
+    bulk storage reads. The first caller waits up to `window` seconds for others to
+    join, then loads the snapshots of the whole group in one read, and the raw content
+    of those without a matching snapshot in a second one. Only subscriptions whose
+    calendar actually changed get here, so unchanged ones never touch storage.
+    Snapshots are returned encoded, callers decode them or pass them to the parse pool.
+    '''
+
+    def __init__(self, storage_manager: StorageManager, window: float = 0.01, max_batch: int = 100):
+        self.storage_manager = storage_manager
+        self.window = window
+        self.max_batch = max_batch
+        self._pending: list[_PendingLoad] = []
+        self._batch_full = threading.Event()
+        self._lock = threading.Lock()
+        self.bulk_reads = 0
+        self.calendars_loaded = 0
+
+    def load(self, email: str, previous_hash: str) -> tuple[bytes | None, str | None]:
+        '''
+        Load a subscriber's previous calendar: its encoded snapshot if that matches
+        `previous_hash`, otherwise its raw content. Both are None if it is not stored.
+        '''
+        request = _PendingLoad(email, previous_hash)
+        with self._lock:
+            self._pending.append(request)
+            leader = len(self._pending) == 1
+            if len(self._pending) >= self.max_batch:
+                self._batch_full.set()
+
+        if leader:
+            self._batch_full.wait(self.window)
+            with self._lock:
+                batch, self._pending = self._pending, []
+                self._batch_full.clear()
+            self._load_batch(batch)
+
+        request.done.wait()
+        return request.snapshot, request.content
+
+    def _load_batch(self, batch: list[_PendingLoad]) -> None:
+        try:
+            hashes = {request.email: request.previous_hash for request in batch}
+            snapshots = self.storage_manager.get_snapshots(list(hashes), hashes)
+            missing = []
+            for request in batch:
+                snapshot = snapshots.get(request.email)
+                if snapshot is not None and snapshot_hash(snapshot) == request.previous_hash:
+                    request.snapshot = snapshot
+                else:
+                    missing.append(request)
+
+            if missing:
+                calendars = self.storage_manager.get_calendars([request.email for request in missing], hashes)
+                for request in missing:
+                    request.content = calendars.get(request.email)
+
+            with self._lock:
+                self.bulk_reads += 1
+                self.calendars_loaded += len(batch)
+        except Exception as e:
+            logger.exception(f'Error loading {len(batch)} previous calendars: {e}')
+        finally:
+            for request in batch:
+                request.done.set()
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                'bulk_reads': self.bulk_reads,
+                'calendars_loaded': self.calendars_loaded,
+            }
@@ -1,48 +1,200 @@
 import time
+import asyncio
 import logging
-from concurrent.futures import ThreadPoolExecutor, as_completed
+import httpx
+import heapq
+import random
+import itertools
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
 from typing import List
-from datetime import datetime
+from datetime import datetime, timedelta
 import threading
 
-from shared.crud import get_active_subscriptions_no_session
+from shared.crud import (
+    _now,
+    get_active_subscriptions_no_session,
+    schedule_unscheduled_subscriptions_no_session,
+    claim_due_subscriptions_no_session,
+    record_fetch_failures_no_session,
+    get_next_due_time_no_session,
+)
+from shared.http_client import create_async_http_client
 from shared.models import UserCalendar
 from worker.services.calendar_service import CalendarService
+from worker.services.polling_policy import PollingPolicy
 
 logger = logging.getLogger(__name__)
 
+@dataclass
+class BatchSummary:
+    '''Outcome counters for one batch of subscriptions.'''
+    successful: int = 0
+    failed: int = 0
+    retries: int = 0
+    retry_delay: float = 0
+
+    def record_retry(self, delay: float) -> None:
+        self.retries += 1
+        self.retry_delay += delay
+
+class RetryQueue:
+    '''Work queue for a single cycle where retried subscriptions wait until their not-before time.'''
+
+    def __init__(self):
+        self._heap: list[tuple[float, int, UserCalendar, int]] = []
+        self._counter = itertools.count()
+
+    def __len__(self) -> int:
+        return len(self._heap)
+
+    def push(self, subscription: UserCalendar, attempt: int, not_before: float = 0) -> None:
+        heapq.heappush(self._heap, (not_before, next(self._counter), subscription, attempt))
+
+    def pop_ready(self) -> list[tuple[UserCalendar, int]]:
+        '''Remove and return every entry whose not-before time has passed.'''
+        now = time.time()
+        ready = []
+        while self._heap and self._heap[0][0] <= now:
+            _, _, subscription, attempt = heapq.heappop(self._heap)
+            ready.append((subscription, attempt))
+        return ready
+
+    def next_delay(self) -> float:
+        '''Seconds until the earliest queued entry becomes ready.'''
+        if not self._heap:
+            return 0
+        return max(0, self._heap[0][0] - time.time())
+
 class WorkerService:
     '''Service for managing the main worker loop.'''
 
-    def __init__(self, calendar_service: CalendarService, worker_interval: int, max_workers: int = 3):
+    def __init__(
+            self,
+            calendar_service: CalendarService,
+            polling_policy: PollingPolicy,
+            worker_interval: int,
+            max_workers: int = 3,
+            mode: str = 'thread',
+            max_concurrency: int = 200,
+            fetch_retries: int = 3,
+            retry_backoff: float = 30,
+            schedule_mode: str = 'due',
+            batch_size: int = 50,
+            max_sleep: float = 60,
+            warm_storage_cache: bool = False
+    ):
         self._terminate = threading.Event()
         self.calendar_service = calendar_service
+        self.polling_policy = polling_policy
         self.worker_interval = worker_interval
         self.max_workers = max_workers
+        self.mode = mode
+        self.max_concurrency = max_concurrency
+        self.fetch_retries = fetch_retries
+        self.retry_backoff = retry_backoff
+        self.schedule_mode = schedule_mode
+        self.batch_size = batch_size
+        self.max_sleep = max_sleep
+        self.warm_storage_cache = warm_storage_cache
         self._running: bool = False
         self.last_cycle: datetime | None = None
+        # Event loop thread and HTTP client of async mode, kept for the worker's lifetime
+        self._loop: asyncio.AbstractEventLoop | None = None
+        self._loop_lock = threading.Lock()
+        self._async_client: httpx.AsyncClient | None = None
 
         # metrics
         self.worker_cycles_total = 0
         self.worker_cycle_duration = 0
         self.worker_last_cycle = 0
+        # Due-time scheduling processes small batches instead of full cycles
+        self.worker_batches_total = 0
+        self.worker_batch_duration = 0
+        self.worker_last_batch = 0
         self.subscriptions_processed: dict[str, int] = {}
         self.calendar_fetches = 0
         self.calendar_fetch_duration = 0
         self.emails_queued = 0
+        self.calendar_not_modified = 0
+        self.fetch_retries_total = 0
+        self.calendar_hash_hits = 0
+        self.calendar_full_path = 0
+        self.calendar_canonical_matches = 0
+        self.calendar_no_differences = 0
+        self.calendar_diff_memo_hits = 0
 
     def stop(self):
         """Signal the worker to stop processing"""
         self._terminate.set()
 
-    def record_cycle_complete(self, start_time: float, status: str = 'success', subscription_count: int = 0):
+    def _get_event_loop(self) -> asyncio.AbstractEventLoop:
+        '''Event loop of async mode, started in its own thread on first use.'''
+        with self._loop_lock:
+            if self._loop is None:
+                self._loop = asyncio.new_event_loop()
+                threading.Thread(target=self._loop.run_forever, name='WorkerEventLoop', daemon=True).start()
+            return self._loop
+
+    def _get_async_client(self) -> httpx.AsyncClient:
+        # Only called on the worker event loop, so it is created once
+        if self._async_client is None:
+            self._async_client = create_async_http_client(max_connections=self.max_concurrency)
+        return self._async_client
+
+    def close(self) -> None:
+        '''Shut down the parse pool, and close the async HTTP client and stop the event loop if async mode started them.'''
+        if self.calendar_service.parse_pool is not None:
+            self.calendar_service.parse_pool.shutdown()
+        with self._loop_lock:
+            loop, self._loop = self._loop, None
+        if loop is None:
+            return
+        if self._async_client is not None:
+            try:
+                asyncio.run_coroutine_threadsafe(self._async_client.aclose(), loop).result(timeout=10)
+            except Exception as e:
+                logger.warning(f'Error closing the async HTTP client: {e}')
+            self._async_client = None
+        loop.call_soon_threadsafe(loop.stop)
+
+    def record_cycle_complete(
+            self,
+            start_time: float,
+            status: str = 'success',
+            subscription_count: int = 0,
+            summary: BatchSummary | None = None
+    ):
         """Record completion of a processing cycle"""
         now = time.time()            
         self.worker_cycles_total += 1
         self.worker_cycle_duration = now - start_time
         self.worker_last_cycle = now
+        summary = summary or BatchSummary()
         
-        logger.info(f'Cycle completed: status={status}, duration={self.worker_cycle_duration:.2f}s, subscriptions={subscription_count}')
+        logger.info(
+            f'Cycle completed: status={status}, duration={self.worker_cycle_duration:.2f}s, subscriptions={subscription_count}, '
+            f'retries={summary.retries}, retry_delay={summary.retry_delay:.0f}s'
+        )
+
+    def record_batch_complete(
+            self,
+            start_time: float,
+            status: str = 'success',
+            subscription_count: int = 0,
+            summary: BatchSummary | None = None
+    ):
+        """Record completion of a batch of due subscriptions"""
+        now = time.time()
+        self.worker_batches_total += 1
+        self.worker_batch_duration = now - start_time
+        self.worker_last_batch = now
+        summary = summary or BatchSummary()
+
+        logger.info(
+            f'Batch completed: status={status}, duration={self.worker_batch_duration:.2f}s, subscriptions={subscription_count}, '
+            f'retries={summary.retries}, retry_delay={summary.retry_delay:.0f}s'
+        )
 
     def record_subscription_processed(self, status: str):
         """Record processing of a subscription"""
@@ -58,24 +210,78 @@ class WorkerService:
         """Record email being queued"""
         self.emails_queued += 1
 
-    def process_subscription_with_metrics(self, subscription: UserCalendar) -> dict:
-        '''Process single subscription with metrics tracking.'''
-        start_time = time.time()
+    def record_not_modified(self):
+        """Record a fetch answered with 304 Not Modified"""
+        self.calendar_not_modified += 1
 
-        try:
-            result = self.calendar_service.process_subscription(subscription)
-            duration = time.time() - start_time
+    def record_content_path(self, hash_hit: bool):
+        """Record whether fetched content matched the stored hash or went through parsing"""
+        if hash_hit:
+            self.calendar_hash_hits += 1
+        else:
+            self.calendar_full_path += 1
 
-            if result['error'] is None:
-                self.record_subscription_processed('processed')
-                self.record_calendar_fetch('success', duration)
+    def record_result(self, result: dict, duration: float) -> None:
+        '''Record metrics for a finished subscription.'''
+        if result['error'] is None:
+            self.record_subscription_processed('processed')
+            self.record_calendar_fetch('success', duration)
 
-                if result['email_queued']:
-                    self.record_email_queued()
-            else:
-                self.record_subscription_processed('error')
-                self.record_calendar_fetch('error', duration)
+            if result['email_queued']:
+                self.record_email_queued()
+            if result['not_modified']:
+                self.record_not_modified()
+            elif not result['skipped']:
+                self.record_content_path(result['hash_hit'])
+            if result['canonical_match']:
+                self.calendar_canonical_matches += 1
+            if result['no_differences']:
+                self.calendar_no_differences += 1
+            if result['diff_memo_hit']:
+                self.calendar_diff_memo_hits += 1
+        else:
+            self.record_subscription_processed('error')
+            self.record_calendar_fetch('error', duration)
+
+    def retry_delay(self, attempt: int) -> float:
+        '''Backoff before the attempt following the given failed attempt.'''
+        return self.retry_backoff * (2 ** (attempt - 1))
+
+    def defer_retry(self, subscription: UserCalendar, attempt: int, delay: float) -> None:
+        '''
+        Record a failed fetch and make the subscription due again after the backoff, so
+        the retry is claimed by a later batch instead of holding up this one.
+        '''
+        logger.info(f'Fetch failed for {subscription.email}, due again in {delay} seconds.')
+        retry_at = _now() + timedelta(seconds=delay)
+        if not record_fetch_failures_no_session(subscription.username, subscription.domain, attempt, retry_at):
+            logger.error(f'Failed to schedule the fetch retry for {subscription.email}')
+
+    def clear_fetch_failures(self, subscription: UserCalendar) -> None:
+        '''Reset the failed fetch count of a subscription whose deferred retries have ended.'''
+        if subscription.fetch_failures:
+            record_fetch_failures_no_session(subscription.username, subscription.domain, 0)
+
+    def process_subscription_attempt(self, subscription: UserCalendar, attempt: int) -> dict | None:
+        '''
+        Fetch and process a single subscription with metrics tracking.
+
+        Returns:
+            Processing status dict, or None if the fetch failed and should be retried later
+        '''
+        start_time = time.time()
+
+        try:
+            logger.info(f'Fetching calendar for {subscription.email} (attempt {attempt})')
+            fetched = self.calendar_service.fetch_calendar(
+                self.calendar_service.build_calendar_url(subscription),
+                self.calendar_service.conditional_headers(subscription)
+            )
+            if fetched is None and attempt < self.fetch_retries:
+                return None
 
+            result = self.calendar_service.process_fetched_calendar(subscription, fetched)
+            self.record_result(result, time.time() - start_time)
             return result
         
         except Exception as e:
@@ -85,38 +291,152 @@ class WorkerService:
             logger.exception(f'Error processing subscription {subscription.email}: {e}')
             return {'error': 'UNDOCUMENTED_ERROR'}
 
-    def process_subscription_batch(self, subscriptions: List[UserCalendar]) -> None:
-        '''Process a batch of subscriptions using ThreadPoolExecutor.'''
+    def process_subscription_batch(self, subscriptions: List[UserCalendar], defer_retries: bool = False) -> BatchSummary:
+        '''
+        Process a batch of subscriptions using the configured execution mode. With
+        defer_retries, failed fetches are rescheduled through next_check_at rather than
+        retried within the batch.
+        '''
         if not subscriptions:
             logger.info('No subscriptions to process')
-            return
-        
+            return BatchSummary()
+
+        if self.mode == 'async':
+            summary = asyncio.run_coroutine_threadsafe(
+                self.process_subscription_batch_async(subscriptions, defer_retries), self._get_event_loop()
+            ).result()
+        else:
+            summary = self.process_subscription_batch_threaded(subscriptions, defer_retries)
+
+        self.fetch_retries_total += summary.retries
+        logger.info(
+            f'Batch processing complete: {summary.successful} successful, {summary.failed} failed, '
+            f'{summary.retries} retries ({summary.retry_delay:.0f}s total backoff)'
+        )
+        return summary
+
+    def process_subscription_batch_threaded(self, subscriptions: List[UserCalendar], defer_retries: bool = False) -> BatchSummary:
+        '''
+        Process a batch of subscriptions using ThreadPoolExecutor.
+
+        Failed fetches go back into the work queue with a not-before time instead of
+        sleeping in the pool thread, so the slot is free for other subscriptions,
+        or with defer_retries are rescheduled for a later batch.
+        '''
         logger.info(f'Processing {len(subscriptions)} subscriptions with {self.max_workers} workers')
 
+        summary = BatchSummary()
+        queue = RetryQueue()
+        for sub in subscriptions:
+            queue.push(sub, attempt=(sub.fetch_failures or 0) + 1 if defer_retries else 1)
+
         with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # Submit all tasks
-            futures = {
-                executor.submit(self.process_subscription_with_metrics, sub): sub
-                for sub in subscriptions
-            }
-
-            # Processs completed tasks
-            successful = 0
-            failed = 0
-            for future in as_completed(futures):
-                subscription = futures[future]
-                try:
-                    success = future.result()
-                    if success['error'] is None:
-                        successful += 1
+            futures: dict[Future, tuple[UserCalendar, int]] = {}
+
+            while queue or futures:
+                for sub, attempt in queue.pop_ready():
+                    futures[executor.submit(self.process_subscription_attempt, sub, attempt)] = (sub, attempt)
+
+                if not futures:
+                    # Only deferred retries left, wait for the earliest one
+                    time.sleep(queue.next_delay())
+                    continue
+
+                done, _ = wait(futures, timeout=queue.next_delay() if queue else None, return_when=FIRST_COMPLETED)
+                for future in done:
+                    subscription, attempt = futures.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.exception(f'Unhandled error processing subscription for {subscription.email}: {e}')
+                        summary.failed += 1
+                        continue
+
+                    if result is None:
+                        delay = self.retry_delay(attempt)
+                        summary.record_retry(delay)
+                        if defer_retries:
+                            self.defer_retry(subscription, attempt, delay)
+                        else:
+                            logger.info(f'Fetch failed for {subscription.email}, retrying in {delay} seconds.')
+                            queue.push(subscription, attempt + 1, time.time() + delay)
+                        continue
+
+                    if defer_retries:
+                        self.clear_fetch_failures(subscription)
+                    if result['error'] is None:
+                        summary.successful += 1
                     else:
-                        failed += 1
+                        summary.failed += 1
+
+        return summary
+
+    async def process_subscription_batch_async(self, subscriptions: List[UserCalendar], defer_retries: bool = False) -> BatchSummary:
+        '''
+        Process a batch of subscriptions on the worker event loop.
+
+        Up to max_concurrency fetches are in flight at once on a single thread, over
+        one HTTP client kept across batches so connections and TLS sessions are reused.
+        Fetched content is handed to a pool of max_workers threads for the
+        database and storage work, which bounds the number of open DB sessions.
+        A failed fetch waits out its backoff as a suspended coroutine, holding
+        neither a fetch slot nor a thread, or with defer_retries is rescheduled
+        for a later batch.
+        '''
+        logger.info(
+            f'Processing {len(subscriptions)} subscriptions asynchronously with '
+            f'{self.max_concurrency} concurrent fetches and {self.max_workers} workers'
+        )
+
+        summary = BatchSummary()
+        loop = asyncio.get_running_loop()
+        semaphore = asyncio.Semaphore(self.max_concurrency)
+
+        async def process_one(client: httpx.AsyncClient, executor: ThreadPoolExecutor, sub: UserCalendar) -> dict | None:
+            '''Returns the processing status dict, or None if the fetch was rescheduled.'''
+            start_time = time.time()
+            try:
+                url = self.calendar_service.build_calendar_url(sub)
+                headers = self.calendar_service.conditional_headers(sub)
+
+                attempt = (sub.fetch_failures or 0) + 1 if defer_retries else 1
+                while True:
+                    logger.info(f'Fetching calendar for {sub.email} (attempt {attempt})')
+                    async with semaphore:
+                        fetched = await self.calendar_service.fetch_calendar_async(client, url, headers)
+                    if fetched is not None or attempt >= self.fetch_retries:
+                        break
 
-                except Exception as e:
-                    logger.exception(f'Unhandled error processing subscription for {subscription.email}: {e}')
-                    failed += 1
+                    delay = self.retry_delay(attempt)
+                    summary.record_retry(delay)
+                    if defer_retries:
+                        await loop.run_in_executor(executor, self.defer_retry, sub, attempt, delay)
+                        return None
+                    logger.info(f'Fetch failed for {sub.email}, retrying in {delay} seconds.')
+                    await asyncio.sleep(delay)
+                    attempt += 1
 
-            logger.info(f'Batch processing complete: {successful} successful, {failed} failed')
+                if defer_retries:
+                    await loop.run_in_executor(executor, self.clear_fetch_failures, sub)
+                result = await loop.run_in_executor(
+                    executor, self.calendar_service.process_fetched_calendar, sub, fetched
+                )
+                self.record_result(result, time.time() - start_time)
+                return result
+            except Exception as e:
+                self.record_subscription_processed('error')
+                self.record_calendar_fetch('error', time.time() - start_time)
+                logger.exception(f'Error processing subscription {sub.email}: {e}')
+                return {'error': 'UNDOCUMENTED_ERROR'}
+
+        client = self._get_async_client()
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            results = await asyncio.gather(*(process_one(client, executor, sub) for sub in subscriptions))
+
+        results = [result for result in results if result is not None]
+        summary.successful = sum(1 for result in results if result['error'] is None)
+        summary.failed = len(results) - summary.successful
+        return summary
 
     def run_single_cycle(self) -> bool:
         '''Run a single processing cycle'''
@@ -134,9 +454,9 @@ class WorkerService:
             logger.info(f'Found {len(subscriptions)} subscriptions')
 
             # Process subscriptions in parallel
-            self.process_subscription_batch(subscriptions)
+            summary = self.process_subscription_batch(subscriptions)
 
-            self.record_cycle_complete(cycle_start, 'success', len(subscriptions))
+            self.record_cycle_complete(cycle_start, 'success', len(subscriptions), summary)
             logger.info('Processing cycle complete')
             return True
         
@@ -148,8 +468,90 @@ class WorkerService:
         finally:
             self.last_cycle = datetime.now()
     
+    def initial_check_time(self, subscription: UserCalendar) -> datetime:
+        '''Random due time within the next interval, used to spread unscheduled subscriptions evenly.'''
+        return _now() + timedelta(seconds=random.uniform(0, self.worker_interval))
+
+    def seconds_until_next_due(self) -> float:
+        '''Time to sleep before the next subscription is due, capped at max_sleep.'''
+        next_due = get_next_due_time_no_session()
+        if next_due is None:
+            return self.max_sleep
+        return min(self.max_sleep, max(1.0, (next_due - _now()).total_seconds()))
+
+    def run_scheduled_batch(self) -> int:
+        '''Claim and process subscriptions that are currently due. Returns how many were claimed.'''
+        batch_start = time.time()
+
+        subscriptions = claim_due_subscriptions_no_session(_now(), self.batch_size, self.polling_policy.next_check_time)
+        if not subscriptions:
+            return 0
+
+        logger.info(f'Claimed {len(subscriptions)} due subscriptions')
+        # A failed fetch becomes due again after its backoff, the batch does not wait for it
+        summary = self.process_subscription_batch(subscriptions, defer_retries=True)
+        self.record_batch_complete(batch_start, 'success', len(subscriptions), summary)
+        self.last_cycle = datetime.now()
+        return len(subscriptions)
+
+    def run_scheduled(self) -> None:
+        '''
+        Run the worker with due-time scheduling.
+
+        Each subscription carries its own persisted next_check_at, set by the
+        polling policy when it is claimed and again once it is processed. The worker keeps
+        pulling small batches of due subscriptions and sleeps until the next one is
+        due, so polling is spread over the interval instead of happening all at once,
+        and a restart only picks up what is actually due.
+        '''
+        logger.info(f'Worker started with due-time scheduling over a {self.worker_interval}-second interval')
+        self._running = True
+
+        scheduled = schedule_unscheduled_subscriptions_no_session(self.initial_check_time)
+        if scheduled:
+            logger.info(f'Spread {scheduled} unscheduled subscriptions over the next {self.worker_interval} seconds')
+
+        while not self._terminate.is_set():
+            try:
+                # A full batch means more subscriptions may already be due
+                if self.run_scheduled_batch() >= self.batch_size:
+                    continue
+                self._terminate.wait(self.seconds_until_next_due())
+
+            except KeyboardInterrupt:
+                logger.info('Worker shutdown requested (KeyboardInterrupt). Exiting.')
+                break
+            except Exception as e:
+                logger.exception(f'Unexpected error in worker loop: {e}')
+                self.record_batch_complete(time.time(), 'critical_error', 0)
+                logger.info(f'Sleeping for {self.max_sleep} seconds before retry')
+                self._terminate.wait(self.max_sleep)
+
+        self._running = False
+        self.close()
+
+    def warm_previous_calendars(self) -> int:
+        '''
+        Load the stored previous calendars of active subscriptions into the storage cache,
+        those due soonest first. Returns the number of subscriptions loaded.
+        '''
+        try:
+            subscriptions = [sub for sub in get_active_subscriptions_no_session() if sub.previous_calendar_path and sub.stored_hash]
+            subscriptions.sort(key=lambda sub: sub.next_check_at or datetime.min)
+            return self.calendar_service.storage_manager.warm_cache({sub.email: sub.stored_hash for sub in subscriptions})
+        except Exception as e:
+            logger.exception(f'Error warming the storage cache: {e}')
+            return 0
+
     def run_continuously(self) -> None:
         '''Run the worker in continuous mode.'''
+        if self.warm_storage_cache:
+            self.warm_previous_calendars()
+
+        if self.schedule_mode == 'due':
+            self.run_scheduled()
+            return
+
         logger.info(f'Worker started with a {self.worker_interval}-second interval')
 
         while True:
@@ -173,6 +575,7 @@ class WorkerService:
             except KeyboardInterrupt:
                 logger.info('Worker shutdown requested (KeyboardInterrupt). Exiting.')
                 self._running = False
+                self.close()
                 break
             except Exception as e:
                 logger.exception(f'Unexpected error in worker loop: {e}')
@@ -27,6 +27,7 @@ const translations = {
             SUBSCRIPTION_ALREADY_ACTIVE: 'Subscription already activated.',
             INVALID_CALENDAR_URL: 'Invalid calendar URL.',
             INVALID_ICAL_DOCUMENT: 'Invalid iCal document at the URL.',
+            CALENDAR_HOST_BUSY: 'The calendar server is busy. Try again in a few minutes.',
             NOTIFICATIONS_ALREADY_PAUSED: 'Notifications are already paused.',
             NOTIFICATIONS_ALREADY_ACTIVE: 'Notifications are already active.',
             RATE_LIMIT_EXCEEDED: 'Too many requests. Try again in {retry_after_minutes} minutes.',
@@ -132,6 +133,7 @@ const translations = {
             SUBSCRIPTION_ALREADY_ACTIVE: 'Pretplata već aktivirana.',
             INVALID_CALENDAR_URL: 'Nevažeći URL kalendara.',
             INVALID_ICAL_DOCUMENT: 'Na URL-u nije valjan iCal dokument.',
+            CALENDAR_HOST_BUSY: 'Poslužitelj kalendara je zauzet. Pokušaj ponovno za nekoliko minuta.',
             NOTIFICATIONS_ALREADY_PAUSED: 'Obavijesti su već pauzirane.',
             NOTIFICATIONS_ALREADY_ACTIVE: 'Obavijesti su već aktivne.',
             RATE_LIMIT_EXCEEDED: 'Previše zahtjeva. Pokušaj ponovno za {retry_after_minutes} minuta.',